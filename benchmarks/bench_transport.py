@@ -0,0 +1,88 @@
+"""Benchmark writing bursts of diagnostics notifications to the client.
+
+Usage: python benchmarks/bench_transport.py [--messages N] [--diagnostics N]
+
+Compares the writer with each installed JSON codec, with and without
+coalescing, against writing and flushing every message separately with the
+stdlib json module, which is what pyls_jsonrpc.streams.JsonRpcStreamWriter
+does.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from mypyls import streams  # noqa: E402
+
+
+def diagnostics_message(i, diagnostics_per_file):
+    return {
+        'jsonrpc': '2.0',
+        'method': 'textDocument/publishDiagnostics',
+        'params': {
+            'uri': 'file:///home/user/project/package/module_%d.py' % i,
+            'diagnostics': [{
+                'source': 'mypy',
+                'range': {
+                    'start': {'line': line, 'character': 4},
+                    'end': {'line': line, 'character': 4}
+                },
+                'message': 'Argument 1 to "f" has incompatible type "str"; expected "int"',
+                'severity': 1
+            } for line in range(diagnostics_per_file)]
+        }
+    }
+
+
+def write_separately(wfile, messages):
+    # Equivalent to pyls_jsonrpc.streams.JsonRpcStreamWriter.write.
+    for message in messages:
+        body = json.dumps(message)
+        response = (
+            "Content-Length: {}\r\n"
+            "Content-Type: application/vscode-jsonrpc; charset=utf8\r\n\r\n"
+            "{}".format(len(body.encode('utf-8')), body)
+        )
+        wfile.write(response.encode('utf-8'))
+        wfile.flush()
+
+
+def write_messages(wfile, messages, codec, coalesce):
+    writer = streams.JsonRpcStreamWriter(wfile, codec, coalesce)
+    for message in messages:
+        writer.write(message)
+    writer.close()
+
+
+def measure(name, write, messages):
+    # Unbuffered, so that every write is a system call like on a pipe to the client.
+    with open(os.devnull, 'wb', buffering=0) as wfile:
+        start = time.perf_counter()
+        write(wfile, messages)
+        elapsed = time.perf_counter() - start
+    print('%-24s %10.0f messages/s' % (name, len(messages) / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--diagnostics', type=int, default=10, help='Diagnostics per message')
+    args = parser.parse_args()
+
+    messages = [diagnostics_message(i, args.diagnostics) for i in range(args.messages)]
+    print('%d publishDiagnostics messages with %d diagnostics each' % (args.messages, args.diagnostics))
+    measure('separate writes (json)', write_separately, messages)
+    for codec_name in streams.CODECS:
+        codec = streams.get_codec(codec_name)
+        if codec.name != codec_name:
+            continue
+        for coalesce in (False, True):
+            measure('%s (%s)' % ('coalesced' if coalesce else 'direct', codec_name),
+                    lambda wfile, messages: write_messages(wfile, messages, codec, coalesce), messages)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""Benchmark path <-> URI conversion, as done for every published diagnostic.
+
+Usage: python benchmarks/bench_uris.py [--files N] [--rounds N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from mypyls import uris  # noqa: E402
+
+
+def run(paths, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for path in paths:
+            uris.to_fs_path(uris.from_fs_path(path))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    paths = ['/home/user/my project/package_%d/module %d.py' % (i // 100, i) for i in range(args.files)]
+    conversions = 2 * args.files * args.rounds
+
+    cached = run(paths, args.rounds)
+    uncached_to_fs_path = uris.to_fs_path.__wrapped__
+    uncached_from_fs_path = uris.from_fs_path.__wrapped__
+    uris.to_fs_path, uris.from_fs_path = uncached_to_fs_path, uncached_from_fs_path
+    uris.urlparse = uris.urlparse.__wrapped__
+    uncached = run(paths, args.rounds)
+
+    print('%d files, %d rounds' % (args.files, args.rounds))
+    print('%-10s %12.0f conversions/s' % ('uncached', conversions / uncached))
+    print('%-10s %12.0f conversions/s' % ('cached', conversions / cached))
+
+
+if __name__ == '__main__':
+    main()
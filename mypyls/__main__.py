@@ -5,7 +5,9 @@ import logging
 import logging.config
 import logging.handlers
 import sys
+from .logs import TruncatingFormatter, parse_log_levels, queue_configured_handlers, set_log_levels, start_queue_logging
 from .python_ls import start_io_lang_server, start_tcp_lang_server, PythonLanguageServer
+from .streams import CODECS
 from contextlib import redirect_stdout
 import os
 from typing import cast, BinaryIO
@@ -35,6 +37,12 @@ def add_arguments(parser):
         "Note that this may not work on a Windows machine."
     )
 
+    parser.add_argument(
+        '--json-codec', choices=('auto',) + CODECS, default='auto',
+        help="JSON library used to encode and decode messages. "
+        "'auto' uses the fastest one installed."
+    )
+
     log_group = parser.add_mutually_exclusive_group()
     log_group.add_argument(
         "--log-config",
@@ -50,20 +58,56 @@ def add_arguments(parser):
         '-v', '--verbose', action='count', default=0,
         help="Increase verbosity of log output, overrides log config file"
     )
+    parser.add_argument(
+        '--log-levels', type=parse_log_levels, default={},
+        help="Comma-separated log levels of individual loggers, overriding --verbose for them, "
+        "e.g. 'mypyls.mypy_server=DEBUG,mypyls.streams=WARNING'"
+    )
+
+    subparsers = parser.add_subparsers(dest='command')
+    check_parser = subparsers.add_parser(
+        'check',
+        help="Check a tree once and print diagnostics as JSON lines, writing the mypy cache "
+        "that the language server loads on startup."
+    )
+    check_parser.add_argument(
+        'root', nargs='?', default='.',
+        help="Root of the tree to check (default: current directory)"
+    )
+    check_parser.add_argument(
+        '--config-file',
+        help="Mypy config file (default: mypy's default locations)"
+    )
+    check_parser.add_argument(
+        '--target', action='append', dest='targets',
+        help="File or directory to check, relative to the root. May be repeated (default: the root)"
+    )
+    check_parser.add_argument(
+        '--python-executable',
+        help="Python interpreter whose installed packages are used"
+    )
+    check_parser.add_argument(
+        '--shared-cache', action='store_true',
+        help="Reuse and publish analyzed library modules in the machine-wide cache (~/.cache/mypyls)"
+    )
 
 
 def main():
     parser = argparse.ArgumentParser()
     add_arguments(parser)
     args = parser.parse_args()
-    _configure_logger(args.verbose, args.log_config, args.log_file)
+    _configure_logger(args.verbose, args.log_config, args.log_file, args.log_levels)
+
+    if args.command == 'check':
+        from .check import check
+        sys.exit(check(args.root, args.config_file, args.targets, args.python_executable, args.shared_cache))
 
     if args.tcp:
-        start_tcp_lang_server(args.host, args.port, PythonLanguageServer)
+        start_tcp_lang_server(args.host, args.port, PythonLanguageServer, args.json_codec)
     else:
         stdin, stdout = _binary_stdio()
         with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
-            start_io_lang_server(stdin, stdout, args.check_parent_process, PythonLanguageServer)
+            start_io_lang_server(stdin, stdout, args.check_parent_process, PythonLanguageServer, args.json_codec)
 
 
 def _binary_stdio():
@@ -91,14 +135,16 @@ def _binary_stdio():
     return stdin, stdout
 
 
-def _configure_logger(verbose=0, log_config=None, log_file=None):
+def _configure_logger(verbose=0, log_config=None, log_file=None, log_levels=None):
     root_logger = logging.root
 
     if log_config:
         with open(log_config, 'r') as f:
             logging.config.dictConfig(json.load(f))
+        # Written by background threads, like the handlers configured below.
+        queue_configured_handlers()
     else:
-        formatter = logging.Formatter(LOG_FORMAT)
+        formatter = TruncatingFormatter(LOG_FORMAT)
         if log_file:
             log_handler = logging.handlers.RotatingFileHandler(
                 log_file, mode='a', maxBytes=50*1024*1024,
@@ -107,7 +153,8 @@ def _configure_logger(verbose=0, log_config=None, log_file=None):
         else:
             log_handler = logging.StreamHandler()
         log_handler.setFormatter(formatter)
-        root_logger.addHandler(log_handler)
+        # Written by a background thread, so that logging never blocks requests.
+        start_queue_logging([log_handler], root_logger)
 
     if verbose == 0:
         level = logging.WARNING
@@ -117,6 +164,7 @@ def _configure_logger(verbose=0, log_config=None, log_file=None):
         level = logging.DEBUG
 
     root_logger.setLevel(level)
+    set_log_levels(log_levels or {})
 
 
 if __name__ == '__main__':
@@ -58,3 +58,12 @@ def is_process_alive(pid):
         return False
     else:
         return True
+
+
+def rss_bytes():
+    """Return the resident set size of this process, or None if it's unknown (e.g. not on Linux)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
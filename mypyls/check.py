@@ -0,0 +1,85 @@
+"""Batch checking from the command line, e.g. in CI.
+
+Runs the same configuration resolution and check pipeline as the language
+server, and writes the diagnostics of each file as a JSON line shaped like
+the params of textDocument/publishDiagnostics. The check writes mypy's
+fine-grained cache, so editors opening the same tree afterwards start from it.
+"""
+import json
+import logging
+import os
+import sys
+from concurrent import futures
+from typing import Dict, List, Optional, TextIO
+
+from . import uris, mypy_server
+from .config import Config
+from .workspace import Workspace, unanswered_request
+
+log = logging.getLogger(__name__)
+
+
+class JsonLinesEndpoint(object):
+    """Stands in for the JSON RPC endpoint, writing published diagnostics as JSON lines."""
+
+    def __init__(self, output: TextIO) -> None:
+        self._output = output
+
+    def notify(self, method: str, params=None) -> None:
+        if method == Workspace.M_PUBLISH_DIAGNOSTICS:
+            self._output.write(json.dumps(params) + '\n')
+        elif method == Workspace.M_SHOW_MESSAGE:
+            sys.stderr.write(params['message'] + '\n')
+
+    def request(self, method: str, params=None) -> futures.Future:
+        log.info(f'Not sending {method} request when running from the command line')
+        return unanswered_request(method)
+
+
+def check(root: str, config_file: Optional[str] = None, targets: Optional[List[str]] = None,
+          python_executable: Optional[str] = None, shared_cache: bool = False,
+          output: TextIO = sys.stdout) -> int:
+    """Check the tree at root, returning an exit status like mypy's.
+
+    The status is 0 if there were no errors, 1 if there were errors and 2 if
+    mypy could not check the tree. mypy runs in root, like in the language
+    server, since it finds the config file and reports paths relative to the
+    current directory.
+    """
+    root = os.path.abspath(root)
+    if config_file:
+        config_file = os.path.abspath(config_file)
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        return check_in_root(root, config_file, targets, python_executable, shared_cache, output)
+    finally:
+        os.chdir(cwd)
+
+
+def check_in_root(root: str, config_file: Optional[str], targets: Optional[List[str]],
+                  python_executable: Optional[str], shared_cache: bool, output: TextIO) -> int:
+    root_uri = uris.from_fs_path(root)
+    workspace = Workspace(root_uri, JsonLinesEndpoint(output))
+    config = Config(root_uri, {}, None, {})
+    settings = {
+        'configFile': config_file,
+        'targets': targets,
+        'sharedCache': shared_cache,
+    } # type: Dict[str, object]
+    config.update(settings)
+
+    session = mypy_server.attach_session(workspace)
+    try:
+        session.settings = config.settings()
+        options = mypy_server.load_options(session, python_executable)
+        session.python_executable = python_executable
+        server = session.mypy_server = mypy_server.BatchServer(
+            options, session.root_path, mypy_server.use_shared_cache(session))
+        mypy_server.mypy_check(workspace, config)
+    finally:
+        mypy_server.detach_session(workspace)
+    if server.status is None:
+        # mypy crashed, the error was logged.
+        return 2
+    return server.status
@@ -0,0 +1,148 @@
+"""Compact storage of the diagnostics of the last check.
+
+The diagnostics of each file are kept as parallel arrays of positions,
+severities and ids of interned message and error code strings. LSP
+diagnostic dicts are only built when they are published or pulled. A store
+is never modified after it's built, so it can be read without waiting for
+a running check, which builds a new one.
+"""
+import os
+import re
+from array import array
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import lsp, uris
+
+# Error codes are appended to messages with show_error_codes.
+RE_ERROR_CODE = re.compile(r'  \[([a-z][\w-]*)\]$')
+
+NO_CODE = -1
+
+# (line, column, severity, code, message) of a diagnostic. Lines and columns are 0-based.
+Entry = Tuple[int, int, int, Optional[str], str]
+
+
+class FileDiagnostics(object):
+    __slots__ = ('lines', 'columns', 'severities', 'codes', 'messages')
+
+    def __init__(self) -> None:
+        self.lines = array('l')
+        self.columns = array('l')
+        self.severities = array('b')
+        self.codes = array('l')
+        self.messages = array('l')
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+
+class DiagnosticsStore(object):
+    def __init__(self, root_path: Optional[str] = None) -> None:
+        self.root_path = root_path
+        self._files = {} # type: Dict[str, FileDiagnostics]
+        self._strings = [] # type: List[str]
+        self._string_ids = {} # type: Dict[str, int]
+
+    def _intern(self, string: str) -> int:
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            string_id = self._string_ids[string] = len(self._strings)
+            self._strings.append(string)
+        return string_id
+
+    def add(self, uri: str, line: int, column: int, severity: int, message: str) -> None:
+        """Add a diagnostic while building the store."""
+        match = RE_ERROR_CODE.search(message)
+        file = self._files.get(uri)
+        if file is None:
+            file = self._files[uri] = FileDiagnostics()
+        file.lines.append(line)
+        file.columns.append(column)
+        file.severities.append(severity)
+        file.codes.append(self._intern(match.group(1)) if match else NO_CODE)
+        file.messages.append(self._intern(message))
+
+    def uris(self) -> List[str]:
+        return list(self._files)
+
+    def __contains__(self, uri: str) -> bool:
+        return uri in self._files
+
+    def entries(self, uri: str) -> List[Entry]:
+        file = self._files.get(uri)
+        if file is None:
+            return []
+        strings = self._strings
+        return [(file.lines[i], file.columns[i], file.severities[i],
+                 strings[file.codes[i]] if file.codes[i] != NO_CODE else None, strings[file.messages[i]])
+                for i in range(len(file))]
+
+    def lsp_diagnostics(self, uri: str) -> List[dict]:
+        """Return the diagnostics of a file, as LSP Diagnostic dicts."""
+        result = []
+        for line, column, severity, code, message in self.entries(uri):
+            position = {'line': line, 'character': column}
+            diagnostic = {
+                'source': 'mypy',
+                # There may be a better solution, but mypy does not provide end
+                'range': {'start': position, 'end': dict(position)},
+                'message': message,
+                'severity': severity
+            }
+            if code is not None:
+                diagnostic['code'] = code
+            result.append(diagnostic)
+        return result
+
+    def summary(self, directory: Optional[str] = None) -> dict:
+        """Count the diagnostics by severity, error code and directory.
+
+        A directory's counts include its subdirectories. Directories are
+        relative to the root, and only files in directory (a path) are counted
+        if it's given.
+        """
+        prefix = os.path.normcase(os.path.abspath(directory)) + os.sep if directory else None
+        total = new_counts()
+        by_code = defaultdict(int) # type: Dict[str, int]
+        by_directory = defaultdict(new_counts) # type: Dict[str, Dict[str, int]]
+        for uri, file in self._files.items():
+            path = uris.to_fs_path(uri)
+            if prefix is not None and not os.path.normcase(os.path.abspath(path)).startswith(prefix):
+                continue
+            counts = new_counts()
+            for i in range(len(file)):
+                counts[severity_name(file.severities[i])] += 1
+                if file.codes[i] != NO_CODE:
+                    by_code[self._strings[file.codes[i]]] += 1
+            counts['files'] = 1
+            add_counts(total, counts)
+            for parent in self._directories(path):
+                add_counts(by_directory[parent], counts)
+        return {'total': total, 'byCode': dict(by_code), 'byDirectory': dict(by_directory)}
+
+    def _directories(self, path: str) -> Iterable[str]:
+        directory = os.path.dirname(path)
+        if self.root_path is not None:
+            directory = os.path.relpath(directory, self.root_path)
+            if directory.startswith(os.pardir):
+                # Outside the root.
+                yield directory.replace(os.sep, '/')
+                return
+        parts = [] if directory in ('', os.curdir) else directory.split(os.sep)
+        yield '.'
+        for i in range(1, len(parts) + 1):
+            yield '/'.join(parts[:i])
+
+
+def new_counts() -> Dict[str, int]:
+    return {'errors': 0, 'notes': 0, 'files': 0}
+
+
+def add_counts(total: Dict[str, int], counts: Dict[str, int]) -> None:
+    for key, value in counts.items():
+        total[key] += value
+
+
+def severity_name(severity: int) -> str:
+    return 'errors' if severity == lsp.DiagnosticSeverity.Error else 'notes'
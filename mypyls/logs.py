@@ -0,0 +1,162 @@
+"""Logging off the request threads.
+
+Log records are put on a queue and formatted and written by a background
+thread, so slow handlers (files, stderr pipes) never block request handling
+or checks. Messages are only formatted there: mutable arguments are replaced
+by bounded snapshots, and long string arguments are truncated, before the
+record is queued. Messages are truncated to a maximum length too, so large
+payloads (such as mypy's output on a big tree) cost little on the hot path
+and don't flood the log.
+"""
+import atexit
+import copy
+import logging
+import logging.handlers
+import queue
+import reprlib
+from typing import Any, Dict, List, cast
+
+MAX_MESSAGE_LENGTH = 20000
+
+# Types of message arguments that can't change before the listener thread formats the message.
+IMMUTABLE_TYPES = (str, bytes, int, float, bool, type(None))
+# Containers whose str() is their repr(), which reprlib renders up to a bounded size.
+CONTAINER_TYPES = (dict, list, tuple, set, frozenset)
+
+_snapshot_repr = reprlib.Repr()
+_snapshot_repr.maxlevel = 4
+_snapshot_repr.maxdict = _snapshot_repr.maxlist = _snapshot_repr.maxtuple = 100
+_snapshot_repr.maxset = _snapshot_repr.maxfrozenset = 100
+_snapshot_repr.maxstring = _snapshot_repr.maxother = 1000
+
+
+class TruncatingFormatter(logging.Formatter):
+    def __init__(self, fmt=None, datefmt=None, max_message_length: int = MAX_MESSAGE_LENGTH) -> None:
+        super().__init__(fmt, datefmt)
+        self.max_message_length = max_message_length
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        message = record.message
+        if len(message) > self.max_message_length:
+            # Other handlers format the same record, with their own limits.
+            record = logging.makeLogRecord(record.__dict__)
+            record.message = truncate(message, self.max_message_length)
+        return super().formatMessage(record)
+
+
+class Snapshot(object):
+    """The text of a mutable message argument when it was logged, formatted with %s or %r later."""
+
+    def __init__(self, value: Any) -> None:
+        if isinstance(value, CONTAINER_TYPES):
+            self._str = self._repr = _snapshot_repr.repr(value)
+        else:
+            self._str = truncate(str(value), MAX_MESSAGE_LENGTH)
+            self._repr = truncate(repr(value), MAX_MESSAGE_LENGTH)
+
+    def __str__(self) -> str:
+        return self._str
+
+    def __repr__(self) -> str:
+        return self._repr
+
+
+def truncate(text: str, max_length: int) -> str:
+    if len(text) > max_length:
+        return f'{text[:max_length]}... [{len(text) - max_length} characters truncated]'
+    return text
+
+
+def snapshot(arg: Any) -> Any:
+    if isinstance(arg, str):
+        return truncate(arg, MAX_MESSAGE_LENGTH)
+    if isinstance(arg, IMMUTABLE_TYPES):
+        return arg
+    return Snapshot(arg)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that leaves formatting the message to the listener thread.
+
+    Mutable arguments (such as a dict of params that's modified later) are
+    replaced by bounded snapshots of their text, and long strings are
+    truncated, so the record is cheap to queue and formats the same later.
+    The queue is in-process, so records don't need to be made picklable.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Other handlers of the logger may still format the original record.
+        record = copy.copy(record)
+        if not isinstance(record.msg, str):
+            record.msg = str(snapshot(record.msg))
+        args = record.args
+        if isinstance(args, dict):
+            # The arguments of a message with named placeholders, or a single dict argument.
+            record.args = {key: snapshot(value) for key, value in args.items()}
+        elif args:
+            record.args = tuple(snapshot(arg) for arg in args)
+        return record
+
+
+def start_queue_logging(handlers: List[logging.Handler], logger: logging.Logger = logging.root) -> None:
+    """Send the records of logger to handlers through a queue, serviced by a background thread."""
+    log_queue = queue.Queue() # type: queue.Queue
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    listener.start()
+    # Flush the remaining records at exit.
+    atexit.register(listener.stop)
+
+
+def queue_configured_handlers() -> None:
+    """Move the handlers configured on loggers (e.g. by logging.config.dictConfig) behind queues."""
+    loggers = [logging.root] # type: List[logging.Logger]
+    for logger in loggers + list(named_loggers().values()):
+        handlers = logger.handlers[:]
+        if not handlers:
+            continue
+        for handler in handlers:
+            logger.removeHandler(handler)
+        start_queue_logging(handlers, logger)
+
+
+def start_worker_logging(log_level: int, log_levels: Dict[str, int]) -> None:
+    """Log to stderr in a worker process, with the levels of the language server."""
+    from .__main__ import LOG_FORMAT
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(TruncatingFormatter(LOG_FORMAT))
+    start_queue_logging([log_handler])
+    logging.root.setLevel(log_level)
+    set_log_levels(log_levels)
+
+
+def parse_log_levels(spec: str) -> Dict[str, int]:
+    """Parse per-logger levels, such as 'mypyls.mypy_server=DEBUG,mypyls.streams=WARNING'."""
+    levels = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, sep, level = item.partition('=')
+        if not sep or not name.strip():
+            raise ValueError(f'Expected LOGGER=LEVEL, got {item!r}')
+        level_number = logging.getLevelName(level.strip().upper())
+        if not isinstance(level_number, int):
+            raise ValueError(f'Unknown log level {level!r}')
+        levels[name.strip()] = level_number
+    return levels
+
+
+def set_log_levels(levels: Dict[str, int]) -> None:
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+
+def configured_log_levels() -> Dict[str, int]:
+    """Return the levels set on individual loggers, to apply them in worker processes."""
+    return {name: logger.level for name, logger in named_loggers().items() if logger.level != logging.NOTSET}
+
+
+def named_loggers() -> Dict[str, logging.Logger]:
+    # The logger registry isn't in the type stubs.
+    logger_dict = cast(Any, logging.root).manager.loggerDict
+    return {name: logger for name, logger in logger_dict.items() if isinstance(logger, logging.Logger)}
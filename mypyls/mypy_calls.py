@@ -0,0 +1,293 @@
+import logging
+from array import array
+from collections import namedtuple, OrderedDict
+from mypy.nodes import (
+    Node, MypyFile, ClassDef, FuncDef, OverloadedFuncDef, Decorator, TypeInfo, CallExpr, NameExpr,
+    MemberExpr, Expression, FuncBase, FUNC_NO_INFO
+)
+from mypy.types import Type
+from mypy.traverser import TraverserVisitor
+from typing import Dict, List, Optional, Set
+
+from . import lsp, uris, mypy_utils, mypy_definition
+from .mypy_index import ModuleIndex
+from .mypy_references import reference_key
+
+log = logging.getLogger(__name__)
+
+# The interned keys are compacted once this many were dropped with the modules using them, and
+# at least as many as are still in use.
+MIN_DROPPED_KEYS = 10000
+
+# A function, method, class (called to construct instances) or module (calling at the top level).
+# Lines are 1-based, columns 0-based.
+Definition = namedtuple('Definition', ['module_id', 'name', 'kind', 'line', 'column'])
+
+
+def prepare_call_hierarchy(workspace, document, position):
+    fgmanager = workspace.mypy_server.fine_grained_manager
+    if not fgmanager or workspace.indexes is None:
+        return None
+    # Columns are zero based in the AST, but rows are 1-based.
+    def_node, mypy_file = mypy_definition.find_definition_node(
+        fgmanager, document.path, position['line'] + 1, position['character'], workspace.indexes)
+    if not isinstance(def_node, (FuncBase, Decorator, ClassDef, TypeInfo)):
+        return None
+    if isinstance(def_node, Decorator):
+        def_node = def_node.func
+    key = reference_key(def_node, mypy_file.fullname())
+    calls = workspace.indexes.calls
+    node_id = calls.node_id(key) if key is not None else None
+    if node_id is None:
+        return None
+    item = calls.item(node_id)
+    return [item] if item is not None else None
+
+
+def incoming_calls(workspace, item):
+    calls = workspace.indexes.calls if workspace.indexes is not None else None
+    node_id = calls.node_id(item['data']['key']) if calls is not None else None
+    if node_id is None:
+        return None
+    result = []
+    for caller, ranges in calls.callers(node_id).items():
+        caller_item = calls.item(caller)
+        if caller_item is not None:
+            result.append({'from': caller_item, 'fromRanges': ranges})
+    return result
+
+
+def outgoing_calls(workspace, item):
+    calls = workspace.indexes.calls if workspace.indexes is not None else None
+    node_id = calls.node_id(item['data']['key']) if calls is not None else None
+    if node_id is None:
+        return None
+    result = []
+    for callee, ranges in calls.callees(node_id).items():
+        callee_item = calls.item(callee)
+        if callee_item is not None:
+            result.append({'to': callee_item, 'fromRanges': ranges})
+    return result
+
+
+class ModuleCalls(object):
+    """The calls in one module, as parallel arrays with one entry per call."""
+
+    def __init__(self) -> None:
+        self.callers = array('l')
+        self.callees = array('l')
+        self.lines = array('l')
+        self.columns = array('l')
+        self.end_columns = array('l')
+
+    def add(self, caller: int, callee: int, line: int, column: int, end_column: int) -> None:
+        self.callers.append(caller)
+        self.callees.append(callee)
+        self.lines.append(line)
+        self.columns.append(column)
+        self.end_columns.append(end_column)
+
+    def range(self, i: int) -> dict:
+        return {
+            'start': {'line': self.lines[i] - 1, 'character': self.columns[i]},
+            'end': {'line': self.lines[i] - 1, 'character': self.end_columns[i]}
+        }
+
+
+class CallGraph(ModuleIndex):
+    """Calls between functions in all analyzed modules, resolved from the targets of call expressions.
+
+    Functions are identified by integer ids, interned from their reference
+    keys (see mypy_references.reference_key). Calls are stored by the module
+    they appear in, which is also the module defining the caller. Ids are
+    only valid until the next update, since updates may renumber them.
+    """
+
+    def __init__(self) -> None:
+        self._ids = {} # type: Dict[str, int]
+        self._keys = [] # type: List[str]
+        self._definitions = {} # type: Dict[int, Definition]
+        self._defined = {} # type: Dict[str, List[int]]
+        self._calls = {} # type: Dict[str, ModuleCalls]
+        # Modules with calls to each function.
+        self._calling_modules = {} # type: Dict[int, Set[str]]
+        self._paths = {} # type: Dict[str, str]
+        # Definitions and calls dropped since the keys were last compacted, an upper bound
+        # on the number of keys no longer in use.
+        self._dropped = 0
+
+    def intern(self, key: str) -> int:
+        node_id = self._ids.get(key)
+        if node_id is None:
+            node_id = self._ids[key] = len(self._keys)
+            self._keys.append(key)
+        return node_id
+
+    def node_id(self, key: str) -> Optional[int]:
+        return self._ids.get(key)
+
+    def update_module(self, module_id: str, state, manager) -> None:
+        self.remove_module(module_id)
+        if state.path is None:
+            return
+        collector = CallCollector(self, module_id, manager.all_types)
+        state.tree.accept(collector)
+        self._paths[module_id] = state.path
+        self._calls[module_id] = collector.calls
+        self._defined[module_id] = list(collector.definitions)
+        self._definitions.update(collector.definitions)
+        for callee in set(collector.calls.callees):
+            self._calling_modules.setdefault(callee, set()).add(module_id)
+        if self._dropped >= MIN_DROPPED_KEYS and self._dropped >= len(self._keys) - self._dropped:
+            self.compact()
+
+    def remove_module(self, module_id: str) -> None:
+        self._paths.pop(module_id, None)
+        defined = self._defined.pop(module_id, ())
+        self._dropped += len(defined)
+        for node_id in defined:
+            definition = self._definitions.get(node_id)
+            if definition is not None and definition.module_id == module_id:
+                del self._definitions[node_id]
+        calls = self._calls.pop(module_id, None)
+        if calls is not None:
+            self._dropped += len(calls.callees)
+            for callee in set(calls.callees):
+                modules = self._calling_modules.get(callee)
+                if modules is not None:
+                    modules.discard(module_id)
+                    if not modules:
+                        del self._calling_modules[callee]
+
+    def compact(self) -> None:
+        """Drop the keys no longer used by any module, renumbering the ids of the others."""
+        live = set(self._definitions)
+        for defined in self._defined.values():
+            live.update(defined)
+        for calls in self._calls.values():
+            live.update(calls.callers)
+            live.update(calls.callees)
+        new_ids = {old_id: new_id for new_id, old_id in enumerate(sorted(live))}
+        log.info(f'Compacting call graph keys: {len(new_ids)} of {len(self._keys)} in use')
+        self._keys = [self._keys[old_id] for old_id in sorted(live)]
+        self._ids = {key: node_id for node_id, key in enumerate(self._keys)}
+        self._definitions = {new_ids[node_id]: definition for node_id, definition in self._definitions.items()}
+        self._defined = {module_id: [new_ids[node_id] for node_id in defined]
+                         for module_id, defined in self._defined.items()}
+        for calls in self._calls.values():
+            calls.callers = array('l', (new_ids[node_id] for node_id in calls.callers))
+            calls.callees = array('l', (new_ids[node_id] for node_id in calls.callees))
+        self._calling_modules = {new_ids[node_id]: modules for node_id, modules in self._calling_modules.items()}
+        self._dropped = 0
+
+    def callers(self, callee: int) -> Dict[int, List[dict]]:
+        """Return the ranges of the calls to a function, by calling function."""
+        result = OrderedDict() # type: Dict[int, List[dict]]
+        for module_id in sorted(self._calling_modules.get(callee, ())):
+            calls = self._calls[module_id]
+            for i, other in enumerate(calls.callees):
+                if other == callee:
+                    result.setdefault(calls.callers[i], []).append(calls.range(i))
+        return result
+
+    def callees(self, caller: int) -> Dict[int, List[dict]]:
+        """Return the ranges of the calls made by a function, by called function."""
+        result = OrderedDict() # type: Dict[int, List[dict]]
+        definition = self._definitions.get(caller)
+        calls = self._calls.get(definition.module_id) if definition is not None else None
+        if calls is None:
+            return result
+        for i, other in enumerate(calls.callers):
+            if other == caller:
+                result.setdefault(calls.callees[i], []).append(calls.range(i))
+        return result
+
+    def item(self, node_id: int) -> Optional[dict]:
+        """Return the CallHierarchyItem of a function."""
+        definition = self._definitions.get(node_id)
+        if definition is None:
+            return None
+        position = {'line': definition.line - 1, 'character': definition.column}
+        return {
+            'name': definition.name,
+            'kind': definition.kind,
+            'detail': definition.module_id,
+            'uri': uris.from_fs_path(self._paths[definition.module_id]),
+            'range': {'start': position, 'end': position},
+            'selectionRange': {'start': position, 'end': position},
+            'data': {'key': self._keys[node_id]},
+        }
+
+
+class CallCollector(TraverserVisitor):
+    def __init__(self, graph: CallGraph, module_id: str, typemap: Dict[Expression, Type]) -> None:
+        super().__init__()
+        self.graph = graph
+        self.module_id = module_id
+        self.typemap = typemap
+        self.calls = ModuleCalls()
+        self.definitions = {} # type: Dict[int, Definition]
+        self.scopes = [] # type: List[int]
+
+    def define(self, node: Node, name: str, kind: int) -> Optional[int]:
+        key = reference_key(node, self.module_id)
+        if key is None:
+            return None
+        node_id = self.graph.intern(key)
+        # Overload items share the name of the overload, which comes first.
+        if node_id not in self.definitions:
+            self.definitions[node_id] = Definition(
+                self.module_id, name, kind, max(node.line, 1), max(node.column, 0))
+        return node_id
+
+    def visit_scope(self, node_id: Optional[int], visit) -> None:
+        if node_id is None:
+            visit()
+            return
+        self.scopes.append(node_id)
+        try:
+            visit()
+        finally:
+            self.scopes.pop()
+
+    def visit_mypy_file(self, o: MypyFile) -> None:
+        node_id = self.define(o, o.fullname(), lsp.SymbolKind.Module)
+        self.visit_scope(node_id, lambda: super(CallCollector, self).visit_mypy_file(o))
+
+    def visit_func_def(self, o: FuncDef) -> None:
+        is_method = o.info is not None and o.info is not FUNC_NO_INFO
+        kind = lsp.SymbolKind.Method if is_method else lsp.SymbolKind.Function
+        node_id = self.define(o, o.name(), kind)
+        self.visit_scope(node_id, lambda: super(CallCollector, self).visit_func_def(o))
+
+    def visit_overloaded_func_def(self, o: OverloadedFuncDef) -> None:
+        is_method = o.info is not None and o.info is not FUNC_NO_INFO
+        self.define(o, o.name(), lsp.SymbolKind.Method if is_method else lsp.SymbolKind.Function)
+        super().visit_overloaded_func_def(o)
+
+    def visit_class_def(self, o: ClassDef) -> None:
+        # Calls in the class body are attributed to the class.
+        node_id = self.define(o, o.name, lsp.SymbolKind.Class)
+        self.visit_scope(node_id, lambda: super(CallCollector, self).visit_class_def(o))
+
+    def visit_call_expr(self, o: CallExpr) -> None:
+        super().visit_call_expr(o)
+        if not self.scopes:
+            return
+        callee = o.callee
+        target = None # type: Optional[Node]
+        if isinstance(callee, NameExpr):
+            target = callee.node
+            line, column, end_column = callee.line, callee.column, callee.column + len(callee.name)
+        elif isinstance(callee, MemberExpr) and callee.end_line is not None and callee.end_column is not None:
+            target = mypy_utils.get_definition(callee, self.typemap)
+            line, column, end_column = callee.end_line, callee.end_column - len(callee.name), callee.end_column
+        else:
+            return
+        if isinstance(target, Decorator):
+            target = target.func
+        if not isinstance(target, (FuncBase, TypeInfo)) or line < 1:
+            return
+        key = reference_key(target, self.module_id)
+        if key is not None:
+            self.calls.add(self.scopes[-1], self.graph.intern(key), line, column, end_column)
@@ -0,0 +1,272 @@
+import logging
+import re
+from collections import defaultdict
+from mypy.nodes import (
+    MypyFile, SymbolNode, SymbolTable, TypeInfo, FuncBase, FuncItem, Decorator, Var, TypeVarExpr,
+    Expression, NameExpr, RefExpr, Context, implicit_module_attrs
+)
+from mypy.traverser import TraverserVisitor
+from mypy.types import (
+    Type, Instance, TupleType, TypedDictType, LiteralType, UnionType, TypeType, CallableType
+)
+from typing import Dict, List, Optional, Set, Tuple
+
+from . import lsp, mypy_utils
+from .mypy_index import LineMap, ModuleIndex
+
+log = logging.getLogger(__name__)
+
+RE_START_WORD = re.compile('[A-Za-z_0-9]*$')
+RE_DOTTED_NAME = re.compile(r'([A-Za-z_][A-Za-z_0-9]*(?:\.[A-Za-z_][A-Za-z_0-9]*)*)\.$')
+
+
+def completions(workspace, document, position):
+    fgmanager = workspace.mypy_server.fine_grained_manager
+    if not fgmanager or workspace.indexes is None:
+        return None
+    lines = document.lines
+    if position['line'] >= len(lines):
+        return None
+    text = lines[position['line']][:position['character']]
+    prefix = RE_START_WORD.findall(text)[0]
+    before = text[:len(text) - len(prefix)]
+
+    state = mypy_utils.find_state(fgmanager, document.path, workspace.indexes)
+    if state is None or state.tree is None:
+        log.error(f'Module not analyzed by mypy: {document.path}')
+        return None
+    checked_lines = workspace.indexes.sources.lines(state)
+    if checked_lines is None:
+        log.info(f'{document.path} changed since it was checked, no completions until the next check')
+        return None
+    # Positions in the tree are in the checked source, the document may have unsaved edits since.
+    line_map = LineMap(checked_lines, lines)
+    tables = workspace.indexes.members
+
+    if before.endswith('.'):
+        # Columns are zero based in the AST, but rows are 1-based.
+        line = line_map.map(position['line'])
+        items = attribute_completions(fgmanager, tables, state.tree, before, line + 1 if line is not None else None)
+    else:
+        items = name_completions(fgmanager, tables, state.tree, line_map.map_before(position['line']) + 1)
+
+    prefix = prefix.lower()
+    return {
+        'isIncomplete': False,
+        'items': [item for item in items if item['label'].lower().startswith(prefix)]
+    }
+
+
+def attribute_completions(fgmanager, tables: 'MemberTables', tree: MypyFile, before: str,
+                          line: Optional[int]) -> List[dict]:
+    """Complete the attributes of the expression before the dot.
+
+    The line is the line in the tree, or None if the line was edited since the check.
+    """
+    typemap = fgmanager.manager.all_types
+    expr = None
+    if line is not None:
+        finder = ExpressionEndFinder(line, len(before) - 1)
+        tree.accept(finder)
+        expr = finder.node
+    if expr is not None:
+        if isinstance(expr, RefExpr) and isinstance(expr.node, (MypyFile, TypeInfo)):
+            return tables.members(expr.node)
+        typ = typemap.get(expr)
+        if typ is not None:
+            return type_completions(tables, typ)
+
+    # The expression may not have been analyzed yet (e.g. it was typed after the last save),
+    # so fall back to resolving it by name.
+    match = RE_DOTTED_NAME.search(before)
+    if match is None:
+        return []
+    names = match.group(1).split('.')
+    stnode = tree.names.get(names[0]) or builtins(fgmanager).names.get(names[0])
+    node = stnode.node if stnode else None # type: Optional[object]
+    for name in names[1:]:
+        if isinstance(node, TypeInfo):
+            member = node.get(name)
+        else:
+            member = mypy_utils.get_member(node, name)
+        node = member.node if member else None
+    if isinstance(node, Var):
+        return type_completions(tables, node.type) if node.type else []
+    if isinstance(node, (MypyFile, TypeInfo)):
+        return tables.members(node)
+    return []
+
+
+def type_completions(tables: 'MemberTables', typ: Type) -> List[dict]:
+    if isinstance(typ, TupleType):
+        typ = typ.partial_fallback
+    elif isinstance(typ, (TypedDictType, LiteralType)):
+        typ = typ.fallback
+    if isinstance(typ, TypeType):
+        typ = typ.item
+    if isinstance(typ, CallableType) and typ.is_type_obj():
+        return tables.members(typ.type_object())
+    if isinstance(typ, Instance):
+        return tables.members(typ.type)
+    if isinstance(typ, UnionType):
+        items = {} # type: Dict[str, dict]
+        for item in typ.items:
+            for completion in type_completions(tables, item):
+                items.setdefault(completion['label'], completion)
+        return list(items.values())
+    return []
+
+
+def name_completions(fgmanager, tables: 'MemberTables', tree: MypyFile, line: int) -> List[dict]:
+    finder = EnclosingFunctionFinder(line)
+    tree.accept(finder)
+    items = {} # type: Dict[str, dict]
+    if finder.function is not None:
+        for name, node in local_definitions(finder.function).items():
+            items[name] = completion_item(name, node, None)
+    for table in (tables.members(tree, public_only=False), tables.members(builtins(fgmanager))):
+        for item in table:
+            items.setdefault(item['label'], item)
+    return list(items.values())
+
+
+def local_definitions(function: FuncItem) -> Dict[str, SymbolNode]:
+    definitions = {} # type: Dict[str, SymbolNode]
+    for argument in function.arguments:
+        definitions[argument.variable.name()] = argument.variable
+
+    class LocalsCollector(TraverserVisitor):
+        def visit_name_expr(self, o: NameExpr) -> None:
+            if isinstance(o.node, Var) and '.' not in o.node.fullname():
+                definitions.setdefault(o.name, o.node)
+
+        def visit_func_def(self, o) -> None:
+            # Locals of nested functions are not visible.
+            definitions.setdefault(o.name(), o)
+
+    function.body.accept(LocalsCollector())
+    return definitions
+
+
+def builtins(fgmanager) -> MypyFile:
+    return fgmanager.manager.modules['builtins']
+
+
+def completion_item(name: str, node: Optional[SymbolNode], owner: Optional[TypeInfo]) -> dict:
+    item = {
+        'label': name,
+        'kind': completion_kind(node, owner),
+        'sortText': sort_text(name),
+    }
+    if owner is not None:
+        item['detail'] = owner.fullname()
+    return item
+
+
+def completion_kind(node: Optional[SymbolNode], owner: Optional[TypeInfo]) -> int:
+    if isinstance(node, TypeInfo):
+        return lsp.CompletionItemKind.Enum if node.is_enum else lsp.CompletionItemKind.Class
+    if isinstance(node, MypyFile):
+        return lsp.CompletionItemKind.Module
+    if isinstance(node, Decorator) and node.var.is_property:
+        return lsp.CompletionItemKind.Property
+    if isinstance(node, (FuncBase, Decorator)):
+        return lsp.CompletionItemKind.Function if owner is None else lsp.CompletionItemKind.Method
+    if isinstance(node, Var):
+        if node.is_property:
+            return lsp.CompletionItemKind.Property
+        return lsp.CompletionItemKind.Variable if owner is None else lsp.CompletionItemKind.Field
+    if isinstance(node, TypeVarExpr):
+        return lsp.CompletionItemKind.TypeParameter
+    return lsp.CompletionItemKind.Text
+
+
+def sort_text(name: str) -> str:
+    # Public names first, then private names, then dunder names.
+    if name.startswith('__') and name.endswith('__'):
+        return '2' + name
+    if name.startswith('_'):
+        return '1' + name
+    return '0' + name
+
+
+class MemberTables(ModuleIndex):
+    """Completion items for the members of classes and modules, computed on first use.
+
+    A class table is the flattened member list of its whole MRO, so it is
+    invalidated when the module of any class in the MRO is reprocessed.
+    """
+
+    def __init__(self) -> None:
+        self._tables = {} # type: Dict[Tuple[str, bool], List[dict]]
+        # Module id -> keys of the tables built from definitions in that module.
+        self._dependents = defaultdict(set) # type: Dict[str, Set[Tuple[str, bool]]]
+
+    def members(self, node, public_only: bool = True) -> List[dict]:
+        """Return the members of a class, or the (public) names of a module."""
+        key = (node.fullname(), public_only)
+        table = self._tables.get(key)
+        if table is None:
+            if isinstance(node, TypeInfo):
+                table = class_members(node)
+                modules = {base.module_name for base in node.mro}
+            else:
+                table = module_members(node, public_only)
+                modules = {node.fullname()}
+            self._tables[key] = table
+            for module_id in modules:
+                self._dependents[module_id].add(key)
+        return table
+
+    def update_module(self, module_id: str, state, manager) -> None:
+        self.remove_module(module_id)
+
+    def remove_module(self, module_id: str) -> None:
+        for key in self._dependents.pop(module_id, ()):
+            self._tables.pop(key, None)
+
+
+def class_members(info: TypeInfo) -> List[dict]:
+    items = {} # type: Dict[str, dict]
+    for base in info.mro:
+        for name, stnode in base.names.items():
+            if name not in items:
+                items[name] = completion_item(name, stnode.node, base)
+    return list(items.values())
+
+
+def module_members(module: MypyFile, public_only: bool) -> List[dict]:
+    return [completion_item(name, stnode.node, None)
+            for name, stnode in module.names.items()
+            if (stnode.module_public or not public_only) and name not in implicit_module_attrs]
+
+
+@mypy_utils.universal_visitor()
+class ExpressionEndFinder(mypy_utils.LineRangeVisitor):
+    """Find the outermost expression ending right before a (1-based line, 0-based column) position."""
+
+    node = None # type: Optional[Expression]
+
+    def __init__(self, line: int, column: int) -> None:
+        super().__init__(line, line)
+        self.line = line
+        self.column = column
+
+    def process_node(self, node: Context) -> None:
+        # Nodes are processed after their children, so outer expressions come last.
+        if (isinstance(node, Expression) and node.end_line == self.line
+                and node.end_column == self.column):
+            self.node = node
+
+
+class EnclosingFunctionFinder(mypy_utils.LineRangeVisitor):
+    function = None # type: Optional[FuncItem]
+
+    def __init__(self, line: int) -> None:
+        super().__init__(line, line)
+
+    def visit_func(self, o: FuncItem) -> None:
+        # Functions are visited outside-in, so the innermost one wins.
+        if o.line <= self.start_line and (o.end_line is None or o.end_line >= self.start_line):
+            self.function = o
+        super().visit_func(o)
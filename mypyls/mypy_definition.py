@@ -5,7 +5,8 @@ from mypy.util import short_type, correct_relative_import
 from mypy.nodes import (
     FuncDef, MypyFile, SymbolTable,
     SymbolNode, TypeInfo, Node, Expression, ReturnStmt, NameExpr, SymbolTableNode, Var,
-    AssignmentStmt, Context, RefExpr, FuncBase, MemberExpr, ImportBase, Import, ImportAll, ImportFrom
+    AssignmentStmt, Context, RefExpr, FuncBase, MemberExpr, ImportBase, Import, ImportAll, ImportFrom,
+    ClassDef
 )
 from mypy.types import (
     Type, AnyType, TypeOfAny, CallableType, UnionType, NoneTyp, Instance, is_optional,
@@ -16,6 +17,7 @@ import parser
 import symbol
 import token
 from . import mypy_utils
+from .source_cache import source_cache
 
 log = logging.getLogger(__name__)
 
@@ -23,7 +25,7 @@ def get_definitions(config, workspace, document, position):
     fgmanager = workspace.mypy_server.fine_grained_manager
     if not fgmanager:
         return []
-    definition = find_definition(fgmanager, document.path, position['line'], position['character'])
+    definition = find_definition(fgmanager, document.path, position['line'], position['character'], workspace.indexes)
     if definition is None:
         return []
     path, line, column = definition
@@ -35,21 +37,28 @@ def get_definitions(config, workspace, document, position):
         }
     }]
 
-def find_definition(fgmanager, path, line, column) -> Optional[Tuple[str, int, int]]:
+def find_definition(fgmanager, path, line, column, indexes=None) -> Optional[Tuple[str, int, int]]:
     # Columns are zero based in the AST, but rows are 1-based.
     line = line + 1
-    node, mypy_file = mypy_utils.find_name_expr(fgmanager, path, line, column)
+    def_node, mypy_file = find_definition_node(fgmanager, path, line, column, indexes)
+    if def_node is None or mypy_file is None:
+        return None
+
+    return definition_location(fgmanager, def_node, mypy_file, path)
+
+def find_definition_node(fgmanager, path, line, column, indexes=None) -> Tuple[Optional[Node], Optional[MypyFile]]:
+    # lines are 1 based, cols 0 based.
+    node, mypy_file = mypy_utils.find_name_expr(fgmanager, path, line, column, indexes)
 
     if mypy_file is None:
         log.error(f'Module not analyzed by mypy: {path}')
-        return None
+        return None, None
 
     if node is None:
         log.info('No name expression at this location')
-        return None
+        return None, mypy_file
 
-    def_node = None
-    result = ''
+    def_node = None # type: Optional[Node]
     if isinstance(node, NameExpr):
         log.info("Find definition of '%s' (%s:%s)" % (node.name, node.line, node.column + 1))
         def_node = node.node
@@ -62,13 +71,17 @@ def find_definition(fgmanager, path, line, column) -> Optional[Tuple[str, int, i
     elif isinstance(node, ImportBase):
         log.info("Find definition of import (%s:%s)" % (node.line, node.column + 1))
         def_node = get_import_definition(fgmanager.manager, node, mypy_file, line, column, path)
+    elif isinstance(node, (FuncDef, ClassDef)) and node.line == line:
+        # The name in the header of a function or class definition.
+        def_node = node
     else:
         logging.error(f'Unknown expression: {short_type(node)}')
 
     if def_node is None:
         logging.error('Definition not found')
-        return None
-    
+    return def_node, mypy_file
+
+def definition_location(fgmanager, def_node: Node, mypy_file: MypyFile, path: str) -> Tuple[str, int, int]:
     filename = mypy_utils.get_file(fgmanager.manager, def_node, mypy_file)
     if filename is None:
         log.info("Could not find file name, guessing symbol is defined in same file.")
@@ -82,8 +95,8 @@ def find_definition(fgmanager, path, line, column) -> Optional[Tuple[str, int, i
 def get_import_definition(manager, import_node: Node, mypy_file: MypyFile, line: int, column: int, path: str) -> Optional[Node]:
     # lines are 1 based, cols 0 based.
 
-    with open(path) as file:
-        code_lines: List[str] = file.readlines()
+    # Not the open document's text: positions in the tree are from the file mypy checked.
+    code_lines = source_cache.lines(path)
 
     if import_node.line == import_node.end_line:
         import_code = code_lines[import_node.line-1][import_node.column:import_node.end_column]
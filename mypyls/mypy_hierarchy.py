@@ -0,0 +1,152 @@
+import logging
+from collections import defaultdict
+from mypy.nodes import SymbolTable, SymbolNode, TypeInfo, ClassDef, FuncBase, Decorator, FUNC_NO_INFO
+from typing import Dict, List, Optional, Set
+
+from . import lsp, uris, mypy_definition
+from .mypy_index import ModuleIndex
+from .mypy_symbols import definition_location
+
+log = logging.getLogger(__name__)
+
+
+def implementations(workspace, document, position):
+    """Return the subclasses of a class, or the overrides of a method in subclasses."""
+    fgmanager = workspace.mypy_server.fine_grained_manager
+    if not fgmanager or workspace.indexes is None:
+        return []
+    # Columns are zero based in the AST, but rows are 1-based.
+    def_node, _ = mypy_definition.find_definition_node(
+        fgmanager, document.path, position['line'] + 1, position['character'], workspace.indexes)
+    subclasses = workspace.indexes.subclasses
+
+    if isinstance(def_node, ClassDef):
+        def_node = def_node.info
+    if isinstance(def_node, TypeInfo):
+        return [location(fgmanager, info) for info in subclasses.all_subclasses(def_node)]
+
+    if isinstance(def_node, Decorator):
+        def_node = def_node.func
+    if isinstance(def_node, FuncBase) and def_node.info is not None and def_node.info is not FUNC_NO_INFO:
+        name = def_node.name()
+        result = []
+        for info in subclasses.all_subclasses(def_node.info):
+            stnode = info.names.get(name)
+            if stnode is not None and stnode.node is not None and not stnode.implicit:
+                result.append(location(fgmanager, stnode.node, info.module_name))
+        return result
+    return []
+
+
+def prepare_type_hierarchy(workspace, document, position):
+    fgmanager = workspace.mypy_server.fine_grained_manager
+    if not fgmanager or workspace.indexes is None:
+        return None
+    def_node, _ = mypy_definition.find_definition_node(
+        fgmanager, document.path, position['line'] + 1, position['character'], workspace.indexes)
+    if isinstance(def_node, ClassDef):
+        def_node = def_node.info
+    if not isinstance(def_node, TypeInfo):
+        return None
+    return [type_hierarchy_item(fgmanager, def_node)]
+
+
+def supertypes(workspace, item):
+    fgmanager = workspace.mypy_server.fine_grained_manager
+    if not fgmanager or workspace.indexes is None:
+        return None
+    info = workspace.indexes.subclasses.lookup(item['data']['fullname'])
+    if info is None:
+        return None
+    return [type_hierarchy_item(fgmanager, base.type) for base in info.bases]
+
+
+def subtypes(workspace, item):
+    fgmanager = workspace.mypy_server.fine_grained_manager
+    if not fgmanager or workspace.indexes is None:
+        return None
+    subclasses = workspace.indexes.subclasses
+    info = subclasses.lookup(item['data']['fullname'])
+    if info is None:
+        return None
+    return [type_hierarchy_item(fgmanager, subclass) for subclass in subclasses.direct_subclasses(info)]
+
+
+def type_hierarchy_item(fgmanager, info: TypeInfo) -> dict:
+    item = location(fgmanager, info)
+    item.update({
+        'name': info.name(),
+        'kind': lsp.SymbolKind.Interface if info.is_protocol else lsp.SymbolKind.Class,
+        'detail': info.module_name,
+        'selectionRange': item['range'],
+        'data': {'fullname': info.fullname()},
+    })
+    return item
+
+
+def location(fgmanager, node: SymbolNode, module_id: Optional[str] = None) -> dict:
+    if module_id is None:
+        assert isinstance(node, TypeInfo)
+        module_id = node.module_name
+    state = fgmanager.graph.get(module_id)
+    path = state.path if state is not None and state.path is not None else ''
+    line, column = definition_location(node)
+    position = {'line': line - 1, 'character': column}
+    return {'uri': uris.from_fs_path(path), 'range': {'start': position, 'end': position}}
+
+
+class SubclassIndex(ModuleIndex):
+    """Map from each class to its direct subclasses (the reverse of the bases) in all analyzed modules."""
+
+    def __init__(self) -> None:
+        self._classes = {} # type: Dict[str, List[TypeInfo]]
+        self._infos = {} # type: Dict[str, TypeInfo]
+        self._subclasses = defaultdict(set) # type: Dict[str, Set[str]]
+
+    def update_module(self, module_id: str, state, manager) -> None:
+        self.remove_module(module_id)
+        classes = [] # type: List[TypeInfo]
+        collect_classes(state.tree.names, module_id, classes)
+        self._classes[module_id] = classes
+        for info in classes:
+            self._infos[info.fullname()] = info
+            for base in info.bases:
+                self._subclasses[base.type.fullname()].add(info.fullname())
+
+    def remove_module(self, module_id: str) -> None:
+        for info in self._classes.pop(module_id, []):
+            fullname = info.fullname()
+            self._infos.pop(fullname, None)
+            for base in info.bases:
+                subclasses = self._subclasses.get(base.type.fullname())
+                if subclasses is not None:
+                    subclasses.discard(fullname)
+                    if not subclasses:
+                        del self._subclasses[base.type.fullname()]
+
+    def lookup(self, fullname: str) -> Optional[TypeInfo]:
+        return self._infos.get(fullname)
+
+    def direct_subclasses(self, info: TypeInfo) -> List[TypeInfo]:
+        names = sorted(self._subclasses.get(info.fullname(), ()))
+        return [self._infos[name] for name in names if name in self._infos]
+
+    def all_subclasses(self, info: TypeInfo) -> List[TypeInfo]:
+        result = []
+        seen = {info.fullname()}
+        queue = [info]
+        while queue:
+            for subclass in self.direct_subclasses(queue.pop(0)):
+                if subclass.fullname() not in seen:
+                    seen.add(subclass.fullname())
+                    result.append(subclass)
+                    queue.append(subclass)
+        return result
+
+
+def collect_classes(names: SymbolTable, prefix: str, classes: List[TypeInfo]) -> None:
+    for name, stnode in names.items():
+        node = stnode.node
+        if isinstance(node, TypeInfo) and node.fullname() == f'{prefix}.{name}':
+            classes.append(node)
+            collect_classes(node.names, node.fullname(), classes)
@@ -1,10 +1,11 @@
 import logging
+from collections import OrderedDict
 from mypy.nodes import (
     FuncDef, MypyFile, SymbolTable,
     SymbolNode, TypeInfo, Node, Expression, ReturnStmt, NameExpr, SymbolTableNode, Var,
     AssignmentStmt, Context, RefExpr, FuncBase, MemberExpr, ImportBase
 )
-from typing import Optional, Union
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from mypy.types import (
     Type, AnyType, TypeOfAny, CallableType, UnionType, NoneTyp, Instance, is_optional,
     Overloaded,
@@ -13,18 +14,26 @@ from mypy.util import short_type
 from .mypy_definition import get_import_definition
 from mypy.server.update import FineGrainedBuildManager
 from . import mypy_utils
+from .mypy_index import ModuleIndex
 import re
 
 log = logging.getLogger(__name__)
 
+# Longer type strings are truncated, so that a huge type doesn't produce megabytes of markdown.
+MAX_TYPE_STRING_LENGTH = 10000
+MAX_CACHED_TYPE_STRINGS = 50000
+
 def hover(workspace, document, position):
     fgmanager = workspace.mypy_server.fine_grained_manager
     if not fgmanager:
         return None
-    hover = get_hover(fgmanager, document.path, position['line'], position['character'])
+    hover = get_hover(fgmanager, document.path, position['line'], position['character'], workspace.indexes)
     if hover is None:
         return None
 
+    return {'contents': hover_contents(hover)}
+
+def hover_contents(hover: Union[dict, str]) -> dict:
     contents = {
         'kind': 'markdown',
     }
@@ -32,15 +41,61 @@ def hover(workspace, document, position):
         contents['value'] = python_highlight(hover)
     else:
         contents.update(hover)
+    return contents
 
-    return {'contents': contents}
-    
+def types_at_positions(workspace, document, positions=None, range=None):
+    """Describe the expressions at many positions, or all names in a range, in one traversal."""
+    fgmanager = workspace.mypy_server.fine_grained_manager
+    if not fgmanager:
+        return None
+    state = mypy_utils.find_state(fgmanager, document.path, workspace.indexes)
+    if state is None:
+        log.error(f'Module not analyzed by mypy: {document.path}')
+        return None
+    mypy_file = state.tree
+    if workspace.indexes is not None:
+        render = workspace.indexes.type_strings.renderer()
+    else:
+        render = memoized_type_to_string()
 
+    results = []
+    if positions is not None:
+        if not positions:
+            return []
+        # Columns are zero based in the AST, but rows are 1-based.
+        locations = [(position['line'] + 1, position['character']) for position in positions]
+        finder = mypy_utils.NodesFinderByLocation(locations)
+        mypy_file.accept(finder)
+        for position, (line, column) in zip(positions, locations):
+            node = finder.nodes.get((line, column))
+            hover = None
+            if node is not None:
+                hover = describe_node(fgmanager, node, mypy_file, line, column, document.path, render)
+            results.append({
+                'position': position,
+                'contents': hover_contents(hover) if hover is not None else None
+            })
+    elif range is not None:
+        collector = NameCollector(range['start']['line'] + 1, range['end']['line'] + 1)
+        mypy_file.accept(collector)
+        for node in collector.nodes:
+            hover = describe_node(fgmanager, node, mypy_file, node.line, node.column, document.path, render)
+            if hover is None:
+                continue
+            results.append({
+                'range': {
+                    'start': {'line': node.line - 1, 'character': node.column},
+                    'end': {'line': node.end_line - 1, 'character': node.end_column}
+                },
+                'contents': hover_contents(hover)
+            })
+    return results
 
-def get_hover(fgmanager: FineGrainedBuildManager, path, line, column) -> Union[dict, str, None]:
+
+def get_hover(fgmanager: FineGrainedBuildManager, path, line, column, indexes=None) -> Union[dict, str, None]:
     # Columns are zero based in the AST, but rows are 1-based.
     line = line + 1
-    node, mypy_file = mypy_utils.find_name_expr(fgmanager, path, line, column)
+    node, mypy_file = mypy_utils.find_name_expr(fgmanager, path, line, column, indexes)
 
     if mypy_file is None:
         log.error(f'Module not analyzed by mypy: {path}')
@@ -50,6 +105,14 @@ def get_hover(fgmanager: FineGrainedBuildManager, path, line, column) -> Union[d
         log.info('No name expression at this location')
         return None
 
+    render = indexes.type_strings.renderer() if indexes is not None else None
+    return describe_node(fgmanager, node, mypy_file, line, column, path, render)
+
+def describe_node(fgmanager: FineGrainedBuildManager, node: Context, mypy_file: MypyFile,
+                  line: int, column: int, path: str,
+                  render: Optional[Callable[[Type], str]] = None) -> Union[dict, str, None]:
+    # lines are 1 based, cols 0 based.
+    render = render or truncated_type_to_string
     def_node: Optional[Node] = None
     if isinstance(node, NameExpr):
         if node.fullname == 'builtins.None':
@@ -67,7 +130,7 @@ def get_hover(fgmanager: FineGrainedBuildManager, path, line, column) -> Union[d
 
     if isinstance(def_node, Var):
         var_type = fgmanager.manager.all_types.get(node) or def_node.type
-        var_type_str = 'Unknown' if var_type is None else type_to_string(var_type)
+        var_type_str = 'Unknown' if var_type is None else render(var_type)
         return f'{def_node.name()}: {var_type_str}'
 
     if isinstance(def_node, TypeInfo):
@@ -85,11 +148,11 @@ def get_hover(fgmanager: FineGrainedBuildManager, path, line, column) -> Union[d
             overloads = node_type.items()
             parts = [python_highlight(fullname(def_node))]
             parts.append(f'{len(overloads)} overloads:')
-            parts.extend(python_highlight(type_to_string(overload)) for overload in overloads)
+            parts.extend(python_highlight(render(overload)) for overload in overloads)
             return {'value': '\n\n'.join(parts)}
 
         if node_type:
-            type_str = type_to_string(node_type)
+            type_str = render(node_type)
             if type_str.startswith('def '):
                 type_str = type_str[4:]
         return fullname(def_node) + type_str
@@ -102,6 +165,64 @@ def python_highlight(value):
     value = value.replace('`', '_')
     return f'```python\n{value}\n```'
 
+def memoized_type_to_string() -> Callable[[Type], str]:
+    """Return a type_to_string that renders each type object only once."""
+    rendered = {} # type: Dict[int, Tuple[Type, str]]
+
+    def render(typ: Type) -> str:
+        entry = rendered.get(id(typ))
+        if entry is None:
+            entry = rendered[id(typ)] = (typ, truncated_type_to_string(typ))
+        return entry[1]
+    return render
+
+class TypeStringCache(ModuleIndex):
+    """Rendered type strings, shared by hovers, inlay hints and batched type requests.
+
+    Entries are keyed by type object. A type's string depends on the modules
+    defining everything it refers to, which fine-grained updates patch in
+    place, so all entries are stale once any module is reprocessed.
+    """
+
+    def __init__(self, max_length: Optional[int] = MAX_TYPE_STRING_LENGTH,
+                 max_entries: int = MAX_CACHED_TYPE_STRINGS) -> None:
+        self.max_length = max_length
+        self.max_entries = max_entries
+        # id(type) -> (type, generation, string)
+        self._strings = OrderedDict() # type: OrderedDict[int, Tuple[Type, int, str]]
+        self._generation = 0
+
+    def renderer(self) -> Callable[[Type], str]:
+        return self.render
+
+    def render(self, typ: Type) -> str:
+        key = id(typ)
+        entry = self._strings.get(key)
+        if entry is not None and entry[0] is typ and entry[1] == self._generation:
+            self._strings.move_to_end(key)
+            return entry[2]
+        type_str = truncate(type_to_string(typ), self.max_length)
+        self._strings[key] = (typ, self._generation, type_str)
+        self._strings.move_to_end(key)
+        if len(self._strings) > self.max_entries:
+            self._strings.popitem(last=False)
+        return type_str
+
+    def update_module(self, module_id: str, state, manager) -> None:
+        self.remove_module(module_id)
+
+    def remove_module(self, module_id: str) -> None:
+        self._generation += 1
+
+
+def truncate(type_str: str, max_length: Optional[int]) -> str:
+    if max_length and len(type_str) > max_length:
+        return type_str[:max_length] + '...'
+    return type_str
+
+def truncated_type_to_string(typ: Type) -> str:
+    return truncate(type_to_string(typ), MAX_TYPE_STRING_LENGTH)
+
 def type_to_string(typ: Type) -> str:
     type_str = str(typ)
     # Strip any occurrence of 'builtins.' unless it's part of an identifier.
@@ -117,3 +238,20 @@ def fullname(node: SymbolNode) -> str:
         return name[9:]
     else:
         return name
+
+
+class NameCollector(mypy_utils.LineRangeVisitor):
+    """Collect the name and member expressions that start in a range of (1-based) lines."""
+
+    def __init__(self, start_line: int, end_line: int) -> None:
+        super().__init__(start_line, end_line)
+        self.nodes = [] # type: List[Context]
+
+    def visit_name_expr(self, o: NameExpr) -> None:
+        if self.start_line <= o.line <= self.end_line:
+            self.nodes.append(o)
+
+    def visit_member_expr(self, o: MemberExpr) -> None:
+        super().visit_member_expr(o)
+        if self.start_line <= o.line <= self.end_line:
+            self.nodes.append(o)
@@ -0,0 +1,283 @@
+import abc
+import logging
+import os
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from .source_cache import Lines, source_cache
+
+log = logging.getLogger(__name__)
+
+
+class ModuleIndex(abc.ABC):
+    """Base class for indexes derived from analyzed modules.
+
+    After each check, an index is told only about the modules that were
+    (re)processed or removed, so it never has to rescan the whole program.
+    """
+
+    @abc.abstractmethod
+    def update_module(self, module_id: str, state, manager) -> None:
+        pass
+
+    @abc.abstractmethod
+    def remove_module(self, module_id: str) -> None:
+        pass
+
+
+class PathIndex(ModuleIndex):
+    """Map from file path to the module analyzed from it."""
+
+    def __init__(self) -> None:
+        self._modules = {} # type: Dict[str, str]
+        self._paths = {} # type: Dict[str, str]
+
+    def find(self, graph, path: str):
+        """Return the State of the module at the given path, if it was analyzed."""
+        module_id = self._modules.get(normalize_path(path))
+        return graph.get(module_id) if module_id is not None else None
+
+    def update_module(self, module_id: str, state, manager) -> None:
+        self.remove_module(module_id)
+        if state.path is None:
+            return
+        path = normalize_path(state.path)
+        self._paths[module_id] = path
+        self._modules[path] = module_id
+
+    def remove_module(self, module_id: str) -> None:
+        path = self._paths.pop(module_id, None)
+        if path is not None and self._modules.get(path) == module_id:
+            del self._modules[path]
+
+
+def normalize_path(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+class CheckedSources(ModuleIndex):
+    """The modification time and size of each module's file when it was analyzed.
+
+    While a file is unchanged on disk, its text is the source the module's tree
+    was built from, which positions in the tree refer to. The text of an open
+    document may differ, if it has unsaved edits.
+    """
+
+    def __init__(self) -> None:
+        self._stats = {} # type: Dict[str, Tuple[int, int]]
+
+    def lines(self, state) -> Optional[Sequence[str]]:
+        """Return the lines of the source of a module's tree, or None if the file changed since."""
+        stat = self._stats.get(state.id)
+        if stat is None or state.path is None:
+            return None
+        try:
+            source_file = source_cache.get(state.path)
+        except OSError:
+            return None
+        if source_file.stat != stat:
+            return None
+        return Lines(source_file)
+
+    def update_module(self, module_id: str, state, manager) -> None:
+        self.remove_module(module_id)
+        if state.path is None:
+            return
+        try:
+            st = os.stat(state.path)
+        except OSError:
+            return
+        self._stats[module_id] = (st.st_mtime_ns, st.st_size)
+
+    def remove_module(self, module_id: str) -> None:
+        self._stats.pop(module_id, None)
+
+
+class LineMap(object):
+    """Maps the (0-based) lines of an edited text to the lines of the original text.
+
+    Only the lines before the first and after the last edited line are mapped,
+    the lines in between are considered edited.
+    """
+
+    def __init__(self, original: Sequence[str], edited: Sequence[str]) -> None:
+        limit = min(len(original), len(edited))
+        prefix = 0
+        while prefix < limit and same_line(original[prefix], edited[prefix]):
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and same_line(original[-1 - suffix], edited[-1 - suffix]):
+            suffix += 1
+        self._prefix = prefix
+        self._suffix_start = len(edited) - suffix
+        self._offset = len(edited) - len(original)
+
+    def map(self, line: int) -> Optional[int]:
+        """Return the original line of an unedited line, or None if the line was edited."""
+        if line < self._prefix:
+            return line
+        if line >= self._suffix_start:
+            return line - self._offset
+        return None
+
+    def map_before(self, line: int) -> int:
+        """Return the original line of the nearest unedited line at or before a line."""
+        mapped = self.map(line)
+        if mapped is not None:
+            return mapped
+        return max(self._prefix - 1, 0)
+
+    def map_after(self, line: int) -> int:
+        """Return the original line of the nearest unedited line at or after a line.
+
+        That's the number of original lines if all lines after it were edited.
+        """
+        mapped = self.map(line)
+        if mapped is not None:
+            return mapped
+        return self._suffix_start - self._offset
+
+    def unmap(self, line: int) -> Optional[int]:
+        """Return the edited line of an original line, or None if the line was edited."""
+        if line < self._prefix:
+            return line
+        if line >= self._suffix_start - self._offset:
+            return line + self._offset
+        return None
+
+
+def same_line(a: str, b: str) -> bool:
+    return a.rstrip('\r\n') == b.rstrip('\r\n')
+
+
+def uncovered(covered: List[Tuple[int, int]], start: int, end: int) -> List[Tuple[int, int]]:
+    """Return the parts of the range of lines from start to end that aren't in covered ranges.
+
+    Ranges are inclusive, and covered ranges are sorted and don't overlap.
+    """
+    result = [] # type: List[Tuple[int, int]]
+    for covered_start, covered_end in covered:
+        if covered_end < start:
+            continue
+        if covered_start > end:
+            break
+        if covered_start > start:
+            result.append((start, covered_start - 1))
+        start = covered_end + 1
+    if start <= end:
+        result.append((start, end))
+    return result
+
+
+def cover(covered: List[Tuple[int, int]], start: int, end: int) -> List[Tuple[int, int]]:
+    """Add a range of lines to covered ranges, merging it with the ranges it overlaps or touches."""
+    result = [] # type: List[Tuple[int, int]]
+    for covered_start, covered_end in sorted(covered + [(start, end)]):
+        if result and covered_start <= result[-1][1] + 1:
+            result[-1] = (result[-1][0], max(result[-1][1], covered_end))
+        else:
+            result.append((covered_start, covered_end))
+    return result
+
+
+class Indexes(object):
+    """All indexes over the analyzed program, kept up to date after each mypy check."""
+
+    def __init__(self, max_type_length: Optional[int] = None) -> None:
+        from .mypy_calls import CallGraph
+        from .mypy_completion import MemberTables
+        from .mypy_hierarchy import SubclassIndex
+        from .mypy_hover import MAX_TYPE_STRING_LENGTH, TypeStringCache
+        from .mypy_inlay_hints import InlayHintCache
+        from .mypy_references import ReferenceIndex
+        from .mypy_semantic_tokens import SemanticTokenCache
+        from .mypy_symbols import SymbolIndex
+        self.paths = PathIndex()
+        self.sources = CheckedSources()
+        self.symbols = SymbolIndex()
+        self.references = ReferenceIndex()
+        self.members = MemberTables()
+        self.inlay_hints = InlayHintCache()
+        self.semantic_tokens = SemanticTokenCache()
+        # A max_type_length of 0 disables truncation.
+        self.type_strings = TypeStringCache(MAX_TYPE_STRING_LENGTH if max_type_length is None else max_type_length)
+        self.subclasses = SubclassIndex()
+        self.calls = CallGraph()
+        # Trees seen in the last update, used to detect reprocessed modules.
+        self._trees = {} # type: Dict[str, object]
+        # The build manager of the last update. A new one means a full build.
+        self._fgmanager = None # type: object
+        # Modules and targets processed by the fine-grained updates since the last update.
+        # A check may run several updates, and the build manager only records the last one.
+        self._updated_modules = set() # type: Set[str]
+        self._processed_targets = set() # type: Set[str]
+
+    def all(self) -> List[ModuleIndex]:
+        return [self.paths, self.sources, self.symbols, self.references, self.members, self.inlay_hints,
+                self.semantic_tokens, self.type_strings, self.subclasses, self.calls]
+
+    def update(self, fgmanager) -> None:
+        changed, removed = self._find_changes(fgmanager)
+        log.info(f'Updating indexes: {len(changed)} changed, {len(removed)} removed modules')
+        for module_id in removed:
+            self._trees.pop(module_id, None)
+            for index in self.all():
+                index.remove_module(module_id)
+        for module_id in changed:
+            state = fgmanager.graph[module_id]
+            self._trees[module_id] = state.tree
+            for index in self.all():
+                index.update_module(module_id, state, fgmanager.manager)
+
+    def _find_changes(self, fgmanager) -> Tuple[Set[str], Set[str]]:
+        """Return the modules (re)processed and removed since the last update.
+
+        After fine-grained updates, only the modules they updated and the
+        modules of the targets they processed are looked at. The whole graph
+        is only scanned after a full build, i.e. with a new build manager.
+        """
+        graph = fgmanager.graph
+        if fgmanager is not self._fgmanager:
+            self._fgmanager = fgmanager
+            self._track_updates(fgmanager)
+            changed = {module_id for module_id, state in graph.items()
+                       if state.tree is not None and self._trees.get(module_id) is not state.tree}
+            return changed, set(self._trees) - set(graph)
+
+        candidates = set(self._updated_modules)
+        for target in self._processed_targets:
+            module_id = target_module(target, graph)
+            if module_id is not None:
+                candidates.add(module_id)
+        self._updated_modules.clear()
+        self._processed_targets.clear()
+        removed = {module_id for module_id in candidates if module_id not in graph and module_id in self._trees}
+        changed = set()
+        for module_id in candidates:
+            state = graph.get(module_id)
+            if state is not None and state.tree is not None and self._trees.get(module_id) is not state.tree:
+                changed.add(module_id)
+        return changed, removed
+
+    def _track_updates(self, fgmanager) -> None:
+        """Record the modules and targets processed by each fine-grained update of a build manager."""
+        self._updated_modules.clear()
+        self._processed_targets.clear()
+        update = fgmanager.update
+
+        def tracked_update(changed_modules, removed_modules):
+            try:
+                return update(changed_modules, removed_modules)
+            finally:
+                self._updated_modules.update(module_id for module_id, _ in changed_modules + removed_modules)
+                self._updated_modules.update(fgmanager.updated_modules)
+                self._processed_targets.update(fgmanager.processed_targets)
+        fgmanager.update = tracked_update
+
+
+def target_module(target: str, graph) -> Optional[str]:
+    """Return the module containing a fine-grained target such as 'pkg.mod.Class.method'."""
+    while target not in graph:
+        if '.' not in target:
+            return None
+        target = target.rsplit('.', 1)[0]
+    return target
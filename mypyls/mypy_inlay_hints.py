@@ -0,0 +1,146 @@
+import logging
+from mypy.nodes import (
+    MypyFile, AssignmentStmt, Expression, Lvalue, NameExpr, MemberExpr, TupleExpr, ListExpr, LambdaExpr, Var
+)
+from mypy.types import Type, AnyType, CallableType
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from . import lsp, mypy_utils
+from .mypy_index import LineMap, ModuleIndex, cover, uncovered
+
+log = logging.getLogger(__name__)
+
+# (line, column, label, kind). Lines are 1-based, columns 0-based.
+Hint = Tuple[int, int, str, int]
+
+
+def inlay_hints(workspace, document, range):
+    fgmanager = workspace.mypy_server.fine_grained_manager
+    if not fgmanager or workspace.indexes is None:
+        return []
+    state = mypy_utils.find_state(fgmanager, document.path, workspace.indexes)
+    if state is None:
+        log.error(f'Module not analyzed by mypy: {document.path}')
+        return []
+
+    # Hints are positioned in the source that was checked, the document may have unsaved edits.
+    checked_lines = workspace.indexes.sources.lines(state)
+    if checked_lines is None:
+        log.info(f'{document.path} changed since it was checked, no inlay hints until the next check')
+        return []
+    line_map = LineMap(checked_lines, document.lines)
+    # Columns are zero based in the AST, but rows are 1-based.
+    start_line = line_map.map_before(range['start']['line']) + 1
+    end_line = line_map.map_after(range['end']['line']) + 1
+    render = workspace.indexes.type_strings.renderer()
+    hints = workspace.indexes.inlay_hints.hints(
+        state, fgmanager.manager.all_types, render, checked_lines, start_line, end_line)
+    result = []
+    for line, column, label, kind in hints:
+        # Hints on edited lines are dropped.
+        document_line = line_map.unmap(line - 1)
+        if document_line is None or not range['start']['line'] <= document_line <= range['end']['line']:
+            continue
+        result.append({
+            'position': {'line': document_line, 'character': column},
+            'label': label,
+            'kind': kind,
+            'paddingLeft': label.startswith('->'),
+        })
+    return result
+
+
+class ModuleHints(object):
+    def __init__(self, tree: MypyFile) -> None:
+        self.tree = tree
+        # Sorted, disjoint, inclusive line ranges for which hints were computed.
+        self.covered = [] # type: List[Tuple[int, int]]
+        self.hints = [] # type: List[Hint]
+
+
+class InlayHintCache(ModuleIndex):
+    """Inlay hints computed so far for each module version.
+
+    Only the line ranges that were never requested are computed, so
+    scrolling back and forth through a file does no repeated work.
+    """
+
+    def __init__(self) -> None:
+        self._modules = {} # type: Dict[str, ModuleHints]
+
+    def hints(self, state, typemap, render: Callable[[Type], str], lines: Sequence[str],
+              start_line: int, end_line: int) -> List[Hint]:
+        """Return the hints in a range of (1-based) lines, given the lines of the source of the tree."""
+        module = self._modules.get(state.id)
+        if module is None or module.tree is not state.tree:
+            module = self._modules[state.id] = ModuleHints(state.tree)
+
+        missing = uncovered(module.covered, start_line, end_line)
+        for start, end in missing:
+            collector = HintCollector(start, end, typemap, render, lines)
+            state.tree.accept(collector)
+            module.hints.extend(collector.hints)
+            module.covered = cover(module.covered, start, end)
+        if missing:
+            module.hints.sort()
+
+        return [hint for hint in module.hints if start_line <= hint[0] <= end_line]
+
+    def update_module(self, module_id: str, state, manager) -> None:
+        self.remove_module(module_id)
+
+    def remove_module(self, module_id: str) -> None:
+        self._modules.pop(module_id, None)
+
+
+class HintCollector(mypy_utils.LineRangeVisitor):
+    def __init__(self, start_line: int, end_line: int, typemap, render: Callable[[Type], str],
+                 lines: Sequence[str]) -> None:
+        super().__init__(start_line, end_line)
+        self.typemap = typemap
+        self.render = render
+        self.lines = lines
+        self.hints = [] # type: List[Hint]
+
+    def add(self, line: int, column: int, label_format: str, typ: Optional[Type]) -> None:
+        if typ is None or isinstance(typ, AnyType):
+            return
+        if self.start_line <= line <= self.end_line:
+            self.hints.append((line, column, label_format % self.render(typ), lsp.InlayHintKind.Type))
+
+    def visit_assignment_stmt(self, o: AssignmentStmt) -> None:
+        if o.type is None:
+            for lvalue in o.lvalues:
+                self.add_lvalue(lvalue)
+        super().visit_assignment_stmt(o)
+
+    def add_lvalue(self, lvalue: Lvalue) -> None:
+        if isinstance(lvalue, (NameExpr, MemberExpr)) and lvalue.is_inferred_def:
+            typ = self.typemap.get(lvalue)
+            if typ is None and isinstance(lvalue.node, Var):
+                typ = lvalue.node.type
+            end_column = lvalue.end_column if lvalue.end_column is not None else lvalue.column + len(lvalue.name)
+            self.add(lvalue.end_line or lvalue.line, end_column, ': %s', typ)
+        elif isinstance(lvalue, (TupleExpr, ListExpr)):
+            for item in lvalue.items:
+                self.add_lvalue(item)
+
+    def visit_lambda_expr(self, o: LambdaExpr) -> None:
+        typ = self.typemap.get(o)
+        if isinstance(typ, CallableType):
+            for argument, arg_type in zip(o.arguments, typ.arg_types):
+                name = argument.variable.name()
+                self.add(argument.line, argument.column + len(name), ': %s', arg_type)
+            colon = self.colon_before(o.expr())
+            if colon is not None:
+                self.add(colon[0], colon[1], '-> %s', typ.ret_type)
+        super().visit_lambda_expr(o)
+
+    def colon_before(self, body: Expression) -> Optional[Tuple[int, int]]:
+        """Return the position of the colon before the body of a lambda, if it's on the same line."""
+        if not 1 <= body.line <= len(self.lines):
+            return None
+        text = self.lines[body.line - 1][:max(body.column, 0)].rstrip()
+        if not text.endswith(':'):
+            return None
+        return body.line, len(text) - 1
@@ -0,0 +1,150 @@
+import logging
+from collections import defaultdict
+from mypy.nodes import (
+    Node, SymbolNode, MypyFile, ClassDef, FuncDef, AssignmentStmt, NameExpr, MemberExpr, Expression
+)
+from mypy.types import Type, Instance, CallableType, UnionType
+from mypy.traverser import TraverserVisitor
+from typing import Dict, List, Optional, Set, Tuple
+
+from . import uris, mypy_utils, mypy_definition
+from .mypy_index import ModuleIndex
+
+log = logging.getLogger(__name__)
+
+# (line, column, end_column) of a reference. Lines are 1-based, columns 0-based.
+Location = Tuple[int, int, int]
+
+
+def references(workspace, document, position, include_declaration=True):
+    fgmanager = workspace.mypy_server.fine_grained_manager
+    if not fgmanager or workspace.indexes is None:
+        return []
+    # Columns are zero based in the AST, but rows are 1-based.
+    line = position['line'] + 1
+    def_node, mypy_file = mypy_definition.find_definition_node(
+        fgmanager, document.path, line, position['character'], workspace.indexes)
+    if def_node is None:
+        return []
+    key = reference_key(def_node, mypy_file.fullname())
+    if key is None:
+        return []
+
+    declaration = mypy_definition.definition_location(fgmanager, def_node, mypy_file, document.path)
+    result = []
+    declared = False
+    for path, ref_line, column, end_column in workspace.indexes.references.find(key):
+        if (path, ref_line, column) == declaration:
+            declared = True
+            if not include_declaration:
+                continue
+        result.append(location(path, ref_line, column, end_column))
+
+    if include_declaration and not declared:
+        path, decl_line, column = declaration
+        result.insert(0, location(path, decl_line, column, column))
+    return result
+
+
+def location(path: str, line: int, column: int, end_column: int) -> dict:
+    return {
+        'uri': uris.from_fs_path(path),
+        'range': {
+            'start': {'line': line - 1, 'character': column},
+            'end': {'line': line - 1, 'character': end_column}
+        }
+    }
+
+
+def reference_key(node: Node, module_id: str) -> Optional[str]:
+    """Return the key under which references to a definition are indexed."""
+    if isinstance(node, ClassDef):
+        node = node.info
+    if not isinstance(node, SymbolNode):
+        return None
+    fullname = node.fullname()
+    if not fullname:
+        return None
+    if '.' not in fullname and not isinstance(node, MypyFile):
+        # Local variables, arguments and nested functions only have a short name.
+        return f'{module_id}.{fullname}@{node.line}:{node.column}'
+    return fullname
+
+
+class ReferenceIndex(ModuleIndex):
+    """Inverted index from definition to all the places in the program that refer to it."""
+
+    def __init__(self) -> None:
+        self._references = {} # type: Dict[str, Dict[str, List[Location]]]
+        self._targets = {} # type: Dict[str, Set[str]]
+        self._paths = {} # type: Dict[str, str]
+
+    def update_module(self, module_id: str, state, manager) -> None:
+        self.remove_module(module_id)
+        if state.path is None:
+            return
+        collector = ReferenceCollector(module_id, manager.all_types)
+        state.tree.accept(collector)
+        self._paths[module_id] = state.path
+        self._targets[module_id] = set(collector.references)
+        for key, locations in collector.references.items():
+            self._references.setdefault(key, {})[module_id] = locations
+
+    def remove_module(self, module_id: str) -> None:
+        self._paths.pop(module_id, None)
+        for key in self._targets.pop(module_id, ()):
+            modules = self._references.get(key)
+            if modules is not None:
+                modules.pop(module_id, None)
+                if not modules:
+                    del self._references[key]
+
+    def find(self, key: str) -> List[Tuple[str, int, int, int]]:
+        modules = self._references.get(key, {})
+        return sorted((self._paths[module_id], line, column, end_column)
+                      for module_id, locations in modules.items()
+                      for line, column, end_column in locations)
+
+
+class ReferenceCollector(TraverserVisitor):
+    def __init__(self, module_id: str, typemap: Dict[Expression, Type]) -> None:
+        super().__init__()
+        self.module_id = module_id
+        self.typemap = typemap
+        self.references = defaultdict(list) # type: Dict[str, List[Location]]
+
+    def add(self, node: Optional[Node], line: int, column: int, end_column: int) -> None:
+        if node is None or line < 1:
+            return
+        key = reference_key(node, self.module_id)
+        if key is not None:
+            self.references[key].append((line, column, end_column))
+
+    def add_type(self, typ: Optional[Type]) -> None:
+        if isinstance(typ, Instance):
+            self.add(typ.type, typ.line, typ.column, typ.column + len(typ.type.name()))
+            for arg in typ.args:
+                self.add_type(arg)
+        elif isinstance(typ, UnionType):
+            for item in typ.items:
+                self.add_type(item)
+
+    def visit_name_expr(self, o: NameExpr) -> None:
+        self.add(o.node, o.line, o.column, o.column + len(o.name))
+
+    def visit_member_expr(self, o: MemberExpr) -> None:
+        super().visit_member_expr(o)
+        if o.end_line is not None and o.end_column is not None:
+            def_node = mypy_utils.get_definition(o, self.typemap)
+            self.add(def_node, o.end_line, o.end_column - len(o.name), o.end_column)
+
+    def visit_assignment_stmt(self, o: AssignmentStmt) -> None:
+        self.add_type(o.type)
+        super().visit_assignment_stmt(o)
+
+    def visit_func_def(self, o: FuncDef) -> None:
+        if isinstance(o.type, CallableType):
+            for arg_type in o.type.arg_types:
+                self.add_type(arg_type)
+            self.add_type(o.type.ret_type)
+        super().visit_func_def(o)
@@ -0,0 +1,235 @@
+import itertools
+import logging
+import re
+from mypy.nodes import (
+    Node, MypyFile, TypeInfo, TypeVarExpr, FuncBase, FuncItem, FuncDef, Decorator, Var, ClassDef,
+    NameExpr, MemberExpr, Expression, FUNC_NO_INFO
+)
+from mypy.types import Type, Instance, UnionType
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from . import mypy_utils
+from .mypy_index import ModuleIndex
+
+log = logging.getLogger(__name__)
+
+TOKEN_TYPES = [
+    'namespace', 'class', 'enum', 'interface', 'typeParameter', 'function', 'method', 'property',
+    'variable', 'parameter',
+]
+TOKEN_MODIFIERS = ['declaration', 'readonly', 'defaultLibrary']
+LEGEND = {'tokenTypes': TOKEN_TYPES, 'tokenModifiers': TOKEN_MODIFIERS}
+
+_TYPE_INDEX = {name: i for i, name in enumerate(TOKEN_TYPES)}
+DECLARATION, READONLY, DEFAULT_LIBRARY = (1 << i for i in range(len(TOKEN_MODIFIERS)))
+
+RE_IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z_0-9.]*')
+
+# (line, column, length, token type, modifiers). Lines are 1-based, columns 0-based.
+Token = Tuple[int, int, int, int, int]
+
+_result_ids = itertools.count()
+
+
+def semantic_tokens_full(workspace, document):
+    result = module_tokens(workspace, document)
+    if result is None:
+        return None
+    result_id, data = result
+    return {'resultId': result_id, 'data': data}
+
+
+def semantic_tokens_delta(workspace, document, previous_result_id):
+    previous = workspace.indexes.semantic_tokens.result(previous_result_id) if workspace.indexes else None
+    result = module_tokens(workspace, document)
+    if result is None:
+        return None
+    result_id, data = result
+    if previous is None:
+        return {'resultId': result_id, 'data': data}
+    return {'resultId': result_id, 'edits': diff(previous, data)}
+
+
+def module_tokens(workspace, document) -> Optional[Tuple[str, List[int]]]:
+    fgmanager = workspace.mypy_server.fine_grained_manager
+    if not fgmanager or workspace.indexes is None:
+        return None
+    state = mypy_utils.find_state(fgmanager, document.path, workspace.indexes)
+    if state is None:
+        log.error(f'Module not analyzed by mypy: {document.path}')
+        return None
+    # Tokens are cached per tree, so they're built from the source of the tree rather than the document,
+    # which may have unsaved edits.
+    lines = workspace.indexes.sources.lines(state)
+    if lines is None:
+        log.info(f'{document.path} changed since it was checked, no semantic tokens until the next check')
+        return None
+    return workspace.indexes.semantic_tokens.tokens(state, lines, fgmanager.manager.all_types)
+
+
+def diff(old: List[int], new: List[int]) -> List[dict]:
+    """Return a single edit turning the old token data into the new one."""
+    start = 0
+    limit = min(len(old), len(new))
+    while start < limit and old[start] == new[start]:
+        start += 1
+    end = 0
+    while end < limit - start and old[-1 - end] == new[-1 - end]:
+        end += 1
+    if start == len(old) == len(new):
+        return []
+    return [{'start': start, 'deleteCount': len(old) - start - end, 'data': new[start:len(new) - end]}]
+
+
+def encode(tokens: List[Token]) -> List[int]:
+    data = [] # type: List[int]
+    previous_line = 1
+    previous_column = 0
+    for line, column, length, token_type, modifiers in tokens:
+        if line != previous_line:
+            previous_column = 0
+        data.extend((line - previous_line, column - previous_column, length, token_type, modifiers))
+        previous_line = line
+        previous_column = column
+    return data
+
+
+class SemanticTokenCache(ModuleIndex):
+    """Encoded semantic tokens per module version, and the results sent to clients."""
+
+    def __init__(self) -> None:
+        # Module id -> (tree, result id, data)
+        self._modules = {} # type: Dict[str, Tuple[MypyFile, str, List[int]]]
+        # Module id -> id of the result before the current one, kept to compute deltas against.
+        self._previous = {} # type: Dict[str, str]
+        self._results = {} # type: Dict[str, List[int]]
+
+    def tokens(self, state, lines: Sequence[str], typemap: Dict[Expression, Type]) -> Tuple[str, List[int]]:
+        cached = self._modules.get(state.id)
+        if cached is None or cached[0] is not state.tree:
+            self.remove_module(state.id)
+            collector = TokenCollector(lines, typemap)
+            state.tree.accept(collector)
+            result_id = str(next(_result_ids))
+            cached = self._modules[state.id] = (state.tree, result_id, encode(collector.tokens()))
+            self._results[result_id] = cached[2]
+        return cached[1], cached[2]
+
+    def result(self, result_id: Optional[str]) -> Optional[List[int]]:
+        return self._results.get(result_id) if result_id is not None else None
+
+    def update_module(self, module_id: str, state, manager) -> None:
+        self.remove_module(module_id)
+
+    def remove_module(self, module_id: str) -> None:
+        cached = self._modules.pop(module_id, None)
+        if cached is not None:
+            stale = self._previous.get(module_id)
+            if stale is not None:
+                self._results.pop(stale, None)
+            self._previous[module_id] = cached[1]
+
+
+class TokenCollector(mypy_utils.AnnotationVisitor):
+    def __init__(self, lines: Sequence[str], typemap: Dict[Expression, Type]) -> None:
+        super().__init__()
+        self.lines = lines
+        self.typemap = typemap
+        self._tokens = {} # type: Dict[Tuple[int, int], Token]
+        self._parameters = set() # type: Set[Var]
+
+    def tokens(self) -> List[Token]:
+        return [self._tokens[position] for position in sorted(self._tokens)]
+
+    def add(self, line: int, column: int, length: int, node: Optional[Node], modifiers: int = 0) -> None:
+        if line < 1 or column < 0 or length <= 0 or node is None:
+            return
+        classified = self.classify(node)
+        if classified is not None:
+            token_type, token_modifiers = classified
+            self._tokens[(line, column)] = (line, column, length, token_type, token_modifiers | modifiers)
+
+    def classify(self, node: Node) -> Optional[Tuple[int, int]]:
+        modifiers = 0
+        if isinstance(node, MypyFile):
+            return _TYPE_INDEX['namespace'], modifiers
+        if isinstance(node, TypeInfo):
+            if node.module_name == 'builtins':
+                modifiers |= DEFAULT_LIBRARY
+            if node.is_enum:
+                return _TYPE_INDEX['enum'], modifiers
+            if node.is_protocol:
+                return _TYPE_INDEX['interface'], modifiers
+            return _TYPE_INDEX['class'], modifiers
+        if isinstance(node, TypeVarExpr):
+            return _TYPE_INDEX['typeParameter'], modifiers
+        if isinstance(node, Decorator) and node.var.is_property:
+            if not node.var.is_settable_property:
+                modifiers |= READONLY
+            return _TYPE_INDEX['property'], modifiers
+        if isinstance(node, (FuncBase, Decorator)):
+            if node.fullname().startswith('builtins.'):
+                modifiers |= DEFAULT_LIBRARY
+            info = node.func.info if isinstance(node, Decorator) else node.info
+            if info is not None and info is not FUNC_NO_INFO:
+                return _TYPE_INDEX['method'], modifiers
+            return _TYPE_INDEX['function'], modifiers
+        if isinstance(node, Var):
+            if node.is_property:
+                return _TYPE_INDEX['property'], modifiers | (0 if node.is_settable_property else READONLY)
+            if node.is_final:
+                modifiers |= READONLY
+            if node in self._parameters:
+                return _TYPE_INDEX['parameter'], modifiers
+            return _TYPE_INDEX['variable'], modifiers
+        return None
+
+    def name_column(self, line: int, column: int, keyword: str, name: str) -> Optional[int]:
+        if line > len(self.lines):
+            return None
+        match = re.compile(r'\b%s\s+(%s)\b' % (keyword, re.escape(name))).search(self.lines[line - 1], column)
+        return match.start(1) if match else None
+
+    def process_node(self, node) -> None:
+        # Types in annotations.
+        if isinstance(node, Instance):
+            if node.line < 1 or node.line > len(self.lines):
+                return
+            match = RE_IDENTIFIER.match(self.lines[node.line - 1], node.column)
+            if match:
+                text = match.group()
+                offset = text.rfind('.') + 1
+                self.add(node.line, node.column + offset, len(text) - offset, node.type)
+            for arg in node.args:
+                self.process_node(arg)
+        elif isinstance(node, UnionType):
+            for item in node.items:
+                self.process_node(item)
+
+    def visit_name_expr(self, o: NameExpr) -> None:
+        self.add(o.line, o.column, len(o.name), o.node)
+
+    def visit_member_expr(self, o: MemberExpr) -> None:
+        super().visit_member_expr(o)
+        if o.end_line is not None and o.end_column is not None:
+            def_node = o.def_var or mypy_utils.get_definition(o, self.typemap)
+            self.add(o.end_line, o.end_column - len(o.name), len(o.name), def_node)
+
+    def visit_func(self, o: FuncItem) -> None:
+        for argument in o.arguments:
+            self._parameters.add(argument.variable)
+            name = argument.variable.name()
+            self.add(argument.line, argument.column, len(name), argument.variable, DECLARATION)
+        super().visit_func(o)
+
+    def visit_func_def(self, o: FuncDef) -> None:
+        column = self.name_column(o.line, o.column, 'def', o.name())
+        if column is not None:
+            self.add(o.line, column, len(o.name()), o, DECLARATION)
+        super().visit_func_def(o)
+
+    def visit_class_def(self, o: ClassDef) -> None:
+        column = self.name_column(o.line, o.column, 'class', o.name)
+        if column is not None:
+            self.add(o.line, column, len(o.name), o.info, DECLARATION)
+        super().visit_class_def(o)
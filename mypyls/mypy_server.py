@@ -1,38 +1,284 @@
+import gc
 import logging
 import os
 import re
-from collections import defaultdict
+import threading
+import time
+import uuid
 from . import uris
 
 from mypy.dmypy_server import Server
 from mypy.dmypy_util import DEFAULT_STATUS_FILE
+from mypy.dmypy.client import BadStatus, get_status, request
+from mypy import build, defaults
+from mypy.errors import CompileError
+from mypy.find_sources import InvalidSourceList, create_source_list
 from mypy.options import Options
 from mypy.main import parse_config_file
 from mypy.version import __version__ as mypy_version
-from typing import Set, Dict, Optional, List, cast
+from typing import Any, Set, Dict, Optional, List, Tuple, Union, cast, TYPE_CHECKING
 
-from . import lsp
-from contextlib import redirect_stderr
+from . import lsp, _utils, shared_cache
+from .diagnostics import DiagnosticsStore
+from .mypy_index import Indexes
+from contextlib import contextmanager, redirect_stderr
 from io import StringIO
 from .version import __version__ as mypyls_version
 
+if TYPE_CHECKING:
+    from .mypy_shards import ShardedServer
+
 line_pattern = r"([^:]+):(?:(\d+):)?(?:(\d+):)? (\w+): (.*)"
 
+PYTHON_FILE_EXTENSIONS = ('.py', '.pyi')
+# Minimum time between progress updates, in seconds.
+PROGRESS_INTERVAL = 0.2
+CONFIG_FILE_NAMES = {os.path.basename(path) for path in defaults.CONFIG_FILES}
+
 log = logging.getLogger(__name__)
-settings = None # type: Optional[Dict[str, object]]
+
+
+class Session(object):
+    """The mypy daemon and analysis results for one workspace root.
+
+    A session is shared by all clients (workspaces) that open the same root,
+    so that they share a single daemon and cache, and checks requested by
+    several clients at once run only once.
+    """
+
+    def __init__(self, root_path: str) -> None:
+        self.root_path = root_path
+        self.settings = None # type: Optional[Dict[str, object]]
+        self.mypy_server = None # type: Union[Server, DaemonClient, BatchServer, ShardedServer, None]
+        self.python_executable = None # type: Optional[str]
+        self.indexes = None # type: Optional[Indexes]
+        # The options read from the config file, before the daemon modified them.
+        self.options_snapshot = {} # type: Dict[str, object]
+        self.config_stat = None # type: Optional[Tuple[int, int]]
+        # The number of modules in the daemon's last check, to show the progress of the next one.
+        self.module_count = None # type: Optional[int]
+        # Set when the daemon was dropped after being idle, until the next request or save.
+        self.hibernated = False
+        self.last_activity = time.monotonic()
+        self._idle_timer = None # type: Optional[threading.Timer]
+        self._progress_title = ''
+        self._last_progress = 0.0
+        self.workspaces = [] # type: list
+        # Last published diagnostics, sent to clients that connect later.
+        self.diagnostics = DiagnosticsStore(root_path)
+        # Incremented by every check. A document's result id is the generation of the check
+        # that last changed its diagnostics, so pulling clients can skip unchanged documents.
+        # Ids are prefixed with a nonce, so that ids from an earlier session never match.
+        self.check_generation = 0
+        self._result_id_nonce = uuid.uuid4().hex[:8]
+        self.diagnostic_result_ids = {} # type: Dict[str, str]
+        # Held while the daemon or the analysis results are in use.
+        self.lock = threading.RLock()
+        # Number of requests and checks waiting for the lock, which background warm-up yields to.
+        self._waiting = 0
+        self._waiting_changed = threading.Condition()
+        self._check_state_lock = threading.Lock()
+        self._checking = False
+        self._check_requested = False
+
+    def show_message(self, message, msg_type=lsp.MessageType.Info):
+        for workspace in list(self.workspaces):
+            workspace.show_message(message, msg_type)
+
+    def begin_progress(self, title):
+        self._progress_title = title
+        self._last_progress = time.monotonic()
+        for workspace in list(self.workspaces):
+            workspace.begin_progress(title)
+
+    def report_progress(self, processed, total=None):
+        """Report the number of processed modules, at most once every PROGRESS_INTERVAL seconds."""
+        now = time.monotonic()
+        if now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        message = f'{processed}/{total}' if total else str(processed)
+        percentage = min(100, processed * 100 // total) if total else None
+        for workspace in list(self.workspaces):
+            workspace.report_progress(self._progress_title, message, percentage)
+
+    def end_progress(self):
+        for workspace in list(self.workspaces):
+            workspace.end_progress()
+
+    def publish_diagnostics(self, uri, diagnostics):
+        for workspace in list(self.workspaces):
+            workspace.publish_diagnostics(uri, diagnostics)
+
+    def refresh_diagnostics(self):
+        for workspace in list(self.workspaces):
+            workspace.refresh_diagnostics()
+
+    def result_id(self, generation: int) -> str:
+        return f'{self._result_id_nonce}-{generation}'
+
+    def diagnostic_result_id(self, uri: str) -> str:
+        # Documents that never had diagnostics keep the initial result id.
+        return self.diagnostic_result_ids.get(uri) or self.result_id(0)
+
+    @contextmanager
+    def priority_lock(self):
+        """Hold the lock, ahead of background warm-up."""
+        with self._waiting_changed:
+            self._waiting += 1
+        try:
+            self.lock.acquire()
+        finally:
+            with self._waiting_changed:
+                self._waiting -= 1
+                self._waiting_changed.notify_all()
+        try:
+            yield
+        finally:
+            self.lock.release()
+
+    def wait_for_requests(self) -> None:
+        """Wait until no request or check is waiting for the lock."""
+        with self._waiting_changed:
+            while self._waiting:
+                self._waiting_changed.wait()
+
+
+class DaemonUnavailable(Exception):
+    pass
+
+
+class BatchServer(object):
+    """Stands in for an in-process Server, running a regular incremental build for each check.
+
+    Unlike the daemon, the build writes the fine-grained cache, which daemons
+    started later (e.g. in an editor) load instead of checking from scratch.
+    """
+
+    fine_grained_manager = None
+    status_callback = None
+
+    def __init__(self, options: Options, root_path: Optional[str] = None, shared_cache: bool = False) -> None:
+        # The daemon can only load a cache written with these options.
+        options.cache_fine_grained = True
+        options.local_partial_types = True
+        # Trusting the cache without checking for changed files is only right for the daemon.
+        options.use_fine_grained_cache = False
+        self.options = options
+        self.root_path = root_path
+        self.shared_cache = shared_cache
+        # Exit status of the last check.
+        self.status = None # type: Optional[int]
+
+    def cmd_check(self, files, is_tty=False, terminal_width=80):
+        if self.shared_cache:
+            shared_cache.seed(self.options)
+        try:
+            sources = create_source_list(files, self.options)
+            result = build.build(sources, self.options)
+        except CompileError as e:
+            self.status = 2
+            output = ''.join(message + '\n' for message in e.messages)
+            if e.use_stdout:
+                return {'out': output, 'err': '', 'status': self.status}
+            return {'out': '', 'err': output, 'status': self.status}
+        self.status = 1 if result.errors else 0
+        if self.shared_cache and self.root_path is not None:
+            shared_cache.export(result.graph, self.options, self.root_path)
+        out = ''.join(message + '\n' for message in result.errors)
+        return {'out': out, 'err': '', 'status': self.status}
+
+
+class DaemonClient(object):
+    """Stands in for an in-process Server, sending check commands to a running dmypy daemon.
+
+    The daemon's build manager lives in another process, so rich language features
+    are not available when attached to it.
+    """
+
+    fine_grained_manager = None
+    status_callback = None
+
+    def __init__(self, status_file: str) -> None:
+        self.status_file = status_file
+
+    def cmd_check(self, files, is_tty=False, terminal_width=80):
+        if mypy_version > '0.720':
+            response = request(self.status_file, 'check', files=files, is_tty=is_tty, terminal_width=terminal_width)
+        else:
+            response = request(self.status_file, 'check', files=files)
+        if 'error' in response:
+            try:
+                get_status(self.status_file)
+            except BadStatus as e:
+                raise DaemonUnavailable(str(e))
+            return {'out': '', 'err': response['error'], 'status': 2}
+        return response
+
+
+def connect_to_daemon(status_file: str) -> Optional[DaemonClient]:
+    try:
+        get_status(status_file)
+    except BadStatus as e:
+        log.info(f'No running dmypy daemon found via {status_file}: {e}')
+        return None
+    log.info(f'Attaching to dmypy daemon via {status_file}')
+    return DaemonClient(status_file)
+
+
+sessions = {} # type: Dict[str, Session]
+sessions_lock = threading.Lock()
+
+def attach_session(workspace) -> Session:
+    with sessions_lock:
+        session = sessions.get(workspace.root_path)
+        if session is None:
+            session = sessions[workspace.root_path] = Session(workspace.root_path)
+        if workspace not in session.workspaces:
+            session.workspaces.append(workspace)
+            for uri in session.diagnostics.uris():
+                workspace.publish_diagnostics(uri, session.diagnostics.lsp_diagnostics(uri))
+    workspace.session = session
+    return session
+
+def detach_session(workspace) -> None:
+    session = workspace.session
+    if session is None:
+        return
+    workspace.session = None
+    with sessions_lock:
+        session.workspaces.remove(workspace)
+        if not session.workspaces:
+            log.info(f'Last client of {session.root_path} disconnected, releasing mypy daemon.')
+            del sessions[session.root_path]
+            if session._idle_timer is not None:
+                session._idle_timer.cancel()
+            close = getattr(session.mypy_server, 'close', None)
+            if close is not None:
+                close()
 
 def configuration_changed(config, workspace):
-    global settings
     if not workspace.root_path:
         return
-    if settings is not None:
+    session = attach_session(workspace)
+    with session.lock:
+        started = session.settings is not None
         new_settings = config.settings()
-        if new_settings != settings:
-            workspace.show_message('Please reload window to update mypy configuration.')
+        if started and new_settings == session.settings:
+            return
+        old_settings = session.settings
+        session.settings = new_settings
+        if started:
+            if new_settings.get('dmypyStatusFile') != old_settings.get('dmypyStatusFile'):
+                workspace.show_message('Please reload window to update the dmypy status file.')
+            elif session.mypy_server is not None:
+                reload_config(session)
+
+    if started:
+        # The config file or the targets may have changed.
+        mypy_check(workspace, config)
         return
 
-    settings = config.settings()
-
     if config.capabilities.get('workspace', {}).get('configuration'):
         python_executable_future = workspace.get_configuration([{'section': 'python.pythonPath'}])
         python_executable_future.add_done_callback(lambda future: got_python_executable(future, config, workspace))
@@ -60,13 +306,61 @@ def got_python_executable(python_executable_future, config, workspace):
     start_server_and_analyze(config, workspace, python_executable)
 
 def start_server_and_analyze(config, workspace, python_executable=None):
+    session = workspace.session
+    with session.lock:
+        if session.mypy_server is None:
+            start_server(session, python_executable)
+    mypy_check(workspace, config)
+
+def start_server(session, python_executable=None, attach_to_daemon=True):
+    settings = session.settings
     if settings is None:
         log.error('Settings is None')
         return
 
     log.info(f'mypy version: {mypy_version}')
     log.info(f'mypyls version: {mypyls_version}')
+    session.python_executable = python_executable
+
+    status_file = settings.get('dmypyStatusFile')
+    if attach_to_daemon and status_file:
+        client = connect_to_daemon(os.path.join(session.root_path, cast(str, status_file)))
+        if client is not None:
+            session.mypy_server = client
+            session.indexes = new_indexes(session)
+            return
+        log.info('Starting mypy in the language server instead.')
+
+    from .mypy_shards import ShardedServer, configured_shards
+    shards = configured_shards(session)
+    if len(shards) > 1:
+        session.mypy_server = ShardedServer(session, shards)
+        session.indexes = new_indexes(session)
+        return
 
+    options = load_options(session, python_executable)
+    create_server(session, options)
+
+def create_server(session, options):
+    # Server modifies the options it's given, so remember what the config file said.
+    session.options_snapshot = options.snapshot()
+    session.config_stat = config_file_stat(options.config_file)
+    session.mypy_server = Server(options, DEFAULT_STATUS_FILE)
+    if use_shared_cache(session):
+        # After creating the server, which sets the options it will build with.
+        shared_cache.seed(session.mypy_server.options)
+    session.indexes = new_indexes(session)
+    schedule_hibernation(session)
+
+def use_shared_cache(session) -> bool:
+    return bool(session.settings.get('sharedCache'))
+
+def new_indexes(session) -> Indexes:
+    return Indexes(max_type_length=cast(Optional[int], session.settings.get('maxTypeLength')))
+
+def load_options(session, python_executable=None) -> Options:
+    """Build mypy options from the session's settings and the mypy config file."""
+    settings = session.settings
     options = Options()
     options.check_untyped_defs = True
     if mypy_version < '0.780':
@@ -94,22 +388,23 @@ def start_server_and_analyze(config, workspace, python_executable=None):
                     "(see 'mypy -h' for the list of flags enabled in strict mode).")
             parse_config_file(options, set_strict_flags, config_file)
         else:
-            parse_config_file(options, config_file)
+            # Before mypy 0.770, parse_config_file took no set_strict_flags callback.
+            cast(Any, parse_config_file)(options, config_file)
 
     stderr = stderr_stream.getvalue()
     if stderr:
-        log.error(f'Error reading mypy config file:\n{stderr}')
-        workspace.show_message(f'Error reading mypy config file:\n{stderr}')
+        log.error('Error reading mypy config file:\n%s', stderr)
+        session.show_message(f'Error reading mypy config file:\n{stderr}')
     if options.config_file:
         log.info(f'Read mypy config from: {options.config_file}')
     else:
         log.info(f'Mypy configuration not read, using defaults.')
         if config_file:
-            workspace.show_message(f'Mypy config file not found:\n{config_file}')
+            session.show_message(f'Mypy config file not found:\n{config_file}')
 
     options.show_column_numbers = True
     if mypy_version < '0.780' and options.follow_imports not in ('error', 'skip'):
-        workspace.show_message(f"Cannot use follow_imports='{options.follow_imports}', using 'error' instead.")
+        session.show_message(f"Cannot use follow_imports='{options.follow_imports}', using 'error' instead.")
         options.follow_imports = 'error'
 
     if mypy_version > '0.720':
@@ -118,102 +413,405 @@ def start_server_and_analyze(config, workspace, python_executable=None):
         options.pretty = False
 
     log.info(f'python_executable after applying config: {options.python_executable}')
-    workspace.mypy_server = Server(options, DEFAULT_STATUS_FILE)
+    return options
+
+def config_file_stat(config_file: Optional[str]) -> Optional[Tuple[int, int]]:
+    if not config_file:
+        return None
+    try:
+        st = os.stat(config_file)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def config_file_changed(session) -> bool:
+    if not isinstance(session.mypy_server, Server):
+        return False
+    config_file = session.options_snapshot.get('config_file')
+    return config_file_stat(config_file) != session.config_stat
+
+def reload_config(session) -> None:
+    """Apply changes in the mypy config file to the running daemon.
+
+    The options are read again from scratch and compared with those the
+    daemon was started with. If they differ, the daemon's build is written
+    to the fine-grained cache and the daemon is rebuilt with the new options.
+    The new daemon loads the cache, and only rechecks the modules whose
+    options affecting the cache changed, since their cache entries no longer
+    match. Options are never modified in place, since mypy caches the
+    per-module options derived from them.
+    """
+    server = session.mypy_server
+    if not isinstance(server, Server):
+        # An external dmypy daemon reads the config file itself.
+        return
+
+    options = load_options(session, session.python_executable)
+    old_snapshot = session.options_snapshot
+    new_snapshot = cast(Dict[str, object], options.snapshot())
+    changed = {key for key in set(old_snapshot) | set(new_snapshot)
+               if old_snapshot.get(key) != new_snapshot.get(key)}
+    session.config_stat = config_file_stat(options.config_file)
+    if not changed:
+        log.info('mypy config unchanged.')
+        return
+
+    log.info(f'mypy options changed ({", ".join(sorted(changed))}), restarting mypy.')
+    write_daemon_cache(server)
+    create_server(session, options)
+
+def write_daemon_cache(server: Server) -> bool:
+    """Write the daemon's build to the fine-grained cache, which the daemon never does itself.
+
+    Modules with errors, and modules whose source changed since the last
+    check, are removed from the cache instead, so that a daemon loading the
+    cache rechecks them. Returns whether the cache was written.
+    """
+    fgmanager = server.fine_grained_manager
+    if fgmanager is None or fgmanager.blocking_error is not None or server.options.cache_dir == os.devnull:
+        return False
+    start = time.monotonic()
+    manager = fgmanager.manager
+    graph = fgmanager.graph
+    checked = server.fswatcher.dump_file_data()
+    with_errors = set(manager.errors.error_info_map)
+    for state in graph.values():
+        if state.tree is None or not state.path:
+            continue
+        source_hash = state.source_hash or (state.meta.hash if state.meta is not None else None)
+        if source_hash is None or state.xpath in with_errors or not unchanged_since_check(state.path, checked):
+            build.delete_cache(state.id, state.path, manager)
+            continue
+        build.write_cache(state.id, state.path, state.tree, list(state.dependencies), list(state.suppressed),
+                          state.dependency_priorities(), state.dependency_lines(), state.interface_hash,
+                          source_hash, state.ignore_all, manager)
+    build.write_deps_cache(build.generate_deps_for_cache(manager, graph), manager, graph)
+    build.write_plugins_snapshot(manager)
+    manager.metastore.commit()
+    log.info(f'Wrote mypy fine-grained cache in {time.monotonic() - start:.1f} s')
+    return True
+
+def unchanged_since_check(path: str, checked: Dict[str, Tuple[float, int, str]]) -> bool:
+    """Return whether the file is still the one the daemon last checked."""
+    data = checked.get(path)
+    if data is None:
+        return False
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return (st.st_mtime, st.st_size) == data[:2]
 
-    mypy_check(workspace, config)
 
 def mypy_check(workspace, config):
-    if not workspace.root_path:
+    session = workspace.session
+    if not workspace.root_path or session is None:
         return
 
-    if settings is None:
+    if session.settings is None or (session.mypy_server is None and not session.hibernated):
         return
 
+    # If another client of this root is already checking, ask it to check once more
+    # when done, instead of running a second check.
+    with session._check_state_lock:
+        if session._checking:
+            log.info('Check already running, scheduling another one.')
+            session._check_requested = True
+            return
+        session._checking = True
+        session._check_requested = False
+
+    while True:
+        with session.priority_lock():
+            if session.hibernated:
+                rehydrate(session)
+            else:
+                if session.mypy_server is None:
+                    # The dmypy daemon we were attached to went away.
+                    start_server(session, session.python_executable, attach_to_daemon=False)
+                elif config_file_changed(session):
+                    reload_config(session)
+                run_check(session)
+        with session._check_state_lock:
+            if not session._check_requested:
+                session._checking = False
+                return
+            session._check_requested = False
+
+def run_check(session):
     log.info('Checking mypy...')
-    workspace.report_progress('$(gear~spin) mypy')
+    session.begin_progress('mypy')
     try:
+        targets = check_targets(session)
+        log.info('Targets: %s', targets)
         if is_patched_mypy():
+            total = expected_module_count(session, targets)
             def report_status(processed_targets: int) -> None:
-                workspace.report_progress(f'$(gear~spin) mypy ({processed_targets})')
-            workspace.mypy_server.status_callback = report_status
+                session.report_progress(processed_targets, total)
+            session.mypy_server.status_callback = report_status
 
-        targets = cast(List[str], settings.get('targets')) or ['.']
-        targets = [os.path.join(workspace.root_path, target) for target in targets]
-        log.info(f'Targets: {targets}')
-        if mypy_version > '0.720':
-            # mypy 0.730 added is_tty and terminal_width
-            result = workspace.mypy_server.cmd_check(targets, False, 80)
-        else:
-            result = workspace.mypy_server.cmd_check(targets)
+        result = cmd_check(session.mypy_server, targets)
         log.info(f'mypy done, exit code {result["status"]}')
+        if session.mypy_server.fine_grained_manager is not None:
+            session.module_count = len(session.mypy_server.fine_grained_manager.graph)
         if result['err']:
-            log.info(f'mypy stderr:\n{result["err"]}')
-            workspace.show_message(f'Error running mypy: {result["err"]}')
-
-        log.info(f'mypy stdout:\n{result["out"]}')
-        publish_diagnostics(workspace, result['out'])
+            log.info('mypy stderr:\n%s', result['err'])
+            session.show_message(f'Error running mypy: {result["err"]}')
+
+        log.info('mypy stdout:\n%s', result['out'])
+        publish_diagnostics(session, result['out'])
+        update_indexes(session)
+        if is_patched_mypy() and session.indexes is not None and session.mypy_server.fine_grained_manager is not None:
+            from . import warm_up
+            warm_up.schedule(session)
+    except DaemonUnavailable as e:
+        log.warning(f'dmypy daemon is no longer running: {e}')
+        session.show_message('The dmypy daemon is no longer running, running mypy in the language server instead.')
+        session.mypy_server = None
+        with session._check_state_lock:
+            session._check_requested = True
     except Exception as e:
         log.exception('Error in mypy check:')
-        workspace.show_message(f'Error running mypy: {e}')
+        session.show_message(f'Error running mypy: {e}')
     except SystemExit as e:
         log.exception('Internal error running mypy:')
-        workspace.show_message('Internal error running mypy. Open output pane for details.')
+        session.show_message('Internal error running mypy. Open output pane for details.')
     finally:
-        workspace.report_progress(None)
-        if is_patched_mypy():
-            workspace.mypy_server.status_callback = None
+        session.end_progress()
+        if is_patched_mypy() and session.mypy_server is not None:
+            session.mypy_server.status_callback = None
+
+def expected_module_count(session, targets: List[str]) -> Optional[int]:
+    """Estimate how many modules a check processes, for its progress."""
+    server = session.mypy_server
+    fgmanager = server.fine_grained_manager
+    if fgmanager is not None:
+        # The modules of the last check.
+        return len(fgmanager.graph)
+    if session.module_count is not None:
+        # The modules of the last check of a daemon since restarted, e.g. after hibernating.
+        return session.module_count
+    if not isinstance(server, Server):
+        return None
+    # The first check: the modules of the targets, without the libraries they import.
+    try:
+        return len(create_source_list(targets, server.options)) or None
+    except InvalidSourceList:
+        return None
+
+def cmd_check(server, targets: List[str]) -> Dict[str, object]:
+    if mypy_version > '0.720':
+        # mypy 0.730 added is_tty and terminal_width
+        return server.cmd_check(targets, False, 80)
+    return server.cmd_check(targets)
+
+def check_targets(session) -> List[str]:
+    targets = cast(List[str], session.settings.get('targets')) or ['.']
+    return [os.path.join(session.root_path, target) for target in targets]
+
+def activity(workspace, config):
+    """Record that a client sent a message, waking mypy up in the background if it's hibernating.
+
+    Called on the thread reading messages, so it must not wait for mypy.
+    """
+    session = workspace.session
+    if session is None:
+        return
+    session.last_activity = time.monotonic()
+    if session.hibernated and not session._checking:
+        log.info('Message received while hibernating, rehydrating mypy.')
+        thread = threading.Thread(target=mypy_check, args=(workspace, config), name='mypyls-rehydrate')
+        thread.daemon = True
+        thread.start()
+
+def rehydrate(session) -> None:
+    """Recreate the daemon from the cache written when it hibernated, and check. Called with the lock held.
+
+    The session stays hibernated until the check is done, so that requests
+    don't wait for it.
+    """
+    start = time.monotonic()
+    try:
+        start_server(session, session.python_executable, attach_to_daemon=False)
+        run_check(session)
+    finally:
+        session.hibernated = False
+    log.info(f'Rehydrated mypy from cache in {time.monotonic() - start:.1f} s, RSS {format_rss()}')
+
+def idle_timeout(session) -> Optional[float]:
+    """Return the number of idle seconds after which mypy hibernates, or None if it never does."""
+    if session.settings is None:
+        return None
+    return cast(Optional[float], session.settings.get('idleTimeout')) or None
+
+def schedule_hibernation(session, delay: Optional[float] = None) -> None:
+    timeout = idle_timeout(session)
+    if timeout is None:
+        return
+    if session._idle_timer is not None:
+        session._idle_timer.cancel()
+    timer = threading.Timer(delay if delay is not None else timeout, hibernate_if_idle, args=[session])
+    timer.daemon = True
+    timer.start()
+    session._idle_timer = timer
+
+def hibernate_if_idle(session) -> None:
+    timeout = idle_timeout(session)
+    if timeout is None or not isinstance(session.mypy_server, Server):
+        return
+    idle = time.monotonic() - session.last_activity
+    if idle < timeout:
+        schedule_hibernation(session, timeout - idle)
+        return
+    with session.lock:
+        if not isinstance(session.mypy_server, Server):
+            return
+        if time.monotonic() - session.last_activity < timeout:
+            # A client became active while we waited for a check to finish.
+            schedule_hibernation(session)
+            return
+        hibernate(session)
+
+def hibernate(session) -> None:
+    """Drop the in-memory build, keeping what's needed to rebuild it from the cache.
+
+    The daemon's build is written to the fine-grained cache first, which the
+    daemon loads with --use-fine-grained-cache when it is recreated.
+    """
+    log.info(f'Idle for {time.monotonic() - session.last_activity:.0f} s, hibernating. RSS {format_rss()}')
+    write_daemon_cache(session.mypy_server)
+    session.mypy_server = None
+    session.indexes = None
+    session.hibernated = True
+    gc.collect()
+    log.info(f'Hibernating, RSS {format_rss()}')
+
+def format_rss() -> str:
+    rss = _utils.rss_bytes()
+    return 'unknown' if rss is None else f'{rss / 2**20:.0f} MiB'
+
+def update_indexes(session):
+    fgmanager = session.mypy_server.fine_grained_manager
+    if fgmanager is None or not is_patched_mypy():
+        return
+    session.indexes.update(fgmanager)
 
-def parse_line(line):
+def watched_files_changed(workspace, config, changes):
+    """Handle workspace/didChangeWatchedFiles: recheck if sources or the mypy config changed."""
+    session = workspace.session
+    if session is None or session.settings is None:
+        return
+    config_file = session.options_snapshot.get('config_file')
+    config_file = os.path.normcase(os.path.abspath(config_file)) if config_file else None
+    recheck = reload = False
+    for change in changes:
+        path = uris.to_fs_path(change['uri'])
+        if path.endswith(PYTHON_FILE_EXTENSIONS):
+            recheck = True
+        elif (os.path.basename(path) in CONFIG_FILE_NAMES
+              or os.path.normcase(os.path.abspath(path)) == config_file):
+            reload = True
+    if reload:
+        # The config file may be new, so don't rely on the modification time of the old one.
+        with session.lock:
+            reload_config(session)
+    if recheck or reload:
+        mypy_check(workspace, config)
+
+def parse_line(line) -> Optional[Tuple[str, int, int, int, str]]:
+    """Parse a line of mypy output into (path, line, column, severity, message), with 0-based positions."""
     result = re.match(line_pattern, line)
     if result is None:
         log.info(f'Skipped unrecognized mypy line: {line}')
-        return None, None
+        return None
 
     path, lineno, offset, severity, msg = result.groups()
     lineno = int(lineno or 1)
     offset = int(offset or 1)
-
     errno = lsp.DiagnosticSeverity.Error if severity == 'error' else lsp.DiagnosticSeverity.Information
-    diag = {
-        'source': 'mypy',
-        'range': {
-            'start': {'line': lineno - 1, 'character': offset - 1},
-            # There may be a better solution, but mypy does not provide end
-            'end': {'line': lineno - 1, 'character': offset - 1}
-        },
-        'message': msg,
-        'severity': errno
-    }
-
-    return path, diag
-
-
-def parse_mypy_output(mypy_output):
-    diagnostics = defaultdict(list) # type: Dict[str, List[dict]]
+    return path, lineno - 1, offset - 1, errno, msg
+
+
+def parse_mypy_output(mypy_output, root_path) -> DiagnosticsStore:
+    diagnostics = DiagnosticsStore(root_path)
     for line in mypy_output.splitlines():
-        path, diag = parse_line(line)
-        if diag:
-            diagnostics[path].append(diag)
+        parsed = parse_line(line)
+        if parsed is not None:
+            path, lineno, offset, severity, msg = parsed
+            uri = uris.from_fs_path(os.path.join(root_path, path))
+            diagnostics.add(uri, lineno, offset, severity, msg)
 
     return diagnostics
 
 
-documents_with_diagnostics: Set[str] = set()
+def publish_diagnostics(session, mypy_output):
+    diagnostics = parse_mypy_output(mypy_output, session.root_path)
+    session.check_generation += 1
+    result_id = session.result_id(session.check_generation)
+    # Replace the store and result ids rather than updating them in place, since pull requests
+    # read them without waiting for the check to finish.
+    previous = session.diagnostics
+    result_ids = dict(session.diagnostic_result_ids)
+    for uri in diagnostics.uris():
+        if previous.entries(uri) != diagnostics.entries(uri):
+            result_ids[uri] = result_id
 
-def publish_diagnostics(workspace, mypy_output):
-    diagnostics_by_path = parse_mypy_output(mypy_output)
-    previous_documents_with_diagnostics = documents_with_diagnostics.copy()
-    documents_with_diagnostics.clear()
-    for path, diagnostics in diagnostics_by_path.items():
-        uri = uris.from_fs_path(os.path.join(workspace.root_path, path))
-        documents_with_diagnostics.add(uri)
+    documents_to_clear = set(previous.uris()) - set(diagnostics.uris())
+    for uri in documents_to_clear:
+        result_ids[uri] = result_id
+    session.diagnostics = diagnostics
+    session.diagnostic_result_ids = result_ids
+
+    for uri in diagnostics.uris():
         # TODO: If mypy is really fast, it may finish before initialization is complete,
         #       and this call will have no effect. (?)
-        workspace.publish_diagnostics(uri, diagnostics)
-
-    documents_to_clear = previous_documents_with_diagnostics - documents_with_diagnostics
+        session.publish_diagnostics(uri, diagnostics.lsp_diagnostics(uri))
     for uri in documents_to_clear:
-        workspace.publish_diagnostics(uri, [])
+        session.publish_diagnostics(uri, [])
+    session.refresh_diagnostics()
+
+def document_diagnostics(workspace, uri, previous_result_id=None):
+    """Return a diagnostic report for textDocument/diagnostic."""
+    session = workspace.session
+    if session is None:
+        return {'kind': 'full', 'items': []}
+    return document_report(session, uri, previous_result_id, session.diagnostics)
+
+def workspace_diagnostics(workspace, previous_result_ids=None):
+    """Return a report for workspace/diagnostic, covering all documents with diagnostics.
+
+    Documents the client already has results for are reported as unchanged, or
+    as cleared when their diagnostics went away.
+    """
+    session = workspace.session
+    if session is None:
+        return {'items': []}
+    diagnostics = session.diagnostics
+    previous = {item['uri']: item['value'] for item in previous_result_ids or []}
+    items = []
+    for uri in set(diagnostics.uris()) | set(previous):
+        report = document_report(session, uri, previous.get(uri), diagnostics)
+        report['uri'] = uri
+        document = workspace.documents.get(uri)
+        report['version'] = document.version if document is not None else None
+        items.append(report)
+    return {'items': items}
+
+def document_report(session, uri, previous_result_id, diagnostics: DiagnosticsStore):
+    result_id = session.diagnostic_result_id(uri)
+    if previous_result_id == result_id:
+        return {'kind': 'unchanged', 'resultId': result_id}
+    return {'kind': 'full', 'resultId': result_id, 'items': diagnostics.lsp_diagnostics(uri)}
+
+def diagnostic_summary(workspace, uri=None):
+    """Return counts of the last check's diagnostics for mypyls/diagnosticSummary.
+
+    Only files under the directory at uri are counted, if it's given.
+    """
+    session = workspace.session
+    if session is None:
+        return None
+    return session.diagnostics.summary(uris.to_fs_path(uri) if uri else None)
 
 def is_patched_mypy():
     return 'langserver' in mypy_version
\ No newline at end of file
@@ -0,0 +1,347 @@
+"""Checking independent groups of targets (shards) in parallel worker processes.
+
+Each shard is checked by its own mypy daemon in a worker process. The
+language server merges the diagnostics of all shards, and forwards requests
+about a document to the shard whose targets contain it. Each worker runs a
+headless PythonLanguageServer, so requests are handled the same way as
+without sharding.
+"""
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import traceback
+from concurrent import futures
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from . import logs, uris
+from .config import Config
+from .workspace import Document, Workspace, unanswered_request
+
+log = logging.getLogger(__name__)
+
+RE_IMPORT = re.compile(r'^\s*(?:from\s+([A-Za-z_][\w.]*)\s+import|import\s+([\w., \t]+))', re.MULTILINE)
+
+
+def configured_shards(session) -> List[List[str]]:
+    """Return the target groups from the 'shards' setting: a list of lists of targets, or 'auto'."""
+    setting = session.settings.get('shards')
+    if not setting:
+        return []
+    if setting == 'auto':
+        targets = session.settings.get('targets') or []
+        shards = detect_shards(session.root_path, targets, os.cpu_count() or 1)
+        log.info('Detected shards: %s', shards)
+        return shards
+    return [list(group) for group in setting]
+
+
+def detect_shards(root_path: str, targets: List[str], max_shards: int) -> List[List[str]]:
+    """Group targets so that no target imports a target in another group.
+
+    Groups are merged (largest first, into the group with the fewest files) to
+    have at most max_shards groups. Returns no groups if there's only one.
+    """
+    module_names = {target: top_level_module(target) for target in targets}
+    targets_by_module = {name: target for target, name in module_names.items()}
+    parent = {target: target for target in targets}
+
+    def find(target: str) -> str:
+        while parent[target] != target:
+            parent[target] = parent[parent[target]]
+            target = parent[target]
+        return target
+
+    file_counts = {} # type: Dict[str, int]
+    for target in targets:
+        imported, file_counts[target] = scan_imports(os.path.join(root_path, target))
+        for name in imported:
+            other = targets_by_module.get(name)
+            if other is not None and other != target:
+                parent[find(other)] = find(target)
+
+    components = {} # type: Dict[str, List[str]]
+    for target in targets:
+        components.setdefault(find(target), []).append(target)
+    if len(components) <= 1:
+        return []
+
+    groups = [[] for _ in range(min(max_shards, len(components)))] # type: List[List[str]]
+    sizes = [0] * len(groups)
+    by_size = sorted(components.values(), key=lambda component: -sum(file_counts[t] for t in component))
+    for component in by_size:
+        smallest = sizes.index(min(sizes))
+        groups[smallest].extend(component)
+        sizes[smallest] += sum(file_counts[target] for target in component)
+    groups = [group for group in groups if group]
+    return groups if len(groups) > 1 else []
+
+
+def top_level_module(target: str) -> str:
+    name = os.path.basename(os.path.normpath(target))
+    return os.path.splitext(name)[0]
+
+
+def scan_imports(path: str) -> Tuple[set, int]:
+    """Return the top-level modules imported by the Python files at path, and the number of files."""
+    if os.path.isfile(path):
+        files = [path]
+    else:
+        files = [os.path.join(directory, name)
+                 for directory, _, names in os.walk(path)
+                 for name in names if name.endswith(('.py', '.pyi'))]
+    imported = set()
+    for file in files:
+        try:
+            with open(file, encoding='utf-8', errors='replace') as f:
+                source = f.read()
+        except OSError:
+            continue
+        for match in RE_IMPORT.finditer(source):
+            if match.group(1):
+                imported.add(match.group(1).split('.')[0])
+            else:
+                for name in match.group(2).split(','):
+                    name = name.split()[0] if name.split() else ''
+                    imported.add(name.split('.')[0])
+    return imported, len(files)
+
+
+class Shard(object):
+    """A worker process checking one group of targets.
+
+    A worker that exits (e.g. when mypy crashes) is restarted the next time
+    the shard is used.
+    """
+
+    def __init__(self, session, targets: List[str]) -> None:
+        self.targets = targets
+        self.paths = [os.path.normcase(os.path.abspath(os.path.join(session.root_path, target)))
+                      for target in targets]
+        settings = dict(session.settings)
+        settings['targets'] = targets
+        settings.pop('shards', None)
+        # Workers are only ever woken up by the language server.
+        settings.pop('idleTimeout', None)
+        self._args = (session.root_path, settings, session.python_executable)
+        self._lock = threading.Lock()
+        self._start()
+
+    def _start(self) -> None:
+        context = multiprocessing.get_context('spawn')
+        self._connection, worker_connection = context.Pipe()
+        self.process = context.Process(
+            target=shard_main,
+            args=(worker_connection,) + self._args + (logging.root.level, logs.configured_log_levels()),
+            name=f'mypyls shard {self.targets}',
+            daemon=True)
+        self.process.start()
+        worker_connection.close()
+        self.dead = False
+
+    def running(self) -> bool:
+        return not self.dead and self.process.is_alive()
+
+    def restart(self) -> None:
+        """Replace an exited worker process. Called with the lock held."""
+        log.warning(f'Shard {self.targets} exited (exit code {self.process.exitcode}), restarting it.')
+        self._connection.close()
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=5)
+        self._start()
+
+    def contains(self, path: str) -> bool:
+        path = os.path.normcase(os.path.abspath(path))
+        return any(path == target or path.startswith(target + os.sep) for target in self.paths)
+
+    def send(self, command: str, *args: Any) -> None:
+        try:
+            self._connection.send((command, args))
+        except OSError as e:
+            self.dead = True
+            raise ShardError(f'Shard {self.targets} exited: {e}')
+
+    def receive(self) -> Any:
+        try:
+            status, value = self._connection.recv()
+        except (EOFError, OSError) as e:
+            self.dead = True
+            raise ShardError(f'Shard {self.targets} exited: {e!r}')
+        if status == 'error':
+            raise ShardError(f'Error in shard {self.targets}:\n{value}')
+        return value
+
+    def call(self, command: str, *args: Any) -> Any:
+        with self._lock:
+            if not self.running():
+                self.restart()
+                # Requests need the analysis, which a new worker only has after checking.
+                self.send('check')
+                self.receive()
+            self.send(command, *args)
+            return self.receive()
+
+    def close(self) -> None:
+        try:
+            with self._lock:
+                self.send('stop')
+        except ShardError:
+            pass
+        self.process.join(timeout=5)
+
+
+class ShardError(Exception):
+    pass
+
+
+class ShardedServer(object):
+    """Stands in for an in-process Server, checking each shard in its own worker process.
+
+    The analysis lives in the workers, so rich language features are served
+    by forwarding requests to them (see route).
+    """
+
+    fine_grained_manager = None
+    status_callback = None
+
+    def __init__(self, session, shards: List[List[str]]) -> None:
+        log.info(f'Starting {len(shards)} shard workers')
+        self.shards = [Shard(session, targets) for targets in shards]
+
+    def cmd_check(self, files, is_tty=False, terminal_width=80):
+        # Each shard checks its own targets. Start them all before waiting for any.
+        for shard in self.shards:
+            shard._lock.acquire()
+        try:
+            checking = []
+            errors = []
+            for shard in self.shards:
+                try:
+                    if not shard.running():
+                        shard.restart()
+                    shard.send('check')
+                    checking.append(shard)
+                except ShardError as e:
+                    errors.append(str(e))
+            results = []
+            for shard in checking:
+                try:
+                    results.append(shard.receive())
+                except ShardError as e:
+                    errors.append(str(e))
+        finally:
+            for shard in self.shards:
+                shard._lock.release()
+        return {
+            'out': ''.join(result['out'] for result in results),
+            'err': ''.join([result['err'] for result in results] + errors),
+            'status': 2 if errors else max([result['status'] for result in results] or [0]),
+        }
+
+    def shard_for(self, path: str) -> Optional[Shard]:
+        for shard in self.shards:
+            if shard.contains(path):
+                return shard
+        return None
+
+    def route(self, workspace, method: str, params: Dict[str, Any]) -> Any:
+        """Handle a request in the worker owning its document or item, or in all workers if it has neither."""
+        text_document = params.get('textDocument')
+        item = params.get('item')
+        if text_document is None and item is None:
+            results = [shard.call('request', method, None, params) for shard in self.shards]
+            return unique(value for result in results if result for value in result)
+
+        document = None # type: Optional[Document]
+        if item is not None:
+            # Type and call hierarchy items are handled by the worker that checks their file.
+            path = uris.to_fs_path(item['uri'])
+        else:
+            uri = params['textDocument']['uri']
+            document = workspace.get_document(uri)
+            path = uris.to_fs_path(uri)
+        shard = self.shard_for(path)
+        if shard is None:
+            log.info(f'No shard checks {path}')
+            return None
+        if document is None:
+            return shard.call('request', method, None, params)
+        return shard.call('request', method, (document.uri, document.source, document.version), params)
+
+    def close(self) -> None:
+        for shard in self.shards:
+            shard.close()
+
+
+def unique(items: Iterable[Any]) -> List[Any]:
+    """Drop repeated results, e.g. symbols of a module that several shards import."""
+    seen = set()
+    result = []
+    for item in items:
+        key = json.dumps(item, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            result.append(item)
+    return result
+
+
+class NullEndpoint(object):
+    """Stands in for the JSON RPC endpoint in workers, which have no client."""
+
+    def notify(self, method: str, params=None) -> None:
+        if method == Workspace.M_SHOW_MESSAGE:
+            log.warning(params['message'])
+
+    def request(self, method: str, params=None) -> futures.Future:
+        log.debug(f'Not sending {method} request from a shard worker')
+        return unanswered_request(method)
+
+
+def shard_main(connection, root_path: str, settings: Dict[str, Any], python_executable: Optional[str],
+               log_level: int, log_levels: Dict[str, int]) -> None:
+    """Entry point of worker processes."""
+    from . import mypy_server
+    from .python_ls import PythonLanguageServer
+    logs.start_worker_logging(log_level, log_levels)
+
+    root_uri = uris.from_fs_path(root_path)
+    language_server = PythonLanguageServer(io.BytesIO(), open(os.devnull, 'wb'))
+    language_server.workspace = workspace = Workspace(root_uri, NullEndpoint())
+    language_server.config = Config(root_uri, {}, None, {})
+    session = mypy_server.attach_session(workspace)
+    session.settings = settings
+    mypy_server.start_server(session, python_executable, attach_to_daemon=False)
+
+    while True:
+        try:
+            command, args = connection.recv()
+        except EOFError:
+            # The language server exited.
+            return
+        if command == 'stop':
+            return
+        try:
+            if command == 'check':
+                with session.lock:
+                    result = mypy_server.cmd_check(session.mypy_server, mypy_server.check_targets(session))
+                    mypy_server.update_indexes(session)
+            elif command == 'request':
+                method, document, params = args
+                if document is not None:
+                    uri, source, version = document
+                    workspace.put_document(uri, source, version=version)
+                try:
+                    result = getattr(language_server, method)(**params)
+                finally:
+                    if document is not None:
+                        workspace.rm_document(uri)
+            else:
+                raise ValueError(f'Unknown command: {command}')
+        except BaseException:
+            connection.send(('error', traceback.format_exc()))
+        else:
+            connection.send(('ok', result))
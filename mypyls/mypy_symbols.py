@@ -0,0 +1,173 @@
+import heapq
+import logging
+from collections import defaultdict, namedtuple
+from mypy.nodes import (
+    MypyFile, Node, SymbolTable, SymbolNode, TypeInfo, FuncBase, Decorator, Var, TypeVarExpr,
+    implicit_module_attrs
+)
+from typing import Dict, List, Optional, Set, Tuple
+
+from . import lsp, uris
+from .mypy_index import ModuleIndex
+
+log = logging.getLogger(__name__)
+
+MAX_RESULTS = 100
+
+Symbol = namedtuple('Symbol', ['name', 'fullname', 'kind', 'path', 'line', 'column', 'container'])
+
+
+def workspace_symbols(workspace, query):
+    if workspace.indexes is None:
+        return []
+    symbols = workspace.indexes.symbols.search(query or '')
+    return [symbol_information(symbol) for symbol in symbols]
+
+
+def symbol_information(symbol: Symbol) -> dict:
+    position = {'line': symbol.line - 1, 'character': symbol.column}
+    return {
+        'name': symbol.name,
+        'kind': symbol.kind,
+        'location': {
+            'uri': uris.from_fs_path(symbol.path),
+            'range': {'start': position, 'end': position}
+        },
+        'containerName': symbol.container
+    }
+
+
+class SymbolIndex(ModuleIndex):
+    """Trigram index over the fully qualified names of all analyzed definitions.
+
+    Queries of one or two characters are answered from a prefix index on the short name.
+    """
+
+    def __init__(self) -> None:
+        self._symbols = {} # type: Dict[str, List[Symbol]]
+        self._trigrams = defaultdict(set) # type: Dict[str, Set[Symbol]]
+        self._prefixes = defaultdict(set) # type: Dict[str, Set[Symbol]]
+
+    def update_module(self, module_id: str, state, manager) -> None:
+        self.remove_module(module_id)
+        if state.path is None:
+            return
+        symbols = module_symbols(module_id, state.tree, state.path)
+        self._symbols[module_id] = symbols
+        for symbol in symbols:
+            for key_index, key in self._keys(symbol):
+                key_index[key].add(symbol)
+
+    def remove_module(self, module_id: str) -> None:
+        for symbol in self._symbols.pop(module_id, []):
+            for key_index, key in self._keys(symbol):
+                entries = key_index.get(key)
+                if entries is not None:
+                    entries.discard(symbol)
+                    if not entries:
+                        del key_index[key]
+
+    def _keys(self, symbol: Symbol):
+        name = symbol.name.lower()
+        yield self._prefixes, name[:1]
+        if len(name) > 1:
+            yield self._prefixes, name[:2]
+        for trigram in trigrams(symbol.fullname.lower()):
+            yield self._trigrams, trigram
+
+    def search(self, query: str, limit: int = MAX_RESULTS) -> List[Symbol]:
+        query = query.lower()
+        if not query:
+            return []
+
+        if len(query) < 3:
+            candidates = self._prefixes.get(query, set()) # type: Set[Symbol]
+        else:
+            postings = []
+            for trigram in trigrams(query):
+                entries = self._trigrams.get(trigram)
+                if not entries:
+                    return []
+                postings.append(entries)
+            postings.sort(key=len)
+            candidates = postings[0].intersection(*postings[1:])
+
+        def rank(symbol: Symbol) -> Tuple[int, int, str]:
+            name = symbol.name.lower()
+            if name == query:
+                match = 0
+            elif name.startswith(query):
+                match = 1
+            elif query in name:
+                match = 2
+            elif query in symbol.fullname.lower():
+                match = 3
+            else:
+                # Trigram false positive.
+                match = 4
+            return match, len(symbol.name), symbol.fullname
+
+        results = heapq.nsmallest(limit, candidates, key=rank)
+        return [symbol for symbol in results if rank(symbol)[0] < 4]
+
+
+def trigrams(text: str):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def module_symbols(module_id: str, tree: MypyFile, path: str) -> List[Symbol]:
+    name = module_id.rsplit('.', 1)[-1]
+    symbols = [Symbol(name, module_id, lsp.SymbolKind.Module, path, 1, 0, '')]
+    collect_symbols(tree.names, module_id, None, path, symbols)
+    return symbols
+
+
+def collect_symbols(names: SymbolTable, prefix: str, info: Optional[TypeInfo], path: str,
+                    symbols: List[Symbol]) -> None:
+    for name, stnode in names.items():
+        node = stnode.node
+        if node is None or (info is None and name in implicit_module_attrs):
+            continue
+        fullname = node.fullname()
+        if fullname != f'{prefix}.{name}':
+            # Imported or aliased from elsewhere.
+            continue
+        kind = symbol_kind(node, info)
+        if kind is None:
+            continue
+        line, column = definition_location(node)
+        symbols.append(Symbol(name, fullname, kind, path, line, column, prefix))
+        if isinstance(node, TypeInfo):
+            collect_symbols(node.names, fullname, node, path, symbols)
+
+
+def symbol_kind(node: SymbolNode, info: Optional[TypeInfo]) -> Optional[int]:
+    if isinstance(node, TypeInfo):
+        if node.is_enum:
+            return lsp.SymbolKind.Enum
+        if node.is_protocol:
+            return lsp.SymbolKind.Interface
+        return lsp.SymbolKind.Class
+    if isinstance(node, Decorator) and node.var.is_property:
+        return lsp.SymbolKind.Property
+    if isinstance(node, (FuncBase, Decorator)):
+        if info is None:
+            return lsp.SymbolKind.Function
+        return lsp.SymbolKind.Constructor if node.name() == '__init__' else lsp.SymbolKind.Method
+    if isinstance(node, Var):
+        if info is not None:
+            return lsp.SymbolKind.EnumMember if info.is_enum else lsp.SymbolKind.Field
+        return lsp.SymbolKind.Constant if node.name().isupper() else lsp.SymbolKind.Variable
+    if isinstance(node, TypeVarExpr):
+        return lsp.SymbolKind.TypeParameter
+    return None
+
+
+def definition_location(node: SymbolNode) -> Tuple[int, int]:
+    """Return the (1-based line, 0-based column) where a symbol is defined."""
+    location = node # type: Node
+    if isinstance(node, TypeInfo):
+        location = node.defn
+    elif isinstance(node, Decorator):
+        location = node.func
+    return max(location.line, 1), max(location.column, 0)
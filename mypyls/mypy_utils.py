@@ -1,15 +1,18 @@
+import abc
+import bisect
 import functools
+import sys
 from mypy.util import short_type
 from mypy.nodes import (
     ARG_POS, ARG_STAR, ARG_NAMED, ARG_STAR2, ARG_NAMED_OPT, FuncDef, MypyFile, SymbolTable,
     SymbolNode, TypeInfo, Node, Expression, ReturnStmt, NameExpr, SymbolTableNode, Var,
-    AssignmentStmt, Context, RefExpr, FuncBase, MemberExpr
+    AssignmentStmt, Context, RefExpr, FuncBase, MemberExpr, Block, Statement
 )
 from mypy.types import (
     Type, AnyType, TypeOfAny, CallableType, UnionType, NoneTyp, Instance, is_optional,
 )
 from mypy.traverser import TraverserVisitor
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, List, Tuple
 import mypy
 
 class NameFinder(TraverserVisitor):
@@ -29,6 +32,34 @@ class NameFinder(TraverserVisitor):
 class NodeFound(Exception):
     pass
 
+
+class LineRangeVisitor(TraverserVisitor):
+    """Traverser that skips statements lying entirely outside a range of (1-based) lines."""
+
+    def __init__(self, start_line: int, end_line: int) -> None:
+        super().__init__()
+        self.start_line = start_line
+        self.end_line = end_line
+
+    def overlaps(self, stmt: Statement) -> bool:
+        if stmt.line > self.end_line:
+            return False
+        # end_line is only set on Python 3.8+.
+        return stmt.end_line is None or stmt.end_line >= self.start_line
+
+    def visit_mypy_file(self, o: MypyFile) -> None:
+        for d in o.defs:
+            if self.overlaps(d):
+                d.accept(self)
+
+    def visit_block(self, block: Block) -> None:
+        if block.is_unreachable:
+            return
+        for s in block.body:
+            if self.overlaps(s):
+                s.accept(self)
+
+
 def universal_visitor():
     def decorator(visitor):
         visit_funcs = [func for func in dir(visitor) if func.startswith('visit_')]
@@ -49,18 +80,12 @@ def universal_visitor():
     return decorator
 
 
-@universal_visitor()
-class NodeFinderByLocation(TraverserVisitor):
-    node: Optional[Context] = None
-
-    def __init__(self, line, column) -> None:
-        self.line = line
-        self.column = column
+class AnnotationVisitor(TraverserVisitor, metaclass=abc.ABCMeta):
+    """Traverser that also processes the types in annotations, which are not nodes in the AST."""
 
+    @abc.abstractmethod
     def process_node(self, node: Context):
-        if node_contains_offset(node, self.line, self.column):
-            self.node = node
-            raise NodeFound()
+        pass
 
     def visit_assignment_stmt(self, o: AssignmentStmt):
         if o.type:
@@ -76,6 +101,40 @@ class NodeFinderByLocation(TraverserVisitor):
         return super().visit_func_def(o)
 
 
+@universal_visitor()
+class NodeFinderByLocation(AnnotationVisitor):
+    node: Optional[Context] = None
+
+    def __init__(self, line, column) -> None:
+        self.line = line
+        self.column = column
+
+    def process_node(self, node: Context):
+        if node_contains_offset(node, self.line, self.column):
+            self.node = node
+            raise NodeFound()
+
+
+@universal_visitor()
+class NodesFinderByLocation(AnnotationVisitor, LineRangeVisitor):
+    """Find the innermost node at each of many (1-based line, 0-based column) positions in one pass."""
+
+    def __init__(self, positions: List[Tuple[int, int]]) -> None:
+        super().__init__(min(line for line, _ in positions), max(line for line, _ in positions))
+        self.positions = sorted(set(positions))
+        self.nodes = {} # type: Dict[Tuple[int, int], Context]
+
+    def process_node(self, node: Context):
+        if node.end_line is None:
+            return
+        # Nodes are processed after their children, so the innermost node is found first.
+        start = bisect.bisect_left(self.positions, (node.line, -1))
+        end = bisect.bisect_right(self.positions, (node.end_line, sys.maxsize))
+        for position in self.positions[start:end]:
+            if position not in self.nodes and node_contains_offset(node, *position):
+                self.nodes[position] = node
+
+
 def get_definition(node: MemberExpr, typemap: Dict[Expression, Type]) -> Optional[Node]:
     if node.node:
         return node.node
@@ -185,12 +244,19 @@ def lookup_fully_qualified(name: str, modules: Dict[str, MypyFile],
         names = node.names
 
 
-def find_name_expr(fgmanager, path: str, line: int, column: int) -> Tuple[Optional[Context], MypyFile]:
+def find_state(fgmanager, path: str, indexes=None):
+    if indexes is not None:
+        return indexes.paths.find(fgmanager.graph, path)
     states = [t for t in fgmanager.graph.values() if t.path == path]
     if not states:
-        loaded = '\n'.join([t.path or '<None>' for t in fgmanager.graph.values()])
+        return None
+    return states[0]
+
+def find_name_expr(fgmanager, path: str, line: int, column: int, indexes=None) -> Tuple[Optional[Context], MypyFile]:
+    state = find_state(fgmanager, path, indexes)
+    if state is None:
         return None, None
-    tree = states[0].tree
+    tree = state.tree
     assert tree is not None
 
     finder = NodeFinderByLocation(line, column)
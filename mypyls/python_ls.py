@@ -1,4 +1,5 @@
 # Copyright 2017 Palantir Technologies, Inc.
+import functools
 import logging
 import socketserver
 import threading
@@ -7,9 +8,9 @@ from typing import Optional, Any
 
 from pyls_jsonrpc.dispatchers import MethodDispatcher
 from pyls_jsonrpc.endpoint import Endpoint
-from pyls_jsonrpc.streams import JsonRpcStreamReader, JsonRpcStreamWriter
+from pyls_jsonrpc.exceptions import JsonRpcException
 
-from . import lsp, _utils, uris
+from . import lsp, _utils, uris, streams
 from . import config
 from .workspace import Workspace
 
@@ -18,8 +19,6 @@ log = logging.getLogger(__name__)
 
 PARENT_PROCESS_WATCH_INTERVAL = 10  # 10 s
 MAX_WORKERS = 64
-PYTHON_FILE_EXTENSIONS = ('.py', '.pyi')
-CONFIG_FILEs = ('pycodestyle.cfg', 'setup.cfg', 'tox.ini', '.flake8')
 
 
 class _StreamHandlerWrapper(socketserver.StreamRequestHandler, object):
@@ -30,13 +29,20 @@ class _StreamHandlerWrapper(socketserver.StreamRequestHandler, object):
     def setup(self):
         super(_StreamHandlerWrapper, self).setup()
         # pylint: disable=no-member
-        self.delegate = self.DELEGATE_CLASS(self.rfile, self.wfile)
+        self.delegate = self.DELEGATE_CLASS(self.rfile, self.wfile, json_codec=self.JSON_CODEC)
 
     def handle(self):
         self.delegate.start()
+        # The client disconnected, possibly without sending exit (m_exit does nothing if it did).
+        self.delegate.m_exit()
 
 
-def start_tcp_lang_server(bind_addr, port, handler_class):
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def start_tcp_lang_server(bind_addr, port, handler_class, json_codec=None):
     if not issubclass(handler_class, PythonLanguageServer):
         raise ValueError('Handler class must be an instance of PythonLanguageServer')
 
@@ -44,11 +50,11 @@ def start_tcp_lang_server(bind_addr, port, handler_class):
     wrapper_class = type(
         handler_class.__name__ + 'Handler',
         (_StreamHandlerWrapper,),
-        {'DELEGATE_CLASS': handler_class}
+        {'DELEGATE_CLASS': handler_class, 'JSON_CODEC': json_codec}
     )
 
-    server = socketserver.TCPServer((bind_addr, port), wrapper_class)
-    server.allow_reuse_address = True
+    # Serve each client on its own thread. Clients of the same root share one mypy daemon.
+    server = _ThreadingTCPServer((bind_addr, port), wrapper_class)
 
     try:
         log.info('Serving %s on (%s, %s)', handler_class.__name__, bind_addr, port)
@@ -58,7 +64,7 @@ def start_tcp_lang_server(bind_addr, port, handler_class):
         server.server_close()
 
 
-def start_io_lang_server(rfile, wfile, check_parent_process, handler_class):
+def start_io_lang_server(rfile, wfile, check_parent_process, handler_class, json_codec=None):
     if not issubclass(handler_class, PythonLanguageServer):
         raise ValueError('Handler class must be an instance of PythonLanguageServer')
     log.info('Starting %s IO language server', handler_class.__name__)
@@ -72,10 +78,47 @@ def start_io_lang_server(rfile, wfile, check_parent_process, handler_class):
     # ptvsd.wait_for_attach()
     # log.info("Debugger attached, starting...")
 
-    server = handler_class(rfile, wfile, check_parent_process)
+    server = handler_class(rfile, wfile, check_parent_process, json_codec)
     server.start()
 
 
+class ContentModified(JsonRpcException):
+    CODE = -32801
+    MESSAGE = 'Content Modified'
+
+
+def _with_analysis_lock(method):
+    """Hold the root's analysis lock while handling a request, since other clients may be checking.
+
+    While mypy hibernates, the request fails with ContentModified, so that the
+    client retries it once mypy has been rehydrated in the background.
+    """
+    @functools.wraps(method)
+    def wrapped(self, *args, **kwargs):
+        session = self.workspace.session if self.workspace else None
+        if session is None:
+            return method(self, *args, **kwargs)
+        if session.hibernated:
+            raise ContentModified()
+        with session.priority_lock():
+            if session.hibernated:
+                raise ContentModified()
+            return method(self, *args, **kwargs)
+    return wrapped
+
+
+def _routed_to_shard(method):
+    """Forward the request to the worker process that checks its document, when checking is sharded."""
+    @functools.wraps(method)
+    def wrapped(self, **kwargs):
+        from . import mypy_shards
+        server = self.workspace.mypy_server if self.workspace else None
+        if isinstance(server, mypy_shards.ShardedServer):
+            return server.route(self.workspace, method.__name__, kwargs)
+        return method(self, **kwargs)
+    return wrapped
+
+
 class PythonLanguageServer(MethodDispatcher):
     """ Implementation of the Microsoft VSCode Language Server Protocol
     https://github.com/Microsoft/language-server-protocol/blob/master/versions/protocol-1-x.md
@@ -83,15 +126,17 @@ class PythonLanguageServer(MethodDispatcher):
 
     # pylint: disable=too-many-public-methods,redefined-builtin
 
-    def __init__(self, rx, tx, check_parent_process=False):
+    def __init__(self, rx, tx, check_parent_process=False, json_codec=None):
         self.workspace = None
         self.config = None
 
-        self._jsonrpc_stream_reader = JsonRpcStreamReader(rx)
-        self._jsonrpc_stream_writer = JsonRpcStreamWriter(tx)
+        codec = streams.get_codec(json_codec)
+        self._jsonrpc_stream_reader = streams.JsonRpcStreamReader(rx, codec)
+        self._jsonrpc_stream_writer = streams.JsonRpcStreamWriter(tx, codec)
         self._check_parent_process = check_parent_process
         self._endpoint = Endpoint(self, self._jsonrpc_stream_writer.write, max_workers=MAX_WORKERS)
         self._shutdown = False
+        self._exited = False
 
     def start(self):
         """Entry point for the server."""
@@ -104,6 +149,10 @@ class PythonLanguageServer(MethodDispatcher):
             log.debug("Ignoring non-exit method during shutdown: %s", item)
             raise KeyError
 
+        if self.workspace is not None and item not in ('exit', 'shutdown') and not item.startswith('$/'):
+            from . import mypy_server
+            mypy_server.activity(self.workspace, self.config)
+
         return super(PythonLanguageServer, self).__getitem__(item)
 
     def m_shutdown(self, **_kwargs):
@@ -111,12 +160,18 @@ class PythonLanguageServer(MethodDispatcher):
         return None
 
     def m_exit(self, **_kwargs):
+        if self._exited:
+            return
+        self._exited = True
+        if self.workspace is not None and self.workspace.session is not None:
+            from . import mypy_server
+            mypy_server.detach_session(self.workspace)
         self._endpoint.shutdown()
         self._jsonrpc_stream_reader.close()
         self._jsonrpc_stream_writer.close()
 
     def capabilities(self):
-        from . import mypy_server
+        from . import mypy_server, mypy_semantic_tokens
         is_patched_mypy = mypy_server.is_patched_mypy()
         if not is_patched_mypy:
             log.info('Using non-patched mypy, rich language features not available.')
@@ -128,8 +183,21 @@ class PythonLanguageServer(MethodDispatcher):
         server_capabilities = {
             'definitionProvider': rich_analysis_available,
             'hoverProvider': rich_analysis_available,
+            'workspaceSymbolProvider': rich_analysis_available,
+            'referencesProvider': rich_analysis_available,
+            'implementationProvider': rich_analysis_available,
+            'typeHierarchyProvider': rich_analysis_available,
+            'callHierarchyProvider': rich_analysis_available,
+            'inlayHintProvider': rich_analysis_available,
+            'diagnosticProvider': {'interFileDependencies': True, 'workspaceDiagnostics': True},
             'textDocumentSync': lsp.TextDocumentSyncKind.INCREMENTAL
         }
+        if rich_analysis_available:
+            server_capabilities['completionProvider'] = {'triggerCharacters': ['.']}
+            server_capabilities['semanticTokensProvider'] = {
+                'legend': mypy_semantic_tokens.LEGEND,
+                'full': {'delta': True}
+            }
         log.info('Server capabilities: %s', server_capabilities)
         return server_capabilities
 
@@ -138,7 +206,7 @@ class PythonLanguageServer(MethodDispatcher):
         if rootUri is None:
             rootUri = uris.from_fs_path(rootPath) if rootPath is not None else ''
 
-        self.workspace = Workspace(rootUri, self._endpoint)
+        self.workspace = Workspace(rootUri, self._endpoint, _kwargs.get('capabilities', {}))
         self.config = config.Config(rootUri, initializationOptions or {},
                                     processId, _kwargs.get('capabilities', {}))
 
@@ -189,6 +257,8 @@ class PythonLanguageServer(MethodDispatcher):
         from . import mypy_server
         mypy_server.mypy_check(self.workspace, self.config)
 
+    @_with_analysis_lock
+    @_routed_to_shard
     def m_text_document__definition(self, textDocument=None, position=None, **_kwargs):
         from . import mypy_definition
         return mypy_definition.get_definitions(
@@ -197,32 +267,122 @@ class PythonLanguageServer(MethodDispatcher):
             self.get_document(textDocument['uri']),
             position)
 
+    @_with_analysis_lock
+    @_routed_to_shard
     def m_text_document__hover(self, textDocument=None, position=None, **_kwargs):
         from . import mypy_hover
         return mypy_hover.hover(self.workspace, self.get_document(textDocument['uri']), position)
 
+    @_with_analysis_lock
+    @_routed_to_shard
+    def m_text_document__completion(self, textDocument=None, position=None, **_kwargs):
+        from . import mypy_completion
+        return mypy_completion.completions(self.workspace, self.get_document(textDocument['uri']), position)
+
+    @_with_analysis_lock
+    @_routed_to_shard
+    def m_text_document__inlay_hint(self, textDocument=None, range=None, **_kwargs):
+        from . import mypy_inlay_hints
+        return mypy_inlay_hints.inlay_hints(self.workspace, self.get_document(textDocument['uri']), range)
+
+    @_with_analysis_lock
+    @_routed_to_shard
+    def m_text_document__semantic_tokens__full(self, textDocument=None, **_kwargs):
+        from . import mypy_semantic_tokens
+        return mypy_semantic_tokens.semantic_tokens_full(self.workspace, self.get_document(textDocument['uri']))
+
+    @_with_analysis_lock
+    @_routed_to_shard
+    def m_text_document__semantic_tokens__full__delta(self, textDocument=None, previousResultId=None, **_kwargs):
+        from . import mypy_semantic_tokens
+        return mypy_semantic_tokens.semantic_tokens_delta(
+            self.workspace, self.get_document(textDocument['uri']), previousResultId)
+
+    @_with_analysis_lock
+    @_routed_to_shard
+    def m_text_document__references(self, textDocument=None, position=None, context=None, **_kwargs):
+        from . import mypy_references
+        return mypy_references.references(
+            self.workspace,
+            self.get_document(textDocument['uri']),
+            position,
+            (context or {}).get('includeDeclaration', True))
+
+    @_with_analysis_lock
+    @_routed_to_shard
+    def m_text_document__implementation(self, textDocument=None, position=None, **_kwargs):
+        from . import mypy_hierarchy
+        return mypy_hierarchy.implementations(self.workspace, self.get_document(textDocument['uri']), position)
+
+    @_with_analysis_lock
+    @_routed_to_shard
+    def m_text_document__prepare_type_hierarchy(self, textDocument=None, position=None, **_kwargs):
+        from . import mypy_hierarchy
+        return mypy_hierarchy.prepare_type_hierarchy(
+            self.workspace, self.get_document(textDocument['uri']), position)
+
+    @_with_analysis_lock
+    @_routed_to_shard
+    def m_type_hierarchy__supertypes(self, item=None, **_kwargs):
+        from . import mypy_hierarchy
+        return mypy_hierarchy.supertypes(self.workspace, item)
+
+    @_with_analysis_lock
+    @_routed_to_shard
+    def m_type_hierarchy__subtypes(self, item=None, **_kwargs):
+        from . import mypy_hierarchy
+        return mypy_hierarchy.subtypes(self.workspace, item)
+
+    @_with_analysis_lock
+    @_routed_to_shard
+    def m_text_document__prepare_call_hierarchy(self, textDocument=None, position=None, **_kwargs):
+        from . import mypy_calls
+        return mypy_calls.prepare_call_hierarchy(self.workspace, self.get_document(textDocument['uri']), position)
+
+    @_with_analysis_lock
+    @_routed_to_shard
+    def m_call_hierarchy__incoming_calls(self, item=None, **_kwargs):
+        from . import mypy_calls
+        return mypy_calls.incoming_calls(self.workspace, item)
+
+    @_with_analysis_lock
+    @_routed_to_shard
+    def m_call_hierarchy__outgoing_calls(self, item=None, **_kwargs):
+        from . import mypy_calls
+        return mypy_calls.outgoing_calls(self.workspace, item)
+
+    @_with_analysis_lock
+    @_routed_to_shard
+    def m_mypyls__types_at_positions(self, textDocument=None, positions=None, range=None, **_kwargs):
+        from . import mypy_hover
+        return mypy_hover.types_at_positions(
+            self.workspace, self.get_document(textDocument['uri']), positions, range)
+
+    def m_text_document__diagnostic(self, textDocument=None, previousResultId=None, **_kwargs):
+        from . import mypy_server
+        self.workspace.diagnostics_pulled(textDocument['uri'])
+        return mypy_server.document_diagnostics(self.workspace, textDocument['uri'], previousResultId)
+
+    def m_workspace__diagnostic(self, previousResultIds=None, **_kwargs):
+        from . import mypy_server
+        self.workspace.diagnostics_pulled()
+        return mypy_server.workspace_diagnostics(self.workspace, previousResultIds)
+
+    def m_mypyls__diagnostic_summary(self, uri=None, **_kwargs):
+        from . import mypy_server
+        return mypy_server.diagnostic_summary(self.workspace, uri)
+
+    @_with_analysis_lock
+    @_routed_to_shard
+    def m_workspace__symbol(self, query=None, **_kwargs):
+        from . import mypy_symbols
+        return mypy_symbols.workspace_symbols(self.workspace, query)
+
     def m_workspace__did_change_configuration(self, settings=None):
         from . import mypy_server
         self.config.update((settings or {}).get('mypy', {}))
         mypy_server.configuration_changed(self.config, self.workspace)
 
-    # def TODO_m_workspace__did_change_watched_files(self, changes=None, **_kwargs):
-    #     changed_py_files = set()
-    #     config_changed = False
-    #     for d in (changes or []):
-    #         if d['uri'].endswith(PYTHON_FILE_EXTENSIONS):
-    #             changed_py_files.add(d['uri'])
-    #         elif d['uri'].endswith(CONFIG_FILEs):
-    #             config_changed = True
-    #
-    #     if config_changed:
-    #         self.config.settings.cache_clear()
-    #     elif not changed_py_files:
-    #         # Only externally changed python files and lint configs may result in changed diagnostics.
-    #         return
-    #
-    #     for doc_uri in self.workspace.documents:
-    #         # Changes in doc_uri are already handled by m_text_document__did_save
-    #         if doc_uri not in changed_py_files:
-    #             # self.lint(doc_uri, is_saved=False)
-    #             pass
+    def m_workspace__did_change_watched_files(self, changes=None, **_kwargs):
+        from . import mypy_server
+        mypy_server.watched_files_changed(self.workspace, self.config, changes or [])
@@ -0,0 +1,304 @@
+"""A machine-wide cache of analyzed library modules (typeshed, site-packages), shared by all workspaces.
+
+Entries are mypy cache files (meta, data and fine-grained dependencies) of
+modules outside the workspace, addressed by a hash of the module's source,
+its name, the mypy version and the options that affect the cache, and then
+by a hash of the sources of the modules it depends on, whose interfaces the
+data reflects. Batch builds (see mypy_server.BatchServer) publish the
+library modules they analyzed. Before a build, the entries matching the
+installed libraries are copied into the workspace's own cache, and recorded
+in its fine-grained dependencies metadata, so mypy loads them instead of
+analyzing them again.
+
+Entries are immutable once written. Writers create them in a temporary
+directory and rename it into place, so concurrent writers and readers in
+other processes never see partial entries.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+from mypy.build import DEPS_META_FILE, _cache_dir_prefix, get_cache_names
+from mypy.options import Options
+from mypy.version import __version__ as mypy_version
+
+log = logging.getLogger(__name__)
+
+
+def cache_root() -> str:
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'mypyls', mypy_version)
+
+
+def environment_key(options: Options) -> str:
+    """Identify the Python environment, whose library modules are listed in one manifest."""
+    environment = [options.python_executable, list(options.python_version), options.platform]
+    return hashlib.sha256(json.dumps(environment).encode('utf-8')).hexdigest()[:16]
+
+
+def entry_key(module_id: str, source: bytes, options: Options) -> str:
+    module_options = options.clone_for_module(module_id).select_options_affecting_cache()
+    key = hashlib.sha256()
+    key.update(json.dumps([mypy_version, module_id, module_options], sort_keys=True, default=str).encode('utf-8'))
+    key.update(source)
+    return key.hexdigest()
+
+
+def dependencies_key(dependencies: Dict[str, str]) -> str:
+    """Hash the source hashes of a module's dependencies, by module id."""
+    return hashlib.sha256(json.dumps(dependencies, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def source_hash(source: bytes) -> str:
+    return hashlib.sha256(source).hexdigest()
+
+
+def entry_dir(key: str, dependencies: Optional[str] = None) -> str:
+    """Return the directory of a module's entries, or of its entry for some dependency sources."""
+    directory = os.path.join(cache_root(), 'modules', key[:2], key)
+    return os.path.join(directory, dependencies) if dependencies is not None else directory
+
+
+def manifest_path(options: Options) -> str:
+    return os.path.join(cache_root(), 'manifests', environment_key(options) + '.json')
+
+
+def cache_files(module_id: str, path: str, options: Options) -> Tuple[str, str, Optional[str]]:
+    """Return the paths of a module's meta, data and fine-grained dependencies files in the workspace's cache."""
+    prefix = _cache_dir_prefix(options)
+    meta_file, data_file, deps_file = get_cache_names(module_id, path, options)
+    return (os.path.join(prefix, meta_file), os.path.join(prefix, data_file),
+            os.path.join(prefix, deps_file) if deps_file is not None else None)
+
+
+def read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_atomically(path: str, data: bytes) -> None:
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def read_source(path: str) -> Optional[bytes]:
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def is_up_to_date(meta: Optional[dict], path: str) -> bool:
+    """Whether a cache meta file describes the current version of a source file."""
+    if meta is None:
+        return False
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return meta.get('mtime') == int(st.st_mtime) and meta.get('size') == st.st_size
+
+
+class SourceHashes(object):
+    """Hashes of the sources of modules, each read at most once."""
+
+    def __init__(self, paths: Dict[str, str]) -> None:
+        self.paths = paths
+        self._hashes = {} # type: Dict[str, Optional[str]]
+
+    def get(self, module_id: str) -> Optional[str]:
+        if module_id not in self._hashes:
+            path = self.paths.get(module_id)
+            source = read_source(path) if path is not None else None
+            self._hashes[module_id] = source_hash(source) if source is not None else None
+        return self._hashes[module_id]
+
+
+def dependency_hashes(dependencies: List[str], hashes: SourceHashes) -> Optional[Dict[str, str]]:
+    """Return the source hashes of a module's dependencies, or None if some can't be read."""
+    result = {} # type: Dict[str, str]
+    for dependency in dependencies:
+        dependency_hash = hashes.get(dependency)
+        if dependency_hash is None:
+            return None
+        result[dependency] = dependency_hash
+    return result
+
+
+def merge_deps(deps: dict, other: Optional[dict]) -> dict:
+    """Merge fine-grained dependencies (trigger -> targets), as mypy does with those it loads."""
+    if not other:
+        return deps
+    merged = {trigger: set(targets) for trigger, targets in deps.items()}
+    for trigger, targets in other.items():
+        merged.setdefault(trigger, set()).update(targets)
+    return {trigger: sorted(targets) for trigger, targets in merged.items()}
+
+
+def matching_entry(module_id: str, source: bytes, options: Options, hashes: SourceHashes) -> Optional[str]:
+    """Return the entry of a module whose dependencies have the same sources as the installed ones."""
+    directory = entry_dir(entry_key(module_id, source, options))
+    try:
+        variants = os.listdir(directory)
+    except OSError:
+        return None
+    for variant in variants:
+        if variant.startswith('.'):
+            continue
+        dependencies = read_json(os.path.join(directory, variant, 'dependencies.json'))
+        if dependencies is not None and all(hashes.get(dependency) == dependency_hash
+                                            for dependency, dependency_hash in dependencies.items()):
+            return os.path.join(directory, variant)
+    return None
+
+
+def seed(options: Options) -> int:
+    """Copy shared entries for this environment's library modules into the local cache.
+
+    Returns the number of modules copied.
+    """
+    manifest = read_json(manifest_path(options)) or {}
+    hashes = SourceHashes(manifest)
+    # Source hashes and dependencies files of the copied modules, for the fine-grained dependencies metadata.
+    snapshot = {} # type: Dict[str, str]
+    deps_files = {} # type: Dict[str, str]
+    for module_id, path in manifest.items():
+        meta_file, data_file, deps_file = cache_files(module_id, path, options)
+        if is_up_to_date(read_json(meta_file), path):
+            continue
+        source = read_source(path)
+        if source is None:
+            continue
+        entry = matching_entry(module_id, source, options, hashes)
+        if entry is None:
+            continue
+        meta = read_json(os.path.join(entry, 'meta.json'))
+        data = read_source(os.path.join(entry, 'data.json'))
+        deps = read_json(os.path.join(entry, 'deps.json'))
+        if meta is None or data is None or (deps_file is not None and deps is None):
+            continue
+        try:
+            write_atomically(data_file, data)
+            # mypy rechecks modules whose data is older than their dependencies' data, so keep
+            # the data mtimes of the build that wrote the entries, which are in dependency order.
+            data_mtime = meta['data_mtime']
+            os.utime(data_file, (data_mtime, data_mtime))
+            # mypy checks that these match the files, which are new or at another path.
+            st = os.stat(path)
+            meta['path'] = path
+            meta['mtime'] = int(st.st_mtime)
+            meta['size'] = st.st_size
+            meta['data_mtime'] = int(os.path.getmtime(data_file))
+            write_atomically(meta_file, json.dumps(meta).encode('utf-8'))
+            if deps_file is not None and deps is not None:
+                # Keep the dependencies of the workspace's modules on this one.
+                deps = merge_deps(deps, read_json(deps_file))
+                write_atomically(deps_file, json.dumps(deps).encode('utf-8'))
+                deps_files[module_id] = deps_file
+            snapshot[module_id] = meta['hash']
+        except (OSError, KeyError, TypeError):
+            log.exception(f'Error copying shared cache entry for {module_id}')
+            continue
+    if snapshot and options.cache_fine_grained:
+        try:
+            update_deps_meta(options, snapshot, deps_files)
+        except (OSError, KeyError, TypeError, AttributeError):
+            log.exception('Error updating fine-grained dependencies metadata')
+    log.info(f'Copied {len(snapshot)} modules from the shared cache')
+    return len(snapshot)
+
+
+def update_deps_meta(options: Options, snapshot: Dict[str, str], deps_files: Dict[str, str]) -> None:
+    """Record copied modules in the workspace's fine-grained dependencies metadata.
+
+    mypy ignores the whole cache unless the metadata lists the current
+    source hash of every cached module it knows, and the modification time
+    of every dependencies file.
+    """
+    prefix = _cache_dir_prefix(options)
+    path = os.path.join(prefix, DEPS_META_FILE)
+    deps_meta = read_json(path) or {'snapshot': {}, 'deps_meta': {}}
+    deps_meta['snapshot'].update(snapshot)
+    for module_id, deps_file in deps_files.items():
+        deps_meta['deps_meta'][module_id] = {'path': os.path.relpath(deps_file, prefix),
+                                             'mtime': int(os.path.getmtime(deps_file))}
+    write_atomically(path, json.dumps(deps_meta).encode('utf-8'))
+
+
+def export(graph, options: Options, root_path: str) -> int:
+    """Publish the cache files of library modules (outside root_path) analyzed by a build.
+
+    Returns the number of new entries.
+    """
+    root = os.path.normcase(os.path.abspath(root_path)) + os.sep
+    library_modules = {} # type: Dict[str, str]
+    hashes = SourceHashes({module_id: state.path for module_id, state in graph.items() if state.path is not None})
+    added = 0
+    for module_id, state in graph.items():
+        path = state.path
+        if path is None or os.path.normcase(os.path.abspath(path)).startswith(root):
+            continue
+        meta_file, data_file, deps_file = cache_files(module_id, path, options)
+        meta = read_json(meta_file)
+        # Modules with errors have no cache files.
+        if meta is None or not is_up_to_date(meta, path) or not os.path.exists(data_file):
+            continue
+        if deps_file is not None and not os.path.exists(deps_file):
+            continue
+        library_modules[module_id] = path
+        source = read_source(path)
+        if source is None:
+            continue
+        dependencies = dependency_hashes(meta.get('dependencies', []), hashes)
+        if dependencies is None:
+            continue
+        entry = entry_dir(entry_key(module_id, source, options), dependencies_key(dependencies))
+        if os.path.exists(entry):
+            continue
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            temp_entry = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix='.tmp')
+            shutil.copyfile(meta_file, os.path.join(temp_entry, 'meta.json'))
+            shutil.copyfile(data_file, os.path.join(temp_entry, 'data.json'))
+            if deps_file is not None:
+                shutil.copyfile(deps_file, os.path.join(temp_entry, 'deps.json'))
+            with open(os.path.join(temp_entry, 'dependencies.json'), 'w', encoding='utf-8') as f:
+                json.dump(dependencies, f)
+            try:
+                os.rename(temp_entry, entry)
+                added += 1
+            except OSError:
+                # Another process published the same entry first.
+                shutil.rmtree(temp_entry, ignore_errors=True)
+        except OSError:
+            log.exception(f'Error publishing shared cache entry for {module_id}')
+
+    if library_modules:
+        # Entries listed by concurrent writers may be lost here, they're added back by their next build.
+        manifest = read_json(manifest_path(options)) or {}
+        manifest.update(library_modules)
+        try:
+            write_atomically(manifest_path(options), json.dumps(manifest).encode('utf-8'))
+        except OSError:
+            log.exception('Error writing shared cache manifest')
+    log.info(f'Published {added} modules to the shared cache')
+    return added
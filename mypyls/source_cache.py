@@ -0,0 +1,129 @@
+"""Cached source files with a line index, for reading lines of files that aren't open.
+
+Files are revalidated by mtime and size on every access, and the least
+recently used ones are dropped when the total size of the cached files
+exceeds a limit.
+"""
+import logging
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, overload
+
+log = logging.getLogger(__name__)
+
+MAX_FILES = 256
+MAX_CACHED_BYTES = 256 * 2**20
+
+# Line endings, as recognized by universal newlines.
+RE_LINE_END = re.compile(rb'\r\n?|\n')
+
+
+class SourceFile(object):
+    def __init__(self, path: str, stat: Tuple[int, int]) -> None:
+        # The file is read rather than memory-mapped: a mapped file that's truncated while
+        # mapped crashes the process on access on Linux, and can't be replaced on Windows.
+        self.stat = stat
+        with open(path, 'rb') as f:
+            self._data = f.read()
+        self.size = len(self._data)
+        # Offset of the start of each line, and of the end of the file.
+        self._offsets = None # type: Optional[array]
+
+    @property
+    def offsets(self) -> array:
+        if self._offsets is None:
+            offsets = array('q', [0])
+            offsets.extend(match.end() for match in RE_LINE_END.finditer(self._data))
+            if offsets[-1] != self.size:
+                offsets.append(self.size)
+            self._offsets = offsets
+        return self._offsets
+
+    def line_count(self) -> int:
+        return len(self.offsets) - 1
+
+    def line(self, index: int) -> str:
+        """Return a (0-based) line, with universal newlines like a file opened in text mode."""
+        offsets = self.offsets
+        line = self._data[offsets[index]:offsets[index + 1]]
+        if line.endswith(b'\r\n'):
+            line = line[:-2] + b'\n'
+        elif line.endswith(b'\r'):
+            line = line[:-1] + b'\n'
+        return line.decode('utf-8', errors='replace')
+
+    def text(self) -> str:
+        return ''.join(Lines(self))
+
+
+class Lines(Sequence[str]):
+    """The lines of a source file, decoded when accessed."""
+
+    def __init__(self, source_file: SourceFile) -> None:
+        self._file = source_file
+
+    def __len__(self) -> int:
+        return self._file.line_count()
+
+    @overload
+    def __getitem__(self, index: int) -> str: ...
+    @overload
+    def __getitem__(self, index: slice) -> List[str]: ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._file.line(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('line index out of range')
+        return self._file.line(index)
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self._file.line(i)
+
+
+class SourceCache(object):
+    def __init__(self, max_files: int = MAX_FILES, max_bytes: int = MAX_CACHED_BYTES) -> None:
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._files = OrderedDict() # type: OrderedDict[str, SourceFile]
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> SourceFile:
+        st = os.stat(path)
+        stat = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            source_file = self._files.get(path)
+            if source_file is not None and source_file.stat == stat:
+                self._files.move_to_end(path)
+                return source_file
+            self._remove(path)
+
+        source_file = SourceFile(path, stat)
+        with self._lock:
+            self._remove(path)
+            self._files[path] = source_file
+            self._size += source_file.size
+            while len(self._files) > 1 and (len(self._files) > self.max_files or self._size > self.max_bytes):
+                self._remove(next(iter(self._files)))
+        return source_file
+
+    def _remove(self, path: str) -> None:
+        source_file = self._files.pop(path, None)
+        if source_file is not None:
+            self._size -= source_file.size
+
+    def lines(self, path: str) -> Lines:
+        return Lines(self.get(path))
+
+    def text(self, path: str) -> str:
+        return self.get(path).text()
+
+
+source_cache = SourceCache()
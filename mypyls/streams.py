@@ -0,0 +1,229 @@
+"""JSON RPC message streams.
+
+A drop-in replacement for pyls_jsonrpc.streams that encodes messages with the
+fastest available JSON library and, with orjson, coalesces bursts of outgoing
+messages (e.g. diagnostics for many files) into few writes.
+"""
+import json
+import logging
+import queue
+import threading
+from typing import Any, Callable, List, Optional
+
+log = logging.getLogger(__name__)
+
+CODECS = ('orjson', 'ujson', 'json')
+
+
+class JsonCodec(object):
+    name = 'json'
+
+    def dumps(self, message: Any) -> bytes:
+        return json.dumps(message, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data.decode('utf-8'))
+
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+
+    def __init__(self) -> None:
+        import orjson
+        self._orjson = orjson
+
+    def dumps(self, message: Any) -> bytes:
+        try:
+            return self._orjson.dumps(message)
+        except TypeError:
+            # e.g. integers larger than 64 bits.
+            return super().dumps(message)
+
+    def loads(self, data: bytes) -> Any:
+        return self._orjson.loads(data)
+
+
+class UjsonCodec(JsonCodec):
+    name = 'ujson'
+
+    def __init__(self) -> None:
+        import ujson
+        self._ujson = ujson
+
+    def dumps(self, message: Any) -> bytes:
+        return self._ujson.dumps(message, ensure_ascii=False).encode('utf-8')
+
+    def loads(self, data: bytes) -> Any:
+        return self._ujson.loads(data)
+
+
+_CODEC_CLASSES = {'orjson': OrjsonCodec, 'ujson': UjsonCodec, 'json': JsonCodec}
+
+
+def get_codec(name: Optional[str] = None) -> JsonCodec:
+    """Return the named codec, or the fastest installed one if no name (or 'auto') is given."""
+    names = CODECS if name is None or name == 'auto' else (name,)
+    for codec_name in names:
+        try:
+            codec = _CODEC_CLASSES[codec_name]()
+        except ImportError:
+            log.info('JSON codec %s is not installed', codec_name)
+            continue
+        log.info('Using JSON codec %s', codec.name)
+        return codec
+    log.warning('JSON codec %s is not available, falling back to json', name)
+    return JsonCodec()
+
+
+def _describe(message: Any) -> str:
+    """Identify a message in logs by its method and id, rather than dumping its payload."""
+    if not isinstance(message, dict):
+        return type(message).__name__
+    return 'method={} id={}'.format(message.get('method'), message.get('id'))
+
+
+class JsonRpcStreamReader(object):
+    def __init__(self, rfile, codec: Optional[JsonCodec] = None) -> None:
+        self._rfile = rfile
+        self._codec = codec or JsonCodec()
+
+    def close(self) -> None:
+        self._rfile.close()
+
+    def listen(self, message_consumer: Callable[[Any], None]) -> None:
+        """Blocking call to listen for messages on the rfile."""
+        while not self._rfile.closed:
+            try:
+                request = self._read_message()
+            except ValueError:
+                if self._rfile.closed:
+                    return
+                log.exception('Failed to read from rfile')
+                continue
+
+            if request is None:
+                break
+
+            try:
+                message = self._codec.loads(request)
+            except ValueError:
+                log.exception('Failed to parse JSON message of %d bytes: %r...', len(request), request[:200])
+                continue
+            message_consumer(message)
+
+    def _read_message(self) -> Optional[bytes]:
+        """Return the body of the next message, or None at the end of the stream.
+
+        Raises ValueError for a message without a valid Content-Length, after
+        consuming its headers.
+        """
+        line = self._rfile.readline()
+        if not line:
+            return None
+
+        content_length = None
+        invalid_value = None
+        # Consume all header lines, only Content-Length is of interest.
+        while line and line.strip():
+            # The header may follow the body of a previous message that couldn't be read.
+            start = line.find(b'Content-Length: ')
+            if start != -1:
+                value = line[start + len(b'Content-Length: '):].strip()
+                try:
+                    content_length = int(value)
+                    invalid_value = None
+                except ValueError:
+                    content_length = None
+                    invalid_value = value
+            line = self._rfile.readline()
+
+        if not line:
+            return None
+        if invalid_value is not None:
+            raise ValueError('Invalid Content-Length header: {!r}, skipping message'.format(invalid_value))
+        if content_length is None:
+            raise ValueError('Missing Content-Length header, skipping message')
+        return self._rfile.read(content_length)
+
+
+_CLOSE = object()
+
+
+class JsonRpcStreamWriter(object):
+    """Writes messages, coalescing bursts of them when encoding is fast.
+
+    With coalescing, messages are encoded on the calling thread and queued.
+    The writer thread takes everything queued since its last write and writes
+    it at once, so a burst of notifications costs a few writes and flushes
+    instead of one each. This only pays off with orjson: with slower codecs,
+    the queue's overhead outweighs the saved writes, so by default each
+    message is written directly.
+    """
+
+    def __init__(self, wfile, codec: Optional[JsonCodec] = None, coalesce: Optional[bool] = None) -> None:
+        self._wfile = wfile
+        self._codec = codec or JsonCodec()
+        self._coalesce = self._codec.name == 'orjson' if coalesce is None else coalesce
+        self._closed = False
+        self._lock = threading.Lock()
+        self._queue = queue.Queue() # type: queue.Queue
+        self._thread = None # type: Optional[threading.Thread]
+        if self._coalesce:
+            self._thread = threading.Thread(target=self._write_loop, name='JsonRpcStreamWriter')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is None:
+            with self._lock:
+                self._wfile.close()
+            return
+        self._queue.put(_CLOSE)
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def write(self, message: Any) -> None:
+        if self._closed:
+            return
+        try:
+            body = self._codec.dumps(message)
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Failed to encode message %s', _describe(message))
+            return
+        data = b'Content-Length: %d\r\n\r\n%s' % (len(body), body)
+        if self._coalesce:
+            self._queue.put(data)
+            return
+        with self._lock:
+            if self._wfile.closed:
+                return
+            try:
+                self._wfile.write(data)
+                self._wfile.flush()
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Failed to write message to output file %s', _describe(message))
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()] # type: List[Any]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            closing = _CLOSE in batch
+            if closing:
+                batch = batch[:batch.index(_CLOSE)]
+            if batch and not self._wfile.closed:
+                try:
+                    self._wfile.write(b''.join(batch))
+                    self._wfile.flush()
+                except Exception:  # pylint: disable=broad-except
+                    log.exception('Failed to write %d messages to output file', len(batch))
+            if closing:
+                self._wfile.close()
+                return
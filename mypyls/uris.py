@@ -3,13 +3,21 @@
 
 https://github.com/Microsoft/vscode-uri/blob/e59cab84f5df6265aed18ae5f43552d3eef13bb9/lib/index.ts
 """
+import functools
 import re
+import sys
 from urllib import parse
 from . import IS_WIN
 
 RE_DRIVE_LETTER_PATH = re.compile(r'^\/[a-zA-Z]:')
 
+# Conversions are memoized since the same few thousand paths are converted
+# over and over (every diagnostic, document and request). Results are
+# interned, so all the places that hold a path or URI share one string.
+CACHE_SIZE = 16384
 
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
 def urlparse(uri):
     """Parse and decode the parts of a URI."""
     scheme, netloc, path, params, query, fragment = parse.urlparse(uri)
@@ -43,6 +51,7 @@ def urlunparse(parts):
     ))
 
 
+@functools.lru_cache(maxsize=CACHE_SIZE)
 def to_fs_path(uri):
     """Returns the filesystem path of the given URI.
 
@@ -68,15 +77,16 @@ def to_fs_path(uri):
     if IS_WIN:
         value = value.replace('/', '\\')
 
-    return value
+    return sys.intern(value)
 
 
+@functools.lru_cache(maxsize=CACHE_SIZE)
 def from_fs_path(path):
     """Returns a URI for the given filesystem path."""
     scheme = 'file'
     params, query, fragment = '', '', ''
     path, netloc = _normalize_win_path(path)
-    return urlunparse((scheme, netloc, path, params, query, fragment))
+    return sys.intern(urlunparse((scheme, netloc, path, params, query, fragment)))
 
 
 def uri_with(uri, scheme=None, netloc=None, path=None, params=None, query=None, fragment=None):
@@ -0,0 +1,100 @@
+"""Precomputing the caches of open documents after each check.
+
+The first hover, completion or semantic tokens request in a module after it
+was reprocessed would otherwise build its caches. Warm-up builds them in the
+background instead, in small steps that each hold the analysis lock briefly.
+Before each step it waits for requests and checks waiting for the lock, so
+it never delays them by more than one step, and it stops as soon as another
+check has finished, since that check schedules its own warm-up.
+"""
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from mypy.nodes import TypeInfo
+
+from . import mypy_utils
+from .mypy_hierarchy import collect_classes
+from .mypy_hover import NameCollector, describe_node
+
+log = logging.getLogger(__name__)
+
+WARM_UP_WORKERS = 2
+# Lines of a document whose types are rendered in one step.
+WARM_UP_LINES = 500
+
+_executor = None # type: Optional[ThreadPoolExecutor]
+_executor_lock = threading.Lock()
+
+
+def schedule(session) -> None:
+    """Warm up the caches of the documents open in the session's workspaces, in the background."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WARM_UP_WORKERS, thread_name_prefix='mypyls-warm-up')
+    _executor.submit(warm_up, session, session.check_generation)
+
+
+def warm_up(session, generation: int) -> None:
+    documents = {}
+    for workspace in list(session.workspaces):
+        documents.update(workspace.documents)
+    steps = 0
+    try:
+        for document in documents.values():
+            for step in document_steps(document):
+                session.wait_for_requests()
+                with session.lock:
+                    if session.check_generation != generation:
+                        log.info(f'Warm-up interrupted by a new check after {steps} steps')
+                        return
+                    fgmanager = session.mypy_server.fine_grained_manager if session.mypy_server else None
+                    if fgmanager is None or session.indexes is None:
+                        return
+                    state = mypy_utils.find_state(fgmanager, document.path, session.indexes)
+                    if state is None:
+                        break
+                    step(fgmanager, session.indexes, state, document)
+                    steps += 1
+    except Exception:
+        log.exception('Error warming up caches')
+        return
+    log.info(f'Warmed up caches of {len(documents)} open documents in {steps} steps')
+
+
+def document_steps(document) -> List[Callable]:
+    steps = [warm_semantic_tokens, warm_members] # type: List[Callable]
+    for start_line in range(1, len(document.lines) + 1, WARM_UP_LINES):
+        end_line = start_line + WARM_UP_LINES - 1
+        steps.append(functools.partial(warm_types, start_line=start_line, end_line=end_line))
+    return steps
+
+
+def warm_semantic_tokens(fgmanager, indexes, state, document) -> None:
+    # Like requests, build the tokens from the source that was checked rather than the document.
+    lines = indexes.sources.lines(state)
+    if lines is not None:
+        indexes.semantic_tokens.tokens(state, lines, fgmanager.manager.all_types)
+
+
+def warm_members(fgmanager, indexes, state, document) -> None:
+    indexes.members.members(state.tree, public_only=False)
+    classes = [] # type: List[TypeInfo]
+    collect_classes(state.tree.names, state.id, classes)
+    for info in classes:
+        indexes.members.members(info)
+
+
+def warm_types(fgmanager, indexes, state, document, start_line: int, end_line: int) -> None:
+    """Render the types shown by inlay hints and hovers in a range of (1-based) lines."""
+    render = indexes.type_strings.renderer()
+    lines = indexes.sources.lines(state)
+    if lines is not None:
+        indexes.inlay_hints.hints(state, fgmanager.manager.all_types, render, lines, start_line, end_line)
+    collector = NameCollector(start_line, end_line)
+    state.tree.accept(collector)
+    for node in collector.nodes:
+        describe_node(fgmanager, node, state.tree, node.line, node.column, document.path, render)
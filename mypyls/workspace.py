@@ -3,8 +3,14 @@ import io
 import logging
 import os
 import re
+import sys
+import threading
+import uuid
+from concurrent import futures
+from typing import Optional, Set, Tuple
 
 from . import lsp, uris, _utils
+from .source_cache import source_cache
 
 log = logging.getLogger(__name__)
 
@@ -13,20 +19,52 @@ RE_START_WORD = re.compile('[A-Za-z_0-9]*$')
 RE_END_WORD = re.compile('^[A-Za-z_0-9]*')
 
 
+class NoClientError(Exception):
+    """The error of requests sent to the client when there is none, e.g. when checking from the command line."""
+
+
+def unanswered_request(method: str) -> futures.Future:
+    """Return the future of a request that can't be sent, failed like an endpoint's future when the client errs."""
+    future = futures.Future() # type: futures.Future
+    future.set_exception(NoClientError(f'Cannot send {method} request without a client'))
+    return future
+
+
 class Workspace(object):
 
     M_PUBLISH_DIAGNOSTICS = 'textDocument/publishDiagnostics'
     M_APPLY_EDIT = 'workspace/applyEdit'
     M_SHOW_MESSAGE = 'window/showMessage'
     M_REPORT_PROGRESS = 'mypyls/reportProgress'
+    M_WORK_DONE_PROGRESS_CREATE = 'window/workDoneProgress/create'
+    M_PROGRESS = '$/progress'
     M_CONFIGURATION = 'workspace/configuration'
+    M_DIAGNOSTIC_REFRESH = 'workspace/diagnostic/refresh'
 
-    def __init__(self, root_uri, endpoint):
+    def __init__(self, root_uri, endpoint, capabilities=None):
+        capabilities = capabilities or {}
         self._root_uri = root_uri
         self._endpoint = endpoint
         self._root_uri_scheme = uris.urlparse(self._root_uri)[0]
         self._root_path = uris.to_fs_path(self._root_uri)
         self._docs = {} # type: dict
+        # Diagnostics of documents the client has pulled, or of all documents once it has pulled
+        # workspace diagnostics, are no longer pushed with publishDiagnostics. Advertising pull
+        # support doesn't mean the client will pull.
+        self._diagnostic_refresh = capabilities.get('workspace', {}).get('diagnostics', {}).get('refreshSupport', False)
+        self._diagnostics_lock = threading.Lock()
+        self._pulled_documents = set() # type: Set[str]
+        self._pulled_workspace = False
+        # Documents last published with diagnostics, which are cleared once the client pulls them.
+        self._pushed_documents = set() # type: Set[str]
+        # Clients that support work done progress are sent $/progress instead of mypyls/reportProgress.
+        self._work_done_progress = capabilities.get('window', {}).get('workDoneProgress', False)
+        self._progress_lock = threading.Lock()
+        self._progress_token = None # type: Optional[str]
+        # A token and the progress notifications held until the client has created it.
+        self._pending_progress = None # type: Optional[Tuple[str, list]]
+        # The mypy_server.Session shared by all clients of this root.
+        self.session = None
 
     @property
     def documents(self):
@@ -40,6 +78,14 @@ class Workspace(object):
     def root_uri(self):
         return self._root_uri
 
+    @property
+    def mypy_server(self):
+        return self.session.mypy_server if self.session else None
+
+    @property
+    def indexes(self):
+        return self.session.indexes if self.session else None
+
     def is_local(self):
         return (self._root_uri_scheme == '' or self._root_uri_scheme == 'file') and os.path.exists(self._root_path)
 
@@ -51,7 +97,8 @@ class Workspace(object):
         return self._docs.get(doc_uri) or self._create_document(doc_uri)
 
     def put_document(self, doc_uri, source, version=None):
-        self._docs[doc_uri] = self._create_document(doc_uri, source=source, version=version)
+        document = self._create_document(doc_uri, source=source, version=version)
+        self._docs[document.uri] = document
 
     def rm_document(self, doc_uri):
         self._docs.pop(doc_uri)
@@ -64,13 +111,101 @@ class Workspace(object):
         return self._endpoint.request(self.M_APPLY_EDIT, {'edit': edit})
 
     def publish_diagnostics(self, doc_uri, diagnostics):
-        self._endpoint.notify(self.M_PUBLISH_DIAGNOSTICS, params={'uri': doc_uri, 'diagnostics': diagnostics})
+        with self._diagnostics_lock:
+            if self._pulled_workspace or doc_uri in self._pulled_documents:
+                return
+            if diagnostics:
+                self._pushed_documents.add(doc_uri)
+            else:
+                self._pushed_documents.discard(doc_uri)
+            self._endpoint.notify(self.M_PUBLISH_DIAGNOSTICS, params={'uri': doc_uri, 'diagnostics': diagnostics})
+
+    def diagnostics_pulled(self, doc_uri=None):
+        """Stop pushing the diagnostics of a document, or of all documents if no uri is given."""
+        with self._diagnostics_lock:
+            if doc_uri is None:
+                self._pulled_workspace = True
+                cleared = self._pushed_documents
+                self._pushed_documents = set()
+            else:
+                self._pulled_documents.add(doc_uri)
+                cleared = {doc_uri} & self._pushed_documents
+                self._pushed_documents -= cleared
+            # Clients show pushed and pulled diagnostics side by side.
+            for uri in cleared:
+                self._endpoint.notify(self.M_PUBLISH_DIAGNOSTICS, params={'uri': uri, 'diagnostics': []})
+
+    def refresh_diagnostics(self):
+        if self._diagnostic_refresh and (self._pulled_workspace or self._pulled_documents):
+            self._endpoint.request(self.M_DIAGNOSTIC_REFRESH)
 
     def show_message(self, message, msg_type=lsp.MessageType.Info):
         self._endpoint.notify(self.M_SHOW_MESSAGE, params={'type': msg_type, 'message': message})
 
-    def report_progress(self, progress):
-        self._endpoint.notify(self.M_REPORT_PROGRESS, params=progress)
+    def begin_progress(self, title, message=None, percentage=None):
+        if not self._work_done_progress:
+            self._endpoint.notify(self.M_REPORT_PROGRESS, params=f'$(gear~spin) {title}')
+            return
+        token = f'mypyls-{uuid.uuid4()}'
+        value = {'kind': 'begin', 'title': title, 'cancellable': False}
+        if message is not None:
+            value['message'] = message
+        if percentage is not None:
+            value['percentage'] = percentage
+        with self._progress_lock:
+            self._progress_token = token
+            self._pending_progress = (token, [value])
+        # Don't wait for the client here, the progress is sent once it has created the token.
+        future = self._endpoint.request(self.M_WORK_DONE_PROGRESS_CREATE, {'token': token})
+        future.add_done_callback(lambda future: self._progress_created(token, future))
+
+    def report_progress(self, title, message=None, percentage=None):
+        if not self._work_done_progress:
+            self._endpoint.notify(self.M_REPORT_PROGRESS, params=f'$(gear~spin) {title} ({message})')
+            return
+        value = {'kind': 'report'}
+        if message is not None:
+            value['message'] = message
+        if percentage is not None:
+            value['percentage'] = percentage
+        self._send_progress(value)
+
+    def end_progress(self):
+        if not self._work_done_progress:
+            self._endpoint.notify(self.M_REPORT_PROGRESS, params=None)
+            return
+        self._send_progress({'kind': 'end'})
+
+    def _send_progress(self, value):
+        with self._progress_lock:
+            token = self._progress_token
+            if token is None:
+                return
+            if value['kind'] == 'end':
+                self._progress_token = None
+            if self._pending_progress is not None and self._pending_progress[0] == token:
+                # Only the latest report is worth sending once the token exists.
+                pending = self._pending_progress[1]
+                if pending[-1]['kind'] == 'report':
+                    pending.pop()
+                pending.append(value)
+                return
+            self._endpoint.notify(self.M_PROGRESS, params={'token': token, 'value': value})
+
+    def _progress_created(self, token, future):
+        with self._progress_lock:
+            if self._pending_progress is None or self._pending_progress[0] != token:
+                # Superseded by newer progress.
+                return
+            pending = self._pending_progress[1]
+            self._pending_progress = None
+            if future.exception() is not None:
+                log.info('Client did not create progress token: %s', future.exception())
+                if self._progress_token == token:
+                    self._progress_token = None
+                return
+            for value in pending:
+                self._endpoint.notify(self.M_PROGRESS, params={'token': token, 'value': value})
 
     def _create_document(self, doc_uri, source=None, version=None):
         return Document(doc_uri, source=source, version=version)
@@ -82,7 +217,7 @@ class Workspace(object):
 class Document(object):
 
     def __init__(self, uri, source=None, version=None, local=True):
-        self.uri = uri
+        self.uri = sys.intern(uri)
         self.version = version
         self.path = uris.to_fs_path(uri)
         self.filename = os.path.basename(self.path)
@@ -95,13 +230,14 @@ class Document(object):
 
     @property
     def lines(self):
-        return self.source.splitlines(True)
+        if self._source is None:
+            return source_cache.lines(self.path)
+        return self._source.splitlines(True)
 
     @property
     def source(self):
         if self._source is None:
-            with io.open(self.path, 'r', encoding='utf-8') as f:
-                return f.read()
+            return source_cache.text(self.path)
         return self._source
 
     def apply_change(self, change):
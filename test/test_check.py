@@ -0,0 +1,34 @@
+import io
+import json
+import os
+
+import pytest
+
+pytest.importorskip('mypy')
+
+from mypyls import uris  # noqa: E402
+from mypyls.check import JsonLinesEndpoint, check  # noqa: E402
+from mypyls.workspace import NoClientError  # noqa: E402
+
+
+def test_check_root_other_than_cwd(tmp_path, monkeypatch):
+    root = tmp_path / 'project'
+    root.mkdir()
+    # Only an error with the config file in root.
+    (root / 'mypy.ini').write_text('[mypy]\ndisallow_untyped_defs = True\n')
+    (root / 'module.py').write_text('def f(x):\n    return x\n')
+    monkeypatch.chdir(tmp_path)
+
+    output = io.StringIO()
+    status = check(str(root), output=output)
+
+    assert status == 1
+    assert os.getcwd() == str(tmp_path)
+    published = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [params['uri'] for params in published] == [uris.from_fs_path(str(root / 'module.py'))]
+    assert 'type annotation' in published[0]['diagnostics'][0]['message']
+
+
+def test_requests_to_the_client_fail_without_raising():
+    future = JsonLinesEndpoint(io.StringIO()).request('window/workDoneProgress/create', {'token': 'token'})
+    assert isinstance(future.exception(), NoClientError)
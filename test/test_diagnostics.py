@@ -0,0 +1,44 @@
+import os
+
+from mypyls import lsp, uris
+from mypyls.diagnostics import DiagnosticsStore
+
+
+def make_store(root):
+    store = DiagnosticsStore(root)
+    error, note = lsp.DiagnosticSeverity.Error, lsp.DiagnosticSeverity.Information
+    store.add(uris.from_fs_path(os.path.join(root, 'a.py')), 0, 0, error, 'Bad  [arg-type]')
+    store.add(uris.from_fs_path(os.path.join(root, 'a.py')), 1, 4, note, 'See this')
+    store.add(uris.from_fs_path(os.path.join(root, 'pkg', 'sub', 'b.py')), 2, 0, error, 'Worse  [arg-type]')
+    store.add(uris.from_fs_path(os.path.join(root, 'pkg', 'c.py')), 3, 0, error, 'Worst  [return-value]')
+    return store
+
+
+def test_lsp_diagnostics(tmp_path):
+    root = str(tmp_path)
+    store = make_store(root)
+    diagnostics = store.lsp_diagnostics(uris.from_fs_path(os.path.join(root, 'a.py')))
+    assert [diagnostic['message'] for diagnostic in diagnostics] == ['Bad  [arg-type]', 'See this']
+    assert diagnostics[0]['code'] == 'arg-type'
+    assert 'code' not in diagnostics[1]
+    assert diagnostics[1]['range']['start'] == {'line': 1, 'character': 4}
+
+
+def test_summary(tmp_path):
+    root = str(tmp_path)
+    summary = make_store(root).summary()
+    assert summary['total'] == {'errors': 3, 'notes': 1, 'files': 3}
+    assert summary['byCode'] == {'arg-type': 2, 'return-value': 1}
+    assert summary['byDirectory'] == {
+        '.': {'errors': 3, 'notes': 1, 'files': 3},
+        'pkg': {'errors': 2, 'notes': 0, 'files': 2},
+        'pkg/sub': {'errors': 1, 'notes': 0, 'files': 1},
+    }
+
+
+def test_summary_of_directory(tmp_path):
+    root = str(tmp_path)
+    summary = make_store(root).summary(os.path.join(root, 'pkg'))
+    assert summary['total'] == {'errors': 2, 'notes': 0, 'files': 2}
+    assert summary['byCode'] == {'arg-type': 1, 'return-value': 1}
+    assert set(summary['byDirectory']) == {'.', 'pkg', 'pkg/sub'}
@@ -0,0 +1,77 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from mypyls.mypy_index import LineMap, ModuleIndex, PathIndex, cover, uncovered
+
+
+def test_module_index_is_abstract():
+    with pytest.raises(TypeError):
+        ModuleIndex()
+
+
+def test_path_index(tmp_path):
+    path = str(tmp_path / 'package' / 'module.py')
+    state = SimpleNamespace(path=path)
+    graph = {'package.module': state}
+    index = PathIndex()
+    index.update_module('package.module', state, None)
+    assert index.find(graph, os.path.join(str(tmp_path), 'package', '..', 'package', 'module.py')) is state
+    assert index.find(graph, str(tmp_path / 'other.py')) is None
+
+    index.remove_module('package.module')
+    assert index.find(graph, path) is None
+
+
+def test_path_index_module_moved(tmp_path):
+    old_path = str(tmp_path / 'old.py')
+    new_path = str(tmp_path / 'new.py')
+    index = PathIndex()
+    index.update_module('module', SimpleNamespace(path=old_path), None)
+    state = SimpleNamespace(path=new_path)
+    index.update_module('module', state, None)
+    assert index.find({'module': state}, old_path) is None
+    assert index.find({'module': state}, new_path) is state
+
+
+def test_path_index_ignores_modules_without_path():
+    index = PathIndex()
+    index.update_module('builtins', SimpleNamespace(path=None), None)
+    index.remove_module('builtins')
+
+
+def test_line_map():
+    original = ['a\n', 'b\n', 'c\n', 'd\n']
+    edited = ['a\r\n', 'x\n', 'y\n', 'c\n', 'd\n']
+    line_map = LineMap(original, edited)
+    assert line_map.map(0) == 0
+    assert line_map.map(1) is None
+    assert line_map.map(2) is None
+    assert line_map.map(3) == 2
+    assert line_map.map(4) == 3
+    assert line_map.map_before(2) == 0
+    assert line_map.map_after(2) == 2
+    assert [line_map.unmap(line) for line in range(4)] == [0, None, 3, 4]
+
+
+@pytest.mark.parametrize('covered, start, end, expected', [
+    ([], 1, 10, [(1, 10)]),
+    ([(1, 10)], 3, 5, []),
+    ([(3, 5)], 1, 10, [(1, 2), (6, 10)]),
+    ([(1, 2), (5, 6), (20, 30)], 1, 10, [(3, 4), (7, 10)]),
+    ([(11, 20)], 1, 10, [(1, 10)]),
+])
+def test_uncovered(covered, start, end, expected):
+    assert uncovered(covered, start, end) == expected
+
+
+@pytest.mark.parametrize('covered, start, end, expected', [
+    ([], 1, 10, [(1, 10)]),
+    ([(1, 5)], 6, 10, [(1, 10)]),
+    ([(1, 5)], 7, 10, [(1, 5), (7, 10)]),
+    ([(1, 2), (5, 6), (20, 30)], 3, 4, [(1, 6), (20, 30)]),
+    ([(5, 10)], 1, 20, [(1, 20)]),
+])
+def test_cover(covered, start, end, expected):
+    assert cover(covered, start, end) == expected
@@ -0,0 +1,64 @@
+import logging
+
+import pytest
+
+from mypyls import logs
+
+
+def make_record(msg, *args):
+    return logging.LogRecord('test', logging.INFO, __file__, 1, msg, args, None)
+
+
+def test_prepare_formats_mutable_args():
+    params = {'a': 1}
+    record = logs.DeferredQueueHandler(None).prepare(make_record('params %s', params))
+    params['a'] = 2
+    assert record.getMessage() == "params {'a': 1}"
+
+
+def test_prepare_defers_immutable_args():
+    record = logs.DeferredQueueHandler(None).prepare(make_record('%s of %d', 'x', 3))
+    assert record.msg == '%s of %d'
+    assert record.getMessage() == 'x of 3'
+
+
+def test_truncating_formatter_keeps_record():
+    record = make_record('x' * 20)
+    short = logs.TruncatingFormatter('%(message)s', max_message_length=5)
+    assert short.format(record) == 'xxxxx... [15 characters truncated]'
+    assert logging.Formatter('%(message)s').format(record) == 'x' * 20
+
+
+def test_parse_log_levels():
+    assert logs.parse_log_levels('mypyls.mypy_server=debug, mypyls.streams=WARNING,') == {
+        'mypyls.mypy_server': logging.DEBUG,
+        'mypyls.streams': logging.WARNING,
+    }
+
+
+@pytest.mark.parametrize('spec', ['mypyls', '=DEBUG', 'mypyls=LOUD'])
+def test_parse_log_levels_invalid(spec):
+    with pytest.raises(ValueError):
+        logs.parse_log_levels(spec)
+
+
+def test_prepare_snapshots_mutable_args_boundedly():
+    items = list(range(100000))
+    record = logs.DeferredQueueHandler(None).prepare(make_record('items %s %r', items, items))
+    items.clear()
+    message = record.getMessage()
+    assert message.startswith('items [0, 1, 2')
+    assert len(message) < 2000
+
+
+def test_prepare_truncates_long_string_args():
+    record = make_record('output %s', 'x' * (logs.MAX_MESSAGE_LENGTH + 10))
+    prepared = logs.DeferredQueueHandler(None).prepare(record)
+    assert prepared.getMessage().endswith('... [10 characters truncated]')
+    assert len(record.args[0]) == logs.MAX_MESSAGE_LENGTH + 10
+
+
+def test_prepare_snapshots_str_and_repr():
+    error = ValueError('bad')
+    record = logs.DeferredQueueHandler(None).prepare(make_record('%s %r', error, error))
+    assert record.getMessage() == "bad ValueError('bad')"
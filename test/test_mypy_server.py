@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip('mypy')
+
+from mypyls import mypy_server  # noqa: E402
+
+
+def check(session) -> str:
+    return mypy_server.cmd_check(session.mypy_server, mypy_server.check_targets(session))['out']
+
+
+def test_reload_config_only_rechecks_modules_whose_options_changed(tmp_path, monkeypatch):
+    (tmp_path / 'mypy.ini').write_text('[mypy]\n')
+    (tmp_path / 'a.py').write_text('import b\nx = b.f()\n')
+    (tmp_path / 'b.py').write_text('def f() -> int:\n    return 1\n')
+    (tmp_path / 'c.py').write_text('def g(x):\n    return x\n')
+    monkeypatch.chdir(tmp_path)
+    session = mypy_server.Session(str(tmp_path))
+    session.settings = {'configFile': str(tmp_path / 'mypy.ini')}
+    mypy_server.create_server(session, mypy_server.load_options(session))
+    assert check(session) == ''
+
+    (tmp_path / 'mypy.ini').write_text('[mypy]\n[mypy-c]\ndisallow_untyped_defs = True\n')
+    mypy_server.reload_config(session)
+    assert 'c.py:1' in check(session)
+    assert session.mypy_server.fine_grained_manager.updated_modules == ['c']
+
+
+def test_hibernate_and_rehydrate_from_cache(tmp_path, monkeypatch):
+    (tmp_path / 'a.py').write_text('import b\nx = b.f() # type: int\n')
+    (tmp_path / 'b.py').write_text('def f() -> int:\n    return 1\n')
+    monkeypatch.chdir(tmp_path)
+    session = mypy_server.Session(str(tmp_path))
+    session.settings = {}
+    mypy_server.create_server(session, mypy_server.load_options(session))
+    assert check(session) == ''
+
+    mypy_server.hibernate(session)
+    assert session.hibernated
+    assert session.mypy_server is None
+
+    (tmp_path / 'b.py').write_text('def f() -> str:\n    return ""\n')
+    mypy_server.rehydrate(session)
+    assert not session.hibernated
+    # Loaded from the cache, then only the changed module and the module using it are reprocessed.
+    assert session.mypy_server.fine_grained_manager.updated_modules == ['b', 'a']
+    assert any(uri.endswith('a.py') for uri in session.diagnostics.uris())
+
+
+def test_expected_module_count(tmp_path, monkeypatch):
+    (tmp_path / 'a.py').write_text('import b\n')
+    (tmp_path / 'b.py').write_text('')
+    monkeypatch.chdir(tmp_path)
+    session = mypy_server.Session(str(tmp_path))
+    session.settings = {}
+    mypy_server.create_server(session, mypy_server.load_options(session))
+    targets = mypy_server.check_targets(session)
+    # Before the first check, only the targets are known.
+    assert mypy_server.expected_module_count(session, targets) == 2
+    mypy_server.run_check(session)
+    # Then the modules of the last check, including the libraries they import.
+    count = mypy_server.expected_module_count(session, targets)
+    assert count is not None and count > 2
+    assert session.module_count == count
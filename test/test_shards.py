@@ -0,0 +1,31 @@
+from mypyls.mypy_shards import detect_shards
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def test_detect_shards_groups_importing_targets(tmp_path):
+    write(tmp_path / 'a' / '__init__.py', 'import b\n')
+    write(tmp_path / 'b' / '__init__.py', '')
+    write(tmp_path / 'c' / '__init__.py', 'from os import path\n')
+    write(tmp_path / 'd.py', 'import json, c.module\n')
+    shards = detect_shards(str(tmp_path), ['a', 'b', 'c', 'd.py'], 4)
+    assert sorted(sorted(shard) for shard in shards) == [['a', 'b'], ['c', 'd.py']]
+
+
+def test_detect_shards_merges_up_to_max_shards(tmp_path):
+    targets = []
+    for i in range(4):
+        write(tmp_path / f'p{i}' / '__init__.py', '')
+        targets.append(f'p{i}')
+    shards = detect_shards(str(tmp_path), targets, 2)
+    assert len(shards) == 2
+    assert sorted(target for shard in shards for target in shard) == targets
+
+
+def test_detect_shards_single_group(tmp_path):
+    write(tmp_path / 'a.py', 'import b\n')
+    write(tmp_path / 'b.py', '')
+    assert detect_shards(str(tmp_path), ['a.py', 'b.py'], 4) == []
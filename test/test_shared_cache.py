@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+pytest.importorskip('mypy')
+
+from mypy import build  # noqa: E402
+from mypy.find_sources import create_source_list  # noqa: E402
+from mypy.options import Options  # noqa: E402
+
+from mypyls import shared_cache  # noqa: E402
+from mypyls.mypy_server import BatchServer  # noqa: E402
+
+
+def test_entry_key():
+    options = Options()
+    key = shared_cache.entry_key('module', b'x = 1\n', options)
+    assert key == shared_cache.entry_key('module', b'x = 1\n', options)
+    assert key != shared_cache.entry_key('module', b'x = 2\n', options)
+    assert key != shared_cache.entry_key('other', b'x = 1\n', options)
+    strict = Options()
+    strict.disallow_untyped_defs = True
+    assert key != shared_cache.entry_key('module', b'x = 1\n', strict)
+
+
+def test_dependencies_key():
+    key = shared_cache.dependencies_key({'a': '1', 'b': '2'})
+    assert key == shared_cache.dependencies_key({'b': '2', 'a': '1'})
+    assert key != shared_cache.dependencies_key({'a': '1', 'b': '3'})
+
+
+def project(tmp_path, name: str) -> str:
+    root = tmp_path / name
+    root.mkdir()
+    (root / 'main.py').write_text('import library\nx = library.f() # type: int\n')
+    return str(root)
+
+
+def batch_server(tmp_path, root: str) -> BatchServer:
+    options = Options()
+    options.mypy_path = [str(tmp_path / 'site-packages')]
+    options.cache_dir = os.path.join(root, '.mypy_cache')
+    return BatchServer(options, root, shared_cache=True)
+
+
+def test_seeded_library_modules_are_not_rechecked(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'shared'))
+    (tmp_path / 'site-packages').mkdir()
+    (tmp_path / 'site-packages' / 'library.py').write_text('def f() -> int:\n    return 1\n')
+    first = project(tmp_path, 'first')
+    monkeypatch.chdir(first)
+    assert batch_server(tmp_path, first).cmd_check([first])['status'] == 0
+
+    second = project(tmp_path, 'second')
+    monkeypatch.chdir(second)
+    options = batch_server(tmp_path, second).options
+    assert shared_cache.seed(options) > 0
+    for _ in range(2):
+        result = build.build(create_source_list([second], options), options)
+        assert result.errors == []
+        assert result.manager.rechecked_modules <= {'main'}
@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+from mypyls.source_cache import SourceCache
+
+
+@pytest.mark.parametrize('data', [b'', b'a\n', b'a\nb', b'a\r\nb\r\n', b'a\rb\rc', b'\r\r\n\n\r', 'é\r\nü'.encode()])
+def test_lines_like_text_mode(tmp_path, data):
+    path = tmp_path / 'module.py'
+    path.write_bytes(data)
+    with open(str(path), encoding='utf-8') as f:
+        expected = f.read()
+    cache = SourceCache()
+    assert list(cache.lines(str(path))) == expected.splitlines(True)
+    assert cache.text(str(path)) == expected
+
+
+def test_reread_when_changed(tmp_path):
+    path = tmp_path / 'module.py'
+    path.write_bytes(b'a\n')
+    cache = SourceCache()
+    assert list(cache.lines(str(path))) == ['a\n']
+    path.write_bytes(b'a\nbc\n')
+    assert list(cache.lines(str(path))) == ['a\n', 'bc\n']
+
+
+def test_least_recently_used_dropped(tmp_path):
+    cache = SourceCache(max_files=2)
+    paths = []
+    for i in range(3):
+        path = tmp_path / f'module{i}.py'
+        path.write_bytes(b'x\n')
+        paths.append(str(path))
+        cache.get(str(path))
+    assert list(cache._files) == paths[1:]
@@ -0,0 +1,68 @@
+import io
+
+from mypyls import streams
+
+
+def message_bytes(body: bytes, content_length=None) -> bytes:
+    length = len(body) if content_length is None else content_length
+    return b'Content-Length: %s\r\n\r\n%s' % (str(length).encode(), body)
+
+
+def read_all(data: bytes) -> list:
+    messages = []
+    streams.JsonRpcStreamReader(io.BytesIO(data)).listen(messages.append)
+    return messages
+
+
+def test_reader():
+    data = message_bytes(b'{"id":1}') + message_bytes(b'{"id":2}')
+    assert read_all(data) == [{'id': 1}, {'id': 2}]
+
+
+def test_reader_skips_message_without_content_length():
+    data = b'Content-Type: application/vscode-jsonrpc\r\n\r\n{"id":1}' + message_bytes(b'{"id":2}')
+    assert read_all(data) == [{'id': 2}]
+
+
+def test_reader_skips_message_with_invalid_content_length():
+    data = message_bytes(b'{"id":1}', content_length='abc') + message_bytes(b'{"id":2}')
+    assert read_all(data) == [{'id': 2}]
+
+
+def test_reader_skips_invalid_json():
+    data = message_bytes(b'{"id":') + message_bytes(b'{"id":2}')
+    assert read_all(data) == [{'id': 2}]
+
+
+class Output(io.BytesIO):
+    def close(self) -> None:
+        self.result = self.getvalue()
+        super().close()
+
+
+def write_all(messages: list, codec: streams.JsonCodec, coalesce=None) -> bytes:
+    output = Output()
+    writer = streams.JsonRpcStreamWriter(output, codec, coalesce)
+    for message in messages:
+        writer.write(message)
+    writer.close()
+    return output.result
+
+
+def test_writer_writes_each_message_without_orjson():
+    writer = streams.JsonRpcStreamWriter(Output(), streams.JsonCodec())
+    assert writer._thread is None
+    writer.close()
+
+
+def test_writer_round_trip():
+    messages = [{'id': i, 'text': 'ü' * i} for i in range(10)]
+    for coalesce in (False, True):
+        assert read_all(write_all(messages, streams.JsonCodec(), coalesce)) == messages
+
+
+def test_encode_failure_logs_method_and_id_only(caplog):
+    message = {'jsonrpc': '2.0', 'id': 7, 'method': 'textDocument/hover', 'params': {'secret': object()}}
+    write_all([message], streams.JsonCodec(), coalesce=False)
+    assert 'method=textDocument/hover id=7' in caplog.text
+    assert 'secret' not in caplog.text